@@ -5,14 +5,443 @@ Returns: HTTP response with user data or error
 '''
 
 import json
+import math
 import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
+import base64
 import hashlib
-from typing import Dict, Any
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_DEBUG = os.environ.get('DB_POOL_DEBUG', 'false') == 'true'
+
+_db_pool: List[Tuple[Any, float]] = []
+_db_pool_lock = threading.Lock()
+_db_pool_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0}
+
+def _connection_is_healthy(conn, idle_seconds: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_seconds < DB_POOL_PING_AFTER:
+        return True
+    try:
+        ping_cursor = conn.cursor()
+        ping_cursor.execute('SELECT 1')
+        ping_cursor.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def get_db_connection():
+    while True:
+        with _db_pool_lock:
+            if not _db_pool:
+                break
+            conn, released_at = _db_pool.pop()
+        if _connection_is_healthy(conn, time.monotonic() - released_at):
+            with _db_pool_lock:
+                _db_pool_stats['hits'] += 1
+            return conn
+        with _db_pool_lock:
+            _db_pool_stats['reconnects'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+    
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        raise ValueError('DATABASE_URL environment variable is not set')
+    with _db_pool_lock:
+        _db_pool_stats['misses'] += 1
+    if DB_POOL_DEBUG:
+        print(f'db pool miss: {db_pool_stats()}')
+    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        conn.close()
+        return
+    with _db_pool_lock:
+        if len(_db_pool) < DB_POOL_MAX_SIZE:
+            _db_pool.append((conn, time.monotonic()))
+            return
+        _db_pool_stats['discarded'] += 1
+    conn.close()
+
+def db_pool_stats() -> Dict[str, int]:
+    with _db_pool_lock:
+        return dict(_db_pool_stats, idle=len(_db_pool), max_size=DB_POOL_MAX_SIZE)
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps_json(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default).decode()
+    return json.dumps(payload, default=_json_default)
+
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+REVOKED_TOKENS_TTL = float(os.environ.get('REVOKED_TOKENS_TTL', '30'))
+
+_revoked_tokens: set = set()
+_revoked_tokens_lock = threading.Lock()
+_revoked_tokens_state: Dict[str, float] = {'loaded_at': float('-inf')}
+
+def _b64url_encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _b64url_decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign_auth_token(signing_input: str) -> bytes:
+    if not AUTH_TOKEN_SECRET:
+        raise ValueError('AUTH_TOKEN_SECRET environment variable is not set')
+    return hmac.new(AUTH_TOKEN_SECRET.encode(), signing_input.encode(), hashlib.sha256).digest()
+
+def decode_auth_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        header_b64, payload_b64, signature_b64 = token.split('.')
+        signature = _b64url_decode(signature_b64)
+        if not hmac.compare_digest(_sign_auth_token(f'{header_b64}.{payload_b64}'), signature):
+            return None
+        header = json.loads(_b64url_decode(header_b64))
+        claims = json.loads(_b64url_decode(payload_b64))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(header, dict) or header.get('alg') != 'HS256' or not isinstance(claims, dict):
+        return None
+    if not isinstance(claims.get('exp'), (int, float)) or claims['exp'] <= time.time():
+        return None
+    return claims
+
+def is_token_revoked(conn, jti: Any) -> bool:
+    now = time.monotonic()
+    with _revoked_tokens_lock:
+        stale = now - _revoked_tokens_state['loaded_at'] >= REVOKED_TOKENS_TTL
+    if stale:
+        cursor = conn.cursor()
+        cursor.execute('SELECT jti FROM t_p71176016_tour_booking_platfor.revoked_tokens WHERE expires_at > NOW()')
+        revoked = {row['jti'] for row in cursor.fetchall()}
+        cursor.close()
+        with _revoked_tokens_lock:
+            _revoked_tokens.clear()
+            _revoked_tokens.update(revoked)
+            _revoked_tokens_state['loaded_at'] = now
+    with _revoked_tokens_lock:
+        return jti in _revoked_tokens
+
+def authenticate(event: Dict[str, Any], conn) -> Optional[Dict[str, Any]]:
+    """Claims of a valid, unrevoked bearer token; the denylist is reloaded at most every REVOKED_TOKENS_TTL seconds."""
+    headers = event.get('headers') or {}
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    claims = decode_auth_token(token.strip())
+    if claims is None or is_token_revoked(conn, claims.get('jti')):
+        return None
+    return claims
+
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', str(7 * 24 * 3600)))
+SELF_REGISTER_ROLES = ('client', 'guide')
+
+def issue_auth_token(user: Dict[str, Any]) -> str:
+    now = int(time.time())
+    claims = {
+        'sub': user['id'],
+        'name': user['name'],
+        'email': user['email'],
+        'role': user['role'],
+        'iat': now,
+        'exp': now + AUTH_TOKEN_TTL,
+        'jti': secrets.token_hex(16)
+    }
+    header_b64 = _b64url_encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}, separators=(',', ':')).encode())
+    payload_b64 = _b64url_encode(json.dumps(claims, separators=(',', ':')).encode())
+    signature_b64 = _b64url_encode(_sign_auth_token(f'{header_b64}.{payload_b64}'))
+    return f'{header_b64}.{payload_b64}.{signature_b64}'
+
+def unauthorized_response() -> Dict[str, Any]:
+    return {
+        'statusCode': 401,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Authorization required'}),
+        'isBase64Encoded': False
+    }
+
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'scrypt' if hasattr(hashlib, 'scrypt') else 'pbkdf2_sha256')
+PASSWORD_HASH_TARGET_MS = float(os.environ.get('PASSWORD_HASH_TARGET_MS', '100'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '8'))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', '2'))
+PASSWORD_HASH_MEMORY_MB = int(os.environ.get('PASSWORD_HASH_MEMORY_MB', '64'))
+
+SCRYPT_MIN_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+def _scrypt_max_n() -> int:
+    """Largest power-of-two n whose scrypt buffers (128 * r * n bytes each) fit PASSWORD_HASH_MEMORY_MB across all workers.
+    
+    The memory budget alone sets the ceiling that calibration may climb to (2 ** 15 with the defaults);
+    PASSWORD_SCRYPT_MAX_N, when set, only lowers it further.
+    """
+    ceiling = PASSWORD_HASH_MEMORY_MB * 1024 * 1024 // (128 * SCRYPT_R * PASSWORD_HASH_WORKERS)
+    if os.environ.get('PASSWORD_SCRYPT_MAX_N'):
+        ceiling = min(ceiling, int(os.environ['PASSWORD_SCRYPT_MAX_N']))
+    n = SCRYPT_MIN_N
+    while n * 2 <= ceiling:
+        n *= 2
+    return n
+
+SCRYPT_MAX_N = _scrypt_max_n()
+PBKDF2_MIN_ITERATIONS = 210000
+PBKDF2_MAX_ITERATIONS = 2000000
+PASSWORD_SALT_BYTES = 16
+
+class PasswordHasherBusy(Exception):
+    pass
+
+def _b64encode(raw: bytes) -> str:
+    return base64.b64encode(raw).decode().rstrip('=')
+
+def _b64decode(text: str) -> bytes:
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+def _scrypt(password: str, salt: bytes, n: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=SCRYPT_R, p=SCRYPT_P,
+        maxmem=256 * SCRYPT_R * n, dklen=32
+    )
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+def _elapsed_ms(fn: Callable[[], Any]) -> float:
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+def calibrate_password_cost() -> int:
+    """Pick the largest cost whose hash stays within PASSWORD_HASH_TARGET_MS on this host."""
+    salt = secrets.token_bytes(PASSWORD_SALT_BYTES)
+    if PASSWORD_HASHER == 'scrypt':
+        n = SCRYPT_MIN_N
+        while n < SCRYPT_MAX_N and _elapsed_ms(lambda: _scrypt('calibrate', salt, n)) * 2 <= PASSWORD_HASH_TARGET_MS:
+            n *= 2
+        return n
+    
+    probe_iterations = 20000
+    probe_ms = max(_elapsed_ms(lambda: _pbkdf2('calibrate', salt, probe_iterations)), 0.001)
+    iterations = int(probe_iterations * PASSWORD_HASH_TARGET_MS / probe_ms)
+    return min(max(iterations, PBKDF2_MIN_ITERATIONS), PBKDF2_MAX_ITERATIONS)
+
+PASSWORD_HASH_COST = calibrate_password_cost()
+
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+def run_password_job(fn: Callable[..., Any], *args: Any) -> Any:
+    if not _password_slots.acquire(timeout=PASSWORD_HASH_QUEUE_TIMEOUT):
+        raise PasswordHasherBusy()
+    try:
+        return _password_pool.submit(fn, *args).result()
+    finally:
+        _password_slots.release()
+
+def _hash_password_sync(password: str) -> str:
+    salt = secrets.token_bytes(PASSWORD_SALT_BYTES)
+    if PASSWORD_HASHER == 'scrypt':
+        digest = _scrypt(password, salt, PASSWORD_HASH_COST)
+        return f'scrypt${PASSWORD_HASH_COST}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(digest)}'
+    digest = _pbkdf2(password, salt, PASSWORD_HASH_COST)
+    return f'pbkdf2_sha256${PASSWORD_HASH_COST}${_b64encode(salt)}${_b64encode(digest)}'
+
+def _verify_password_sync(password: str, stored_hash: str) -> Tuple[bool, bool]:
+    parts = stored_hash.split('$')
+    
+    if parts[0] == 'scrypt' and len(parts) == 6:
+        n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+        expected = _b64decode(parts[5])
+        digest = hashlib.scrypt(
+            password.encode(), salt=_b64decode(parts[4]), n=n, r=r, p=p,
+            maxmem=256 * r * n, dklen=len(expected)
+        )
+        outdated = PASSWORD_HASHER != 'scrypt' or n < PASSWORD_HASH_COST or n > SCRYPT_MAX_N
+        return hmac.compare_digest(digest, expected), outdated
+    
+    if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+        iterations = int(parts[1])
+        digest = _pbkdf2(password, _b64decode(parts[2]), iterations)
+        outdated = PASSWORD_HASHER != 'pbkdf2_sha256' or iterations < PASSWORD_HASH_COST
+        return hmac.compare_digest(digest, _b64decode(parts[3])), outdated
+    
+    legacy_digest = hashlib.sha256(password.encode()).hexdigest()
+    return hmac.compare_digest(legacy_digest, stored_hash), True
+
+_DUMMY_PASSWORD_HASH = _hash_password_sync(secrets.token_hex(16))
 
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    return run_password_job(_hash_password_sync, password)
+
+def verify_password(password: str, stored_hash: str) -> Tuple[bool, bool]:
+    """Returns (matches, needs_rehash); legacy unsalted SHA-256 hashes always need a rehash."""
+    return run_password_job(_verify_password_sync, password, stored_hash)
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_SCOPE = 'auth'
+RATE_LIMIT_IP_BURST = float(os.environ.get('RATE_LIMIT_IP_BURST', '60'))
+RATE_LIMIT_IP_RATE = float(os.environ.get('RATE_LIMIT_IP_RATE', '1'))
+RATE_LIMIT_USER_BURST = float(os.environ.get('RATE_LIMIT_USER_BURST', '120'))
+RATE_LIMIT_USER_RATE = float(os.environ.get('RATE_LIMIT_USER_RATE', '2'))
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false') == 'true'
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+
+class MemoryRateLimitStore:
+    """Token buckets kept as a theoretical arrival time per key (GCRA), bounded by LRU eviction."""
+    
+    def __init__(self, max_keys: int):
+        self._max_keys = max_keys
+        self._arrivals: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        step = cost / rate
+        now = time.monotonic()
+        with self._lock:
+            arrival = max(self._arrivals.pop(key, now), now)
+            retry_after = arrival + step - now - burst / rate
+            self._arrivals[key] = arrival + step if retry_after <= 0 else arrival
+            while len(self._arrivals) > self._max_keys:
+                self._arrivals.popitem(last=False)
+        return max(retry_after, 0.0)
+
+class PostgresRateLimitStore:
+    """Same buckets in a shared table, so limits hold across instances; one upsert per admitted request."""
+    
+    def __init__(self, acquire: Callable[[], Any], release: Callable[[Any], None]):
+        self._acquire = acquire
+        self._release = release
+    
+    def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        params = {'key': key, 'step': cost / rate, 'burst': burst / rate}
+        conn = self._acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO t_p71176016_tour_booking_platfor.rate_limit_buckets AS b (key, tat)
+                VALUES (%(key)s, EXTRACT(EPOCH FROM clock_timestamp()) + %(step)s)
+                ON CONFLICT (key) DO UPDATE
+                    SET tat = GREATEST(b.tat + %(step)s, EXCLUDED.tat)
+                    WHERE GREATEST(b.tat + %(step)s, EXCLUDED.tat) - EXCLUDED.tat + %(step)s <= %(burst)s
+                RETURNING tat
+            ''', params)
+            retry_after = 0.0
+            if cursor.fetchone() is None:
+                cursor.execute('''
+                    SELECT tat + %(step)s - %(burst)s - EXTRACT(EPOCH FROM clock_timestamp()) as retry_after
+                    FROM t_p71176016_tour_booking_platfor.rate_limit_buckets
+                    WHERE key = %(key)s
+                ''', params)
+                retry_after = float(cursor.fetchone()['retry_after'])
+            conn.commit()
+            cursor.close()
+            return max(retry_after, 0.0)
+        finally:
+            self._release(conn)
+
+_rate_limit_memory = MemoryRateLimitStore(RATE_LIMIT_MAX_KEYS)
+_rate_limit_store: Any = (
+    PostgresRateLimitStore(get_db_connection, release_db_connection) if RATE_LIMIT_BACKEND == 'postgres' else _rate_limit_memory
+)
+
+def client_ip(event: Dict[str, Any]) -> str:
+    """The gateway-observed address; X-Forwarded-For is client-controlled unless a proxy we run appends to it."""
+    if RATE_LIMIT_TRUST_FORWARDED:
+        headers = event.get('headers') or {}
+        forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+        if forwarded.strip():
+            return forwarded.split(',')[-1].strip()
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or 'unknown'
+
+def rate_limit_subject(event: Dict[str, Any]) -> Optional[Any]:
+    headers = event.get('headers') or {}
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if not AUTH_TOKEN_SECRET or scheme.lower() != 'bearer' or not token.strip():
+        return None
+    claims = decode_auth_token(token.strip())
+    return claims['sub'] if claims else None
+
+def _take_rate_limit(key: str, burst: float, rate: float, cost: float) -> float:
+    try:
+        return _rate_limit_store.take(key, burst, rate, cost)
+    except psycopg2.Error as e:
+        print(f'rate limit store unavailable, using local buckets: {e}')
+        return _rate_limit_memory.take(key, burst, rate, cost)
+
+def admit_request(event: Dict[str, Any], cost: float) -> Optional[Dict[str, Any]]:
+    """None when the request fits the caller's per-IP and per-user buckets, otherwise the 429 response."""
+    buckets = [(f'{RATE_LIMIT_SCOPE}:ip:{client_ip(event)}', RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_RATE)]
+    subject = rate_limit_subject(event)
+    if subject is not None:
+        buckets.append((f'{RATE_LIMIT_SCOPE}:user:{subject}', RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_RATE))
+    
+    for key, burst, rate in buckets:
+        retry_after = _take_rate_limit(key, burst, rate, cost)
+        if retry_after > 0:
+            return {
+                'statusCode': 429,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'Retry-After',
+                    'Retry-After': str(math.ceil(retry_after))
+                },
+                'body': json.dumps({'error': 'Too many requests', 'retry_after': math.ceil(retry_after)}),
+                'isBase64Encoded': False
+            }
+    return None
+
+RATE_LIMIT_COSTS: Dict[str, float] = {
+    'POST login': 5,
+    'POST register': 10
+}
+
+def rate_limit_cost(method: str, event: Dict[str, Any]) -> float:
+    action = None
+    if method == 'POST':
+        try:
+            action = json.loads(event.get('body') or '{}').get('action', 'register')
+        except (ValueError, AttributeError):
+            action = None
+    return RATE_LIMIT_COSTS.get(f'{method} {action}', 1)
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
@@ -23,20 +452,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    database_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(database_url)
+    rejected = admit_request(event, rate_limit_cost(method, event))
+    if rejected:
+        return rejected
+    
+    conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
         if method == 'GET':
-            user_id = event.get('queryStringParameters', {}).get('user_id')
+            params = event.get('queryStringParameters') or {}
+            
+            if params.get('action') == 'me':
+                claims = authenticate(event, conn)
+                if not claims:
+                    return unauthorized_response()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'user': {
+                        'id': claims['sub'],
+                        'name': claims.get('name'),
+                        'email': claims.get('email'),
+                        'role': claims.get('role')
+                    }}),
+                    'isBase64Encoded': False
+                }
+            
+            user_id = params.get('user_id')
             
             if not user_id:
                 return {
@@ -69,7 +520,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(user), default=str),
+                'body': dumps_json(user),
                 'isBase64Encoded': False
             }
         
@@ -85,6 +536,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            claims = authenticate(event, conn)
+            if not claims:
+                return unauthorized_response()
+            if claims['sub'] != int(user_id) and claims.get('role') != 'admin':
+                return {
+                    'statusCode': 403,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Cannot update another user'}),
+                    'isBase64Encoded': False
+                }
+            
             update_fields = []
             values = []
             
@@ -165,6 +627,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
+                if role not in SELF_REGISTER_ROLES:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Role must be client or guide'}),
+                        'isBase64Encoded': False
+                    }
+                
                 cursor.execute(
                     "SELECT id FROM t_p71176016_tour_booking_platfor.users WHERE email = %s",
                     (email,)
@@ -197,7 +667,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False,
                     'body': json.dumps({
                         'success': True,
-                        'user': dict(user)
+                        'user': dict(user),
+                        'token': issue_auth_token(user)
                     })
                 }
             
@@ -213,16 +684,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                password_hash = hash_password(password)
-                
                 cursor.execute(
-                    """SELECT id, name, email, role FROM t_p71176016_tour_booking_platfor.users 
-                    WHERE email = %s AND password_hash = %s""",
-                    (email, password_hash)
+                    """SELECT id, name, email, role, password_hash FROM t_p71176016_tour_booking_platfor.users 
+                    WHERE email = %s""",
+                    (email,)
                 )
                 user = cursor.fetchone()
+                stored_hash = (user.pop('password_hash') if user else None) or _DUMMY_PASSWORD_HASH
                 
-                if not user:
+                matches, needs_rehash = verify_password(password, stored_hash)
+                
+                if not user or not matches:
                     return {
                         'statusCode': 401,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -230,16 +702,52 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
+                if needs_rehash:
+                    try:
+                        upgraded_hash = hash_password(password)
+                    except PasswordHasherBusy:
+                        upgraded_hash = None
+                    if upgraded_hash:
+                        cursor.execute(
+                            """UPDATE t_p71176016_tour_booking_platfor.users 
+                            SET password_hash = %s WHERE id = %s AND password_hash = %s""",
+                            (upgraded_hash, user['id'], stored_hash)
+                        )
+                        conn.commit()
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'isBase64Encoded': False,
                     'body': json.dumps({
                         'success': True,
-                        'user': dict(user)
+                        'user': dict(user),
+                        'token': issue_auth_token(user)
                     })
                 }
             
+            elif action == 'logout':
+                claims = authenticate(event, conn)
+                if not claims:
+                    return unauthorized_response()
+                
+                cursor.execute(
+                    """INSERT INTO t_p71176016_tour_booking_platfor.revoked_tokens (jti, expires_at)
+                    VALUES (%s, to_timestamp(%s))
+                    ON CONFLICT (jti) DO NOTHING""",
+                    (claims['jti'], claims['exp'])
+                )
+                conn.commit()
+                with _revoked_tokens_lock:
+                    _revoked_tokens.add(claims['jti'])
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'success': True}),
+                    'isBase64Encoded': False
+                }
+            
             else:
                 return {
                     'statusCode': 400,
@@ -255,6 +763,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    except PasswordHasherBusy:
+        return {
+            'statusCode': 503,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Retry-After': '1'
+            },
+            'body': json.dumps({'error': 'Too many concurrent sign-ins, please retry'}),
+            'isBase64Encoded': False
+        }
+    
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
@@ -5,19 +5,571 @@ Args: event - dict with httpMethod, body, queryStringParameters, headers
 Returns: HTTP response with booking data or operation status
 '''
 
+import base64
+import hashlib
+import hmac
 import json
+import math
 import os
-from typing import Dict, Any
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from datetime import date, datetime
+from decimal import Decimal
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor, execute_values
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_DEBUG = os.environ.get('DB_POOL_DEBUG', 'false') == 'true'
+
+_db_pool: List[Tuple[Any, float]] = []
+_db_pool_lock = threading.Lock()
+_db_pool_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0}
+
+def _connection_is_healthy(conn, idle_seconds: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_seconds < DB_POOL_PING_AFTER:
+        return True
+    try:
+        ping_cursor = conn.cursor()
+        ping_cursor.execute('SELECT 1')
+        ping_cursor.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
 
 def get_db_connection():
+    while True:
+        with _db_pool_lock:
+            if not _db_pool:
+                break
+            conn, released_at = _db_pool.pop()
+        if _connection_is_healthy(conn, time.monotonic() - released_at):
+            with _db_pool_lock:
+                _db_pool_stats['hits'] += 1
+            return conn
+        with _db_pool_lock:
+            _db_pool_stats['reconnects'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+    
     database_url = os.environ.get('DATABASE_URL')
     if not database_url:
         raise ValueError('DATABASE_URL environment variable is not set')
+    with _db_pool_lock:
+        _db_pool_stats['misses'] += 1
+    if DB_POOL_DEBUG:
+        print(f'db pool miss: {db_pool_stats()}')
     return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
 
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        conn.close()
+        return
+    with _db_pool_lock:
+        if len(_db_pool) < DB_POOL_MAX_SIZE:
+            _db_pool.append((conn, time.monotonic()))
+            return
+        _db_pool_stats['discarded'] += 1
+    conn.close()
+
+def db_pool_stats() -> Dict[str, int]:
+    with _db_pool_lock:
+        return dict(_db_pool_stats, idle=len(_db_pool), max_size=DB_POOL_MAX_SIZE)
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps_json(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default).decode()
+    return json.dumps(payload, default=_json_default)
+
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+REVOKED_TOKENS_TTL = float(os.environ.get('REVOKED_TOKENS_TTL', '30'))
+
+_revoked_tokens: set = set()
+_revoked_tokens_lock = threading.Lock()
+_revoked_tokens_state: Dict[str, float] = {'loaded_at': float('-inf')}
+
+def _b64url_encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _b64url_decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign_auth_token(signing_input: str) -> bytes:
+    if not AUTH_TOKEN_SECRET:
+        raise ValueError('AUTH_TOKEN_SECRET environment variable is not set')
+    return hmac.new(AUTH_TOKEN_SECRET.encode(), signing_input.encode(), hashlib.sha256).digest()
+
+def decode_auth_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        header_b64, payload_b64, signature_b64 = token.split('.')
+        signature = _b64url_decode(signature_b64)
+        if not hmac.compare_digest(_sign_auth_token(f'{header_b64}.{payload_b64}'), signature):
+            return None
+        header = json.loads(_b64url_decode(header_b64))
+        claims = json.loads(_b64url_decode(payload_b64))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(header, dict) or header.get('alg') != 'HS256' or not isinstance(claims, dict):
+        return None
+    if not isinstance(claims.get('exp'), (int, float)) or claims['exp'] <= time.time():
+        return None
+    return claims
+
+def is_token_revoked(conn, jti: Any) -> bool:
+    now = time.monotonic()
+    with _revoked_tokens_lock:
+        stale = now - _revoked_tokens_state['loaded_at'] >= REVOKED_TOKENS_TTL
+    if stale:
+        cursor = conn.cursor()
+        cursor.execute('SELECT jti FROM revoked_tokens WHERE expires_at > NOW()')
+        revoked = {row['jti'] for row in cursor.fetchall()}
+        cursor.close()
+        with _revoked_tokens_lock:
+            _revoked_tokens.clear()
+            _revoked_tokens.update(revoked)
+            _revoked_tokens_state['loaded_at'] = now
+    with _revoked_tokens_lock:
+        return jti in _revoked_tokens
+
+def authenticate(event: Dict[str, Any], conn) -> Optional[Dict[str, Any]]:
+    """Claims of a valid, unrevoked bearer token; the denylist is reloaded at most every REVOKED_TOKENS_TTL seconds."""
+    headers = event.get('headers') or {}
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    claims = decode_auth_token(token.strip())
+    if claims is None or is_token_revoked(conn, claims.get('jti')):
+        return None
+    return claims
+
+RENDER_MODES = ('python', 'sql')
+DEFAULT_RENDER_MODE = os.environ.get('RENDER_MODE', 'python')
+
+TOUR_DATES_MAX_AGE = 60
+
+def cached_json_response(event: Dict[str, Any], payload: Any, max_age: int, private: bool = False) -> Dict[str, Any]:
+    return cached_json_body_response(event, dumps_json(payload), max_age, private)
+
+def cached_json_body_response(event: Dict[str, Any], body: str, max_age: int, private: bool = False) -> Dict[str, Any]:
+    etag = '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': f"{'private' if private else 'public'}, max-age={max_age}",
+        'ETag': etag
+    }
+    
+    request_headers = event.get('headers') or {}
+    if_none_match = request_headers.get('If-None-Match') or request_headers.get('if-none-match')
+    if if_none_match:
+        candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        if etag in candidates or '*' in candidates:
+            return {
+                'statusCode': 304,
+                'headers': headers,
+                'body': '',
+                'isBase64Encoded': False
+            }
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+BOOKING_MAX_ATTEMPTS = 3
+
+def reserve_seats(cursor, tour_id: int, booking_date: Any, guests_count: int, capacity: int) -> Optional[int]:
+    cursor.execute('''
+        INSERT INTO tour_availability (tour_id, date, capacity, reserved)
+        VALUES (%s, %s, %s, 0)
+        ON CONFLICT (tour_id, date) DO NOTHING
+    ''', (tour_id, booking_date, capacity))
+    
+    cursor.execute('''
+        UPDATE tour_availability
+        SET reserved = reserved + %s, updated_at = CURRENT_TIMESTAMP
+        WHERE tour_id = %s AND date = %s AND reserved + %s <= capacity
+        RETURNING capacity - reserved as seats_left
+    ''', (guests_count, tour_id, booking_date, guests_count))
+    row = cursor.fetchone()
+    return row['seats_left'] if row else None
+
+def release_seats(cursor, tour_id: int, booking_date: Any, guests_count: int) -> None:
+    cursor.execute('''
+        UPDATE tour_availability
+        SET reserved = GREATEST(reserved - %s, 0), updated_at = CURRENT_TIMESTAMP
+        WHERE tour_id = %s AND date = %s
+    ''', (guests_count, tour_id, booking_date))
+
+OUTBOX_FLUSH_BATCH = 500
+
+_outbox_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='notification-outbox')
+
+def flush_notification_outbox(conn, limit: int = OUTBOX_FLUSH_BATCH) -> Tuple[int, List[int]]:
+    """Moves queued outbox rows into notifications and per-channel deliveries in a single statement.
+    
+    Returns how many rows were moved and which users received them.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        WITH claimed AS (
+            SELECT id FROM notification_outbox
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), moved AS (
+            DELETE FROM notification_outbox o
+            USING claimed c
+            WHERE o.id = c.id
+            RETURNING o.id, o.user_id, o.type, o.title, o.message, o.link, o.created_at
+        ), inserted AS (
+            INSERT INTO notifications (user_id, type, title, message, link, created_at)
+            SELECT user_id, type, title, message, link, created_at FROM moved ORDER BY id
+            RETURNING id, user_id
+        ), queued AS (
+            INSERT INTO notification_deliveries (notification_id, user_id, channel)
+            SELECT i.id, i.user_id, channel.name
+            FROM inserted i
+            JOIN users u ON u.id = i.user_id
+            CROSS JOIN LATERAL (VALUES
+                ('email', u.email_notifications AND COALESCE(u.email, '') <> ''),
+                ('telegram', u.telegram_notifications AND COALESCE(u.telegram, '') <> '')
+            ) AS channel(name, enabled)
+            WHERE channel.enabled
+            RETURNING id
+        )
+        SELECT
+            (SELECT COUNT(*) FROM inserted) as moved,
+            (SELECT COUNT(*) FROM queued) as deliveries,
+            ARRAY(SELECT DISTINCT user_id FROM inserted) as user_ids
+    ''', (limit,))
+    result = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return result['moved'], result['user_ids']
+
+def _flush_outbox_in_background() -> None:
+    conn = get_db_connection()
+    try:
+        while True:
+            moved, user_ids = flush_notification_outbox(conn)
+            if moved < OUTBOX_FLUSH_BATCH:
+                break
+    except psycopg2.Error as e:
+        print(f'notification outbox flush failed, left for process_outbox: {e}')
+    finally:
+        release_db_connection(conn)
+
+NOTIFICATION_INSERT_PAGE = 1000
+
+def queue_notifications(cursor, notifications: List[Tuple[int, str, str, str, Optional[str]]]) -> None:
+    """Writes (user_id, type, title, message, link) rows to the outbox as one multi-row INSERT per page."""
+    execute_values(cursor, '''
+        INSERT INTO notification_outbox (user_id, type, title, message, link)
+        VALUES %s
+    ''', notifications, page_size=NOTIFICATION_INSERT_PAGE)
+
+def kick_outbox_flush() -> None:
+    """Called after a commit that wrote to notification_outbox; the request does not wait for the move."""
+    _outbox_pool.submit(_flush_outbox_in_background)
+
+def validate_booking_request(conn, body_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Rejects malformed bookings and party sizes above the tour's capacity before anything is reserved."""
+    tour_id = body_data.get('tour_id')
+    booking_date = body_data.get('booking_date')
+    guests_count = body_data.get('guests_count', 1)
+    client_name = body_data.get('client_name')
+    
+    if not all([tour_id, booking_date, client_name]):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'tour_id, booking_date, and client_name required'}),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        guests_count = int(guests_count)
+    except (TypeError, ValueError):
+        guests_count = 0
+    if guests_count < 1:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'guests_count must be a positive integer'}),
+            'isBase64Encoded': False
+        }
+    
+    cursor = conn.cursor()
+    cursor.execute('SELECT max_guests FROM tours WHERE id = %s', (tour_id,))
+    tour = cursor.fetchone()
+    cursor.close()
+    
+    if not tour:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Tour not found'}),
+            'isBase64Encoded': False
+        }
+    
+    if guests_count > (tour['max_guests'] or 8):
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Not enough seats available for this date'}),
+            'isBase64Encoded': False
+        }
+    
+    return None
+
+def create_booking(conn, body_data: Dict[str, Any], client_id: int) -> Dict[str, Any]:
+    """Expects a body that already passed validate_booking_request."""
+    tour_id = body_data.get('tour_id')
+    booking_date = body_data.get('booking_date')
+    guests_count = int(body_data.get('guests_count', 1))
+    client_name = body_data.get('client_name')
+    client_telegram = body_data.get('client_telegram')
+    
+    for attempt in range(BOOKING_MAX_ATTEMPTS):
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                SELECT guide_id, price, instant_booking, max_guests FROM tours WHERE id = %s
+            ''', (tour_id,))
+            tour = cursor.fetchone()
+            
+            if not tour:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Tour not found'}),
+                    'isBase64Encoded': False
+                }
+            
+            seats_left = reserve_seats(cursor, tour_id, booking_date, guests_count, tour['max_guests'] or 8)
+            if seats_left is None:
+                conn.rollback()
+                return {
+                    'statusCode': 409,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Not enough seats available for this date'}),
+                    'isBase64Encoded': False
+                }
+            
+            total_price = float(tour['price']) * guests_count
+            status = 'confirmed' if tour['instant_booking'] else 'pending'
+            
+            cursor.execute('''
+                INSERT INTO bookings (
+                    tour_id, client_id, guide_id, booking_date, 
+                    guests_count, total_price, status, client_name, client_telegram
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id, created_at
+            ''', (
+                tour_id, client_id, tour['guide_id'], booking_date,
+                guests_count, total_price, status, client_name, client_telegram
+            ))
+            result = cursor.fetchone()
+            booking_id = result['id']
+            
+            queue_notifications(cursor, [
+                (
+                    tour['guide_id'],
+                    'booking',
+                    'Новое бронирование' if status == 'pending' else 'Подтверждено бронирование',
+                    f'{client_name} забронировал тур на {booking_date}',
+                    '/guide'
+                ),
+                (
+                    client_id,
+                    'booking',
+                    'Бронирование создано',
+                    f'Ваше бронирование {"подтверждено" if status == "confirmed" else "ожидает подтверждения"}',
+                    '/client'
+                )
+            ])
+            
+            conn.commit()
+            kick_outbox_flush()
+            break
+        except psycopg2.extensions.TransactionRollbackError:
+            conn.rollback()
+            if attempt == BOOKING_MAX_ATTEMPTS - 1:
+                raise
+        finally:
+            cursor.close()
+    
+    return {
+        'statusCode': 201,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'id': booking_id,
+            'status': status,
+            'total_price': total_price,
+            'seats_left': seats_left,
+            'created_at': result['created_at'].isoformat() if result['created_at'] else None
+        }),
+        'isBase64Encoded': False
+    }
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_SCOPE = 'bookings'
+RATE_LIMIT_IP_BURST = float(os.environ.get('RATE_LIMIT_IP_BURST', '60'))
+RATE_LIMIT_IP_RATE = float(os.environ.get('RATE_LIMIT_IP_RATE', '1'))
+RATE_LIMIT_USER_BURST = float(os.environ.get('RATE_LIMIT_USER_BURST', '120'))
+RATE_LIMIT_USER_RATE = float(os.environ.get('RATE_LIMIT_USER_RATE', '2'))
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false') == 'true'
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+
+class MemoryRateLimitStore:
+    """Token buckets kept as a theoretical arrival time per key (GCRA), bounded by LRU eviction."""
+    
+    def __init__(self, max_keys: int):
+        self._max_keys = max_keys
+        self._arrivals: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        step = cost / rate
+        now = time.monotonic()
+        with self._lock:
+            arrival = max(self._arrivals.pop(key, now), now)
+            retry_after = arrival + step - now - burst / rate
+            self._arrivals[key] = arrival + step if retry_after <= 0 else arrival
+            while len(self._arrivals) > self._max_keys:
+                self._arrivals.popitem(last=False)
+        return max(retry_after, 0.0)
+
+class PostgresRateLimitStore:
+    """Same buckets in a shared table, so limits hold across instances; one upsert per admitted request."""
+    
+    def __init__(self, acquire: Callable[[], Any], release: Callable[[Any], None]):
+        self._acquire = acquire
+        self._release = release
+    
+    def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        params = {'key': key, 'step': cost / rate, 'burst': burst / rate}
+        conn = self._acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO rate_limit_buckets AS b (key, tat)
+                VALUES (%(key)s, EXTRACT(EPOCH FROM clock_timestamp()) + %(step)s)
+                ON CONFLICT (key) DO UPDATE
+                    SET tat = GREATEST(b.tat + %(step)s, EXCLUDED.tat)
+                    WHERE GREATEST(b.tat + %(step)s, EXCLUDED.tat) - EXCLUDED.tat + %(step)s <= %(burst)s
+                RETURNING tat
+            ''', params)
+            retry_after = 0.0
+            if cursor.fetchone() is None:
+                cursor.execute('''
+                    SELECT tat + %(step)s - %(burst)s - EXTRACT(EPOCH FROM clock_timestamp()) as retry_after
+                    FROM rate_limit_buckets
+                    WHERE key = %(key)s
+                ''', params)
+                retry_after = float(cursor.fetchone()['retry_after'])
+            conn.commit()
+            cursor.close()
+            return max(retry_after, 0.0)
+        finally:
+            self._release(conn)
+
+_rate_limit_memory = MemoryRateLimitStore(RATE_LIMIT_MAX_KEYS)
+_rate_limit_store: Any = (
+    PostgresRateLimitStore(get_db_connection, release_db_connection) if RATE_LIMIT_BACKEND == 'postgres' else _rate_limit_memory
+)
+
+def client_ip(event: Dict[str, Any]) -> str:
+    """The gateway-observed address; X-Forwarded-For is client-controlled unless a proxy we run appends to it."""
+    if RATE_LIMIT_TRUST_FORWARDED:
+        headers = event.get('headers') or {}
+        forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+        if forwarded.strip():
+            return forwarded.split(',')[-1].strip()
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or 'unknown'
+
+def rate_limit_subject(event: Dict[str, Any]) -> Optional[Any]:
+    headers = event.get('headers') or {}
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if not AUTH_TOKEN_SECRET or scheme.lower() != 'bearer' or not token.strip():
+        return None
+    claims = decode_auth_token(token.strip())
+    return claims['sub'] if claims else None
+
+def _take_rate_limit(key: str, burst: float, rate: float, cost: float) -> float:
+    try:
+        return _rate_limit_store.take(key, burst, rate, cost)
+    except psycopg2.Error as e:
+        print(f'rate limit store unavailable, using local buckets: {e}')
+        return _rate_limit_memory.take(key, burst, rate, cost)
+
+def admit_request(event: Dict[str, Any], cost: float) -> Optional[Dict[str, Any]]:
+    """None when the request fits the caller's per-IP and per-user buckets, otherwise the 429 response."""
+    buckets = [(f'{RATE_LIMIT_SCOPE}:ip:{client_ip(event)}', RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_RATE)]
+    subject = rate_limit_subject(event)
+    if subject is not None:
+        buckets.append((f'{RATE_LIMIT_SCOPE}:user:{subject}', RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_RATE))
+    
+    for key, burst, rate in buckets:
+        retry_after = _take_rate_limit(key, burst, rate, cost)
+        if retry_after > 0:
+            return {
+                'statusCode': 429,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'Retry-After',
+                    'Retry-After': str(math.ceil(retry_after))
+                },
+                'body': json.dumps({'error': 'Too many requests', 'retry_after': math.ceil(retry_after)}),
+                'isBase64Encoded': False
+            }
+    return None
+
+RATE_LIMIT_COSTS: Dict[str, float] = {
+    'GET tour_dates': 1,
+    'GET user_bookings': 1,
+    'POST create': 3,
+    'PUT update': 2
+}
+
+def rate_limit_cost(method: str, params: Dict[str, Any]) -> float:
+    action = params.get('action', 'list') if method == 'GET' else {'POST': 'create', 'PUT': 'update'}.get(method)
+    return RATE_LIMIT_COSTS.get(f'{method} {action}', 1)
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -27,13 +579,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    rejected = admit_request(event, rate_limit_cost(method, event.get('queryStringParameters') or {}))
+    if rejected:
+        return rejected
+    
     conn = get_db_connection()
     
     try:
@@ -53,39 +609,73 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 cursor = conn.cursor()
                 cursor.execute('''
-                    SELECT date, available_slots 
-                    FROM tour_dates 
+                    SELECT date, GREATEST(capacity - reserved, 0) as available_slots
+                    FROM tour_availability
                     WHERE tour_id = %s AND date >= CURRENT_DATE
                     ORDER BY date ASC
                 ''', (tour_id,))
                 dates = cursor.fetchall()
                 cursor.close()
                 
-                result = [{'date': d['date'].isoformat(), 'available_slots': d['available_slots']} for d in dates]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'dates': result}),
-                    'isBase64Encoded': False
-                }
+                return cached_json_response(event, {'dates': dates}, TOUR_DATES_MAX_AGE)
             
             elif action == 'user_bookings':
-                headers = event.get('headers', {})
-                user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+                claims = authenticate(event, conn)
+                if not claims:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Authorization required'}),
+                        'isBase64Encoded': False
+                    }
+                user_id = claims['sub']
                 
-                if not user_id:
+                render_mode = params.get('render', DEFAULT_RENDER_MODE)
+                if render_mode not in RENDER_MODES:
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'X-User-Id header required'}),
+                        'body': json.dumps({'error': 'render must be python or sql'}),
                         'isBase64Encoded': False
                     }
                 
                 cursor = conn.cursor()
+                
+                if render_mode == 'sql':
+                    cursor.execute('''
+                        SELECT json_build_object('bookings', COALESCE(json_agg(json_build_object(
+                            'id', b.id,
+                            'tour_id', b.tour_id,
+                            'tour_title', t.title,
+                            'city', t.city,
+                            'image_url', t.image_url,
+                            'guide_name', g.name,
+                            'guide_avatar', g.avatar_url,
+                            'booking_date', b.booking_date,
+                            'guests_count', b.guests_count,
+                            'total_price', b.total_price,
+                            'status', b.status,
+                            'created_at', b.created_at
+                        ) ORDER BY b.booking_date DESC), '[]'::json))::text as body
+                        FROM bookings b
+                        JOIN tours t ON b.tour_id = t.id
+                        JOIN users g ON b.guide_id = g.id
+                        WHERE b.client_id = %s
+                    ''', (user_id,))
+                    body = cursor.fetchone()['body']
+                    cursor.close()
+                    
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': body,
+                        'isBase64Encoded': False
+                    }
+                
                 cursor.execute('''
-                    SELECT b.*, t.title as tour_title, t.city, t.image_url,
-                           g.name as guide_name, g.avatar_url as guide_avatar
+                    SELECT b.id, b.tour_id, t.title as tour_title, t.city, t.image_url,
+                           g.name as guide_name, g.avatar_url as guide_avatar,
+                           b.booking_date, b.guests_count, b.total_price, b.status, b.created_at
                     FROM bookings b
                     JOIN tours t ON b.tour_id = t.id
                     JOIN users g ON b.guide_id = g.id
@@ -95,117 +685,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 bookings = cursor.fetchall()
                 cursor.close()
                 
-                result = []
-                for booking in bookings:
-                    result.append({
-                        'id': booking['id'],
-                        'tour_id': booking['tour_id'],
-                        'tour_title': booking['tour_title'],
-                        'city': booking['city'],
-                        'image_url': booking['image_url'],
-                        'guide_name': booking['guide_name'],
-                        'guide_avatar': booking['guide_avatar'],
-                        'booking_date': booking['booking_date'].isoformat() if booking['booking_date'] else None,
-                        'guests_count': booking['guests_count'],
-                        'total_price': float(booking['total_price']),
-                        'status': booking['status'],
-                        'created_at': booking['created_at'].isoformat() if booking['created_at'] else None
-                    })
-                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'bookings': result}),
+                    'body': dumps_json({'bookings': bookings}),
                     'isBase64Encoded': False
                 }
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
+            invalid = validate_booking_request(conn, body_data)
+            if invalid:
+                return invalid
             
-            tour_id = body_data.get('tour_id')
-            client_id = body_data.get('client_id')
-            booking_date = body_data.get('booking_date')
-            guests_count = body_data.get('guests_count', 1)
-            client_name = body_data.get('client_name')
-            client_telegram = body_data.get('client_telegram')
-            
-            if not all([tour_id, client_id, booking_date, client_name]):
+            claims = authenticate(event, conn)
+            if not claims:
                 return {
-                    'statusCode': 400,
+                    'statusCode': 401,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'tour_id, client_id, booking_date, and client_name required'}),
+                    'body': json.dumps({'error': 'Authorization required'}),
                     'isBase64Encoded': False
                 }
             
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT guide_id, price, instant_booking FROM tours WHERE id = %s
-            ''', (tour_id,))
-            tour = cursor.fetchone()
-            
-            if not tour:
-                cursor.close()
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Tour not found'}),
-                    'isBase64Encoded': False
-                }
-            
-            total_price = float(tour['price']) * guests_count
-            status = 'confirmed' if tour['instant_booking'] else 'pending'
-            
-            cursor.execute('''
-                INSERT INTO bookings (
-                    tour_id, client_id, guide_id, booking_date, 
-                    guests_count, total_price, status, client_name, client_telegram
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, created_at
-            ''', (
-                tour_id, client_id, tour['guide_id'], booking_date,
-                guests_count, total_price, status, client_name, client_telegram
-            ))
-            result = cursor.fetchone()
-            booking_id = result['id']
-            
-            cursor.execute('''
-                INSERT INTO notifications (user_id, type, title, message, link)
-                VALUES (%s, %s, %s, %s, %s)
-            ''', (
-                tour['guide_id'],
-                'booking',
-                'Новое бронирование' if status == 'pending' else 'Подтверждено бронирование',
-                f'{client_name} забронировал тур на {booking_date}',
-                '/guide'
-            ))
-            
-            cursor.execute('''
-                INSERT INTO notifications (user_id, type, title, message, link)
-                VALUES (%s, %s, %s, %s, %s)
-            ''', (
-                client_id,
-                'booking',
-                'Бронирование создано',
-                f'Ваше бронирование {"подтверждено" if status == "confirmed" else "ожидает подтверждения"}',
-                '/client'
-            ))
-            
-            conn.commit()
-            cursor.close()
-            
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'id': booking_id,
-                    'status': status,
-                    'total_price': total_price,
-                    'created_at': result['created_at'].isoformat() if result['created_at'] else None
-                }),
-                'isBase64Encoded': False
-            }
+            return create_booking(conn, body_data, claims['sub'])
         
         elif method == 'PUT':
             body_data = json.loads(event.get('body', '{}'))
@@ -221,9 +723,62 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            claims = authenticate(event, conn)
+            if not claims:
+                return {
+                    'statusCode': 401,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Authorization required'}),
+                    'isBase64Encoded': False
+                }
+            
             cursor = conn.cursor()
+            cursor.execute('SELECT guide_id FROM bookings WHERE id = %s', (booking_id,))
+            booking = cursor.fetchone()
+            
+            if not booking:
+                cursor.close()
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Booking not found'}),
+                    'isBase64Encoded': False
+                }
+            
+            if booking['guide_id'] != claims['sub'] and claims.get('role') != 'admin':
+                cursor.close()
+                return {
+                    'statusCode': 403,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Only the tour guide can confirm or cancel this booking'}),
+                    'isBase64Encoded': False
+                }
             
             if action == 'confirm':
+                cursor.execute('''
+                    SELECT b.status, b.tour_id, b.booking_date, b.guests_count, t.max_guests
+                    FROM bookings b
+                    JOIN tours t ON t.id = b.tour_id
+                    WHERE b.id = %s
+                    FOR UPDATE OF b
+                ''', (booking_id,))
+                previous = cursor.fetchone()
+                
+                if previous and previous['status'] not in ('pending', 'confirmed'):
+                    seats_left = reserve_seats(
+                        cursor, previous['tour_id'], previous['booking_date'],
+                        previous['guests_count'], previous['max_guests'] or 8
+                    )
+                    if seats_left is None:
+                        conn.rollback()
+                        cursor.close()
+                        return {
+                            'statusCode': 409,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Not enough seats available for this date'}),
+                            'isBase64Encoded': False
+                        }
+                
                 cursor.execute('''
                     UPDATE bookings SET status = 'confirmed', updated_at = CURRENT_TIMESTAMP
                     WHERE id = %s
@@ -233,7 +788,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 if result:
                     cursor.execute('''
-                        INSERT INTO notifications (user_id, type, title, message, link)
+                        INSERT INTO notification_outbox (user_id, type, title, message, link)
                         VALUES (%s, %s, %s, %s, %s)
                     ''', (
                         result['client_id'],
@@ -244,6 +799,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     ))
                 
             elif action == 'cancel':
+                cursor.execute('''
+                    SELECT status, tour_id, booking_date, guests_count
+                    FROM bookings WHERE id = %s
+                    FOR UPDATE
+                ''', (booking_id,))
+                previous = cursor.fetchone()
+                
                 cursor.execute('''
                     UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
                     WHERE id = %s
@@ -251,9 +813,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 ''', (booking_id,))
                 result = cursor.fetchone()
                 
+                if previous and previous['status'] in ('pending', 'confirmed'):
+                    release_seats(cursor, previous['tour_id'], previous['booking_date'], previous['guests_count'])
+                
                 if result:
                     cursor.execute('''
-                        INSERT INTO notifications (user_id, type, title, message, link)
+                        INSERT INTO notification_outbox (user_id, type, title, message, link)
                         VALUES (%s, %s, %s, %s, %s)
                     ''', (
                         result['client_id'],
@@ -265,6 +830,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             conn.commit()
             cursor.close()
+            kick_outbox_flush()
             
             return {
                 'statusCode': 200,
@@ -281,4 +847,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     finally:
-        conn.close()
+        release_db_connection(conn)
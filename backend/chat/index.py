@@ -5,19 +5,675 @@ Args: event - dict with httpMethod, body, queryStringParameters, headers
 Returns: HTTP response with chat messages, notifications, or operation status
 '''
 
+import base64
+import hashlib
+import hmac
 import json
+import math
 import os
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+import select
+import smtplib
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from datetime import date, datetime
+from decimal import Decimal
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_DEBUG = os.environ.get('DB_POOL_DEBUG', 'false') == 'true'
+
+_db_pool: List[Tuple[Any, float]] = []
+_db_pool_lock = threading.Lock()
+_db_pool_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0}
+
+def _connection_is_healthy(conn, idle_seconds: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_seconds < DB_POOL_PING_AFTER:
+        return True
+    try:
+        ping_cursor = conn.cursor()
+        ping_cursor.execute('SELECT 1')
+        ping_cursor.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
 
 def get_db_connection():
+    while True:
+        with _db_pool_lock:
+            if not _db_pool:
+                break
+            conn, released_at = _db_pool.pop()
+        if _connection_is_healthy(conn, time.monotonic() - released_at):
+            with _db_pool_lock:
+                _db_pool_stats['hits'] += 1
+            return conn
+        with _db_pool_lock:
+            _db_pool_stats['reconnects'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+    
     database_url = os.environ.get('DATABASE_URL')
     if not database_url:
         raise ValueError('DATABASE_URL environment variable is not set')
+    with _db_pool_lock:
+        _db_pool_stats['misses'] += 1
+    if DB_POOL_DEBUG:
+        print(f'db pool miss: {db_pool_stats()}')
     return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
 
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        conn.close()
+        return
+    with _db_pool_lock:
+        if len(_db_pool) < DB_POOL_MAX_SIZE:
+            _db_pool.append((conn, time.monotonic()))
+            return
+        _db_pool_stats['discarded'] += 1
+    conn.close()
+
+def db_pool_stats() -> Dict[str, int]:
+    with _db_pool_lock:
+        return dict(_db_pool_stats, idle=len(_db_pool), max_size=DB_POOL_MAX_SIZE)
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps_json(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default).decode()
+    return json.dumps(payload, default=_json_default)
+
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+REVOKED_TOKENS_TTL = float(os.environ.get('REVOKED_TOKENS_TTL', '30'))
+
+_revoked_tokens: set = set()
+_revoked_tokens_lock = threading.Lock()
+_revoked_tokens_state: Dict[str, float] = {'loaded_at': float('-inf')}
+
+def _b64url_encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _b64url_decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign_auth_token(signing_input: str) -> bytes:
+    if not AUTH_TOKEN_SECRET:
+        raise ValueError('AUTH_TOKEN_SECRET environment variable is not set')
+    return hmac.new(AUTH_TOKEN_SECRET.encode(), signing_input.encode(), hashlib.sha256).digest()
+
+def decode_auth_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        header_b64, payload_b64, signature_b64 = token.split('.')
+        signature = _b64url_decode(signature_b64)
+        if not hmac.compare_digest(_sign_auth_token(f'{header_b64}.{payload_b64}'), signature):
+            return None
+        header = json.loads(_b64url_decode(header_b64))
+        claims = json.loads(_b64url_decode(payload_b64))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(header, dict) or header.get('alg') != 'HS256' or not isinstance(claims, dict):
+        return None
+    if not isinstance(claims.get('exp'), (int, float)) or claims['exp'] <= time.time():
+        return None
+    return claims
+
+def is_token_revoked(conn, jti: Any) -> bool:
+    now = time.monotonic()
+    with _revoked_tokens_lock:
+        stale = now - _revoked_tokens_state['loaded_at'] >= REVOKED_TOKENS_TTL
+    if stale:
+        cursor = conn.cursor()
+        cursor.execute('SELECT jti FROM revoked_tokens WHERE expires_at > NOW()')
+        revoked = {row['jti'] for row in cursor.fetchall()}
+        cursor.close()
+        with _revoked_tokens_lock:
+            _revoked_tokens.clear()
+            _revoked_tokens.update(revoked)
+            _revoked_tokens_state['loaded_at'] = now
+    with _revoked_tokens_lock:
+        return jti in _revoked_tokens
+
+def authenticate(event: Dict[str, Any], conn) -> Optional[Dict[str, Any]]:
+    """Claims of a valid, unrevoked bearer token; the denylist is reloaded at most every REVOKED_TOKENS_TTL seconds."""
+    headers = event.get('headers') or {}
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    claims = decode_auth_token(token.strip())
+    if claims is None or is_token_revoked(conn, claims.get('jti')):
+        return None
+    return claims
+
+WORKER_SECRET = os.environ.get('WORKER_SECRET', '')
+
+def is_worker_request(event: Dict[str, Any], claims: Optional[Dict[str, Any]]) -> bool:
+    """Timer triggers send X-Worker-Secret; an admin token is accepted for manual runs."""
+    if claims and claims.get('role') == 'admin':
+        return True
+    headers = event.get('headers') or {}
+    supplied = headers.get('X-Worker-Secret') or headers.get('x-worker-secret') or ''
+    return bool(WORKER_SECRET) and hmac.compare_digest(supplied.encode(), WORKER_SECRET.encode())
+
+MESSAGES_MAX_AGE = 0
+MESSAGES_DEFAULT_LIMIT = 50
+MESSAGES_MAX_LIMIT = 200
+MESSAGES_MAX_WAIT = 25
+NOTIFICATIONS_MAX_WAIT = 25
+
+def cached_json_response(event: Dict[str, Any], payload: Any, max_age: int, private: bool = False) -> Dict[str, Any]:
+    return cached_json_body_response(event, dumps_json(payload), max_age, private)
+
+def cached_json_body_response(event: Dict[str, Any], body: str, max_age: int, private: bool = False) -> Dict[str, Any]:
+    etag = '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': f"{'private' if private else 'public'}, max-age={max_age}",
+        'ETag': etag
+    }
+    
+    request_headers = event.get('headers') or {}
+    if_none_match = request_headers.get('If-None-Match') or request_headers.get('if-none-match')
+    if if_none_match:
+        candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        if etag in candidates or '*' in candidates:
+            return {
+                'statusCode': 304,
+                'headers': headers,
+                'body': '',
+                'isBase64Encoded': False
+            }
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+def fetch_chat_messages(conn, booking_id: int, after_id: Optional[int], before_id: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], bool]:
+    where_clauses = ['cm.booking_id = %s']
+    query_params: List[Any] = [booking_id]
+    
+    if after_id is not None:
+        where_clauses.append('cm.id > %s')
+        query_params.append(after_id)
+    
+    if before_id is not None:
+        where_clauses.append('cm.id < %s')
+        query_params.append(before_id)
+    
+    order = 'ASC' if after_id is not None else 'DESC'
+    
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT cm.id, cm.booking_id, cm.sender_id,
+               u.name as sender_name, u.avatar_url as sender_avatar,
+               cm.message, cm.is_read, cm.created_at
+        FROM chat_messages cm
+        JOIN users u ON cm.sender_id = u.id
+        WHERE {' AND '.join(where_clauses)}
+        ORDER BY cm.id {order}
+        LIMIT %s
+    ''', query_params + [limit + 1])
+    messages = cursor.fetchall()
+    cursor.close()
+    
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if order == 'DESC':
+        messages.reverse()
+    return messages, has_more
+
+def can_read_booking_chat(conn, booking_id: int, claims: Dict[str, Any]) -> bool:
+    if claims.get('role') == 'admin':
+        return True
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT 1 FROM bookings
+        WHERE id = %s AND (client_id = %s OR guide_id = %s)
+    ''', (booking_id, claims['sub'], claims['sub']))
+    allowed = cursor.fetchone() is not None
+    cursor.close()
+    return allowed
+
+def wait_for_pg_notify(conn, timeout: float) -> Optional[str]:
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        if select.select([conn], [], [], remaining) == ([], [], []):
+            return None
+        conn.poll()
+        if conn.notifies:
+            payload = conn.notifies[-1].payload
+            conn.notifies.clear()
+            return payload
+
+def set_listening(conn, channel: Optional[str]) -> None:
+    cursor = conn.cursor()
+    if channel:
+        conn.rollback()
+        conn.autocommit = True
+        cursor.execute(f'LISTEN {channel}')
+    else:
+        cursor.execute('UNLISTEN *')
+        conn.autocommit = False
+    cursor.close()
+
+def get_unread_count(conn, user_id: int) -> int:
+    """A primary-key read of the trigger-maintained counter; cheap enough that caching it only served stale badges."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT unread_count FROM notification_counters
+        WHERE user_id = %s
+    ''', (user_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row['unread_count'] if row else 0
+
+def fetch_notifications(conn, user_id: int, since_id: Optional[int]) -> List[Dict[str, Any]]:
+    """The newest 50 without since_id; with it the next 50 after since_id, oldest first, so the client pages forward."""
+    cursor = conn.cursor()
+    if since_id is None:
+        cursor.execute('''
+            SELECT id, type, title, message, link, is_read, created_at
+            FROM notifications
+            WHERE user_id = %s
+            ORDER BY created_at DESC
+            LIMIT 50
+        ''', (user_id,))
+    else:
+        cursor.execute('''
+            SELECT id, type, title, message, link, is_read, created_at
+            FROM notifications
+            WHERE user_id = %s AND id > %s
+            ORDER BY id ASC
+            LIMIT 50
+        ''', (user_id, since_id))
+    notifications = cursor.fetchall()
+    cursor.close()
+    return notifications
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_SCOPE = 'chat'
+RATE_LIMIT_IP_BURST = float(os.environ.get('RATE_LIMIT_IP_BURST', '60'))
+RATE_LIMIT_IP_RATE = float(os.environ.get('RATE_LIMIT_IP_RATE', '1'))
+RATE_LIMIT_USER_BURST = float(os.environ.get('RATE_LIMIT_USER_BURST', '120'))
+RATE_LIMIT_USER_RATE = float(os.environ.get('RATE_LIMIT_USER_RATE', '2'))
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false') == 'true'
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+
+class MemoryRateLimitStore:
+    """Token buckets kept as a theoretical arrival time per key (GCRA), bounded by LRU eviction."""
+    
+    def __init__(self, max_keys: int):
+        self._max_keys = max_keys
+        self._arrivals: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        step = cost / rate
+        now = time.monotonic()
+        with self._lock:
+            arrival = max(self._arrivals.pop(key, now), now)
+            retry_after = arrival + step - now - burst / rate
+            self._arrivals[key] = arrival + step if retry_after <= 0 else arrival
+            while len(self._arrivals) > self._max_keys:
+                self._arrivals.popitem(last=False)
+        return max(retry_after, 0.0)
+
+class PostgresRateLimitStore:
+    """Same buckets in a shared table, so limits hold across instances; one upsert per admitted request."""
+    
+    def __init__(self, acquire: Callable[[], Any], release: Callable[[Any], None]):
+        self._acquire = acquire
+        self._release = release
+    
+    def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        params = {'key': key, 'step': cost / rate, 'burst': burst / rate}
+        conn = self._acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO rate_limit_buckets AS b (key, tat)
+                VALUES (%(key)s, EXTRACT(EPOCH FROM clock_timestamp()) + %(step)s)
+                ON CONFLICT (key) DO UPDATE
+                    SET tat = GREATEST(b.tat + %(step)s, EXCLUDED.tat)
+                    WHERE GREATEST(b.tat + %(step)s, EXCLUDED.tat) - EXCLUDED.tat + %(step)s <= %(burst)s
+                RETURNING tat
+            ''', params)
+            retry_after = 0.0
+            if cursor.fetchone() is None:
+                cursor.execute('''
+                    SELECT tat + %(step)s - %(burst)s - EXTRACT(EPOCH FROM clock_timestamp()) as retry_after
+                    FROM rate_limit_buckets
+                    WHERE key = %(key)s
+                ''', params)
+                retry_after = float(cursor.fetchone()['retry_after'])
+            conn.commit()
+            cursor.close()
+            return max(retry_after, 0.0)
+        finally:
+            self._release(conn)
+
+_rate_limit_memory = MemoryRateLimitStore(RATE_LIMIT_MAX_KEYS)
+_rate_limit_store: Any = (
+    PostgresRateLimitStore(get_db_connection, release_db_connection) if RATE_LIMIT_BACKEND == 'postgres' else _rate_limit_memory
+)
+
+def client_ip(event: Dict[str, Any]) -> str:
+    """The gateway-observed address; X-Forwarded-For is client-controlled unless a proxy we run appends to it."""
+    if RATE_LIMIT_TRUST_FORWARDED:
+        headers = event.get('headers') or {}
+        forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+        if forwarded.strip():
+            return forwarded.split(',')[-1].strip()
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or 'unknown'
+
+def rate_limit_subject(event: Dict[str, Any]) -> Optional[Any]:
+    headers = event.get('headers') or {}
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if not AUTH_TOKEN_SECRET or scheme.lower() != 'bearer' or not token.strip():
+        return None
+    claims = decode_auth_token(token.strip())
+    return claims['sub'] if claims else None
+
+def _take_rate_limit(key: str, burst: float, rate: float, cost: float) -> float:
+    try:
+        return _rate_limit_store.take(key, burst, rate, cost)
+    except psycopg2.Error as e:
+        print(f'rate limit store unavailable, using local buckets: {e}')
+        return _rate_limit_memory.take(key, burst, rate, cost)
+
+def admit_request(event: Dict[str, Any], cost: float) -> Optional[Dict[str, Any]]:
+    """None when the request fits the caller's per-IP and per-user buckets, otherwise the 429 response."""
+    buckets = [(f'{RATE_LIMIT_SCOPE}:ip:{client_ip(event)}', RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_RATE)]
+    subject = rate_limit_subject(event)
+    if subject is not None:
+        buckets.append((f'{RATE_LIMIT_SCOPE}:user:{subject}', RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_RATE))
+    
+    for key, burst, rate in buckets:
+        retry_after = _take_rate_limit(key, burst, rate, cost)
+        if retry_after > 0:
+            return {
+                'statusCode': 429,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'Retry-After',
+                    'Retry-After': str(math.ceil(retry_after))
+                },
+                'body': json.dumps({'error': 'Too many requests', 'retry_after': math.ceil(retry_after)}),
+                'isBase64Encoded': False
+            }
+    return None
+
+RATE_LIMIT_COSTS: Dict[str, float] = {
+    'GET messages': 1,
+    'GET messages_wait': 5,
+    'GET watch_notifications': 5,
+    'POST send_message': 2,
+    'POST create_notification': 2,
+    'POST process_outbox': 5,
+    'POST broadcast': 10
+}
+
+def rate_limit_cost(method: str, params: Dict[str, Any]) -> float:
+    action = params.get('action', 'messages')
+    if action == 'messages' and params.get('wait') not in (None, '', '0'):
+        action = 'messages_wait'
+    return RATE_LIMIT_COSTS.get(f'{method} {action}', 1)
+
+OUTBOX_FLUSH_BATCH = 500
+
+_outbox_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='notification-outbox')
+
+def flush_notification_outbox(conn, limit: int = OUTBOX_FLUSH_BATCH) -> int:
+    """Moves queued outbox rows into notifications and per-channel deliveries in a single statement.
+    
+    Returns how many rows were moved.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        WITH claimed AS (
+            SELECT id FROM notification_outbox
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), moved AS (
+            DELETE FROM notification_outbox o
+            USING claimed c
+            WHERE o.id = c.id
+            RETURNING o.id, o.user_id, o.type, o.title, o.message, o.link, o.created_at
+        ), inserted AS (
+            INSERT INTO notifications (user_id, type, title, message, link, created_at)
+            SELECT user_id, type, title, message, link, created_at FROM moved ORDER BY id
+            RETURNING id, user_id
+        ), queued AS (
+            INSERT INTO notification_deliveries (notification_id, user_id, channel)
+            SELECT i.id, i.user_id, channel.name
+            FROM inserted i
+            JOIN users u ON u.id = i.user_id
+            CROSS JOIN LATERAL (VALUES
+                ('email', u.email_notifications AND COALESCE(u.email, '') <> ''),
+                ('telegram', u.telegram_notifications AND COALESCE(u.telegram, '') <> '')
+            ) AS channel(name, enabled)
+            WHERE channel.enabled
+            RETURNING id
+        )
+        SELECT
+            (SELECT COUNT(*) FROM inserted) as moved,
+            (SELECT COUNT(*) FROM queued) as deliveries
+    ''', (limit,))
+    result = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return result['moved']
+
+def _flush_outbox_in_background() -> None:
+    conn = get_db_connection()
+    try:
+        while True:
+            moved = flush_notification_outbox(conn)
+            if moved < OUTBOX_FLUSH_BATCH:
+                break
+        dispatch_notification_deliveries(conn)
+    except psycopg2.Error as e:
+        print(f'notification outbox flush failed, left for process_outbox: {e}')
+    finally:
+        release_db_connection(conn)
+
+NOTIFICATION_TYPES = ('booking', 'message', 'review', 'system')
+BROADCAST_ROLES = ('client', 'guide', 'admin')
+NOTIFICATION_INSERT_PAGE = 1000
+MAX_NOTIFICATION_RECIPIENTS = 1000
+
+def parse_recipient_ids(raw: Any) -> Optional[List[int]]:
+    """Accepts a single id or a list of ids; None when anything is not a positive integer."""
+    values = raw if isinstance(raw, list) else [raw]
+    if not values or len(values) > MAX_NOTIFICATION_RECIPIENTS:
+        return None
+    recipients = set()
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).isdigit():
+            return None
+        recipients.add(int(value))
+    return None if 0 in recipients else sorted(recipients)
+
+def queue_notifications(cursor, notifications: List[Tuple[int, str, str, str, Optional[str]]]) -> None:
+    """Writes (user_id, type, title, message, link) rows to the outbox as one multi-row INSERT per page."""
+    execute_values(cursor, '''
+        INSERT INTO notification_outbox (user_id, type, title, message, link)
+        VALUES %s
+    ''', notifications, page_size=NOTIFICATION_INSERT_PAGE)
+
+def kick_outbox_flush() -> None:
+    """Called after a commit that wrote to notification_outbox; the request does not wait for the move."""
+    _outbox_pool.submit(_flush_outbox_in_background)
+
+SMTP_HOST = os.environ.get('SMTP_HOST', '')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_USER = os.environ.get('SMTP_USER', '')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
+SMTP_FROM = os.environ.get('SMTP_FROM', SMTP_USER)
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', 'true') == 'true'
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+SITE_URL = os.environ.get('SITE_URL', '').rstrip('/')
+DELIVERY_BATCH = 50
+DELIVERY_MAX_ATTEMPTS = 6
+DELIVERY_TIMEOUT = 10
+
+_delivery_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='notification-delivery')
+
+def notification_text(delivery: Dict[str, Any]) -> str:
+    text = f"{delivery['title']}\n\n{delivery['message']}"
+    if delivery['link'] and SITE_URL:
+        text += f"\n\n{SITE_URL}{delivery['link']}"
+    return text
+
+def send_email_notification(delivery: Dict[str, Any]) -> None:
+    email = EmailMessage()
+    email['Subject'] = delivery['title']
+    email['From'] = SMTP_FROM
+    email['To'] = delivery['email']
+    email.set_content(notification_text(delivery))
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=DELIVERY_TIMEOUT) as smtp:
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        smtp.send_message(email)
+
+def send_telegram_notification(delivery: Dict[str, Any]) -> None:
+    request = urllib.request.Request(
+        f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage',
+        data=json.dumps({'chat_id': delivery['telegram'], 'text': notification_text(delivery)}).encode(),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request, timeout=DELIVERY_TIMEOUT) as response:
+        if not json.loads(response.read()).get('ok'):
+            raise ValueError('Telegram rejected the message')
+
+def delivery_senders() -> Dict[str, Callable[[Dict[str, Any]], None]]:
+    senders: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+    if SMTP_HOST:
+        senders['email'] = send_email_notification
+    if TELEGRAM_BOT_TOKEN:
+        senders['telegram'] = send_telegram_notification
+    return senders
+
+def claim_notification_deliveries(conn, channels: List[str]) -> List[Dict[str, Any]]:
+    """Claims due deliveries for configured channels and pushes their next attempt out with exponential backoff."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        WITH claimed AS (
+            UPDATE notification_deliveries d
+            SET attempts = d.attempts + 1,
+                next_attempt_at = NOW() + INTERVAL '1 minute' * power(2, d.attempts)
+            WHERE d.id IN (
+                SELECT id FROM notification_deliveries
+                WHERE status = 'pending' AND next_attempt_at <= NOW() AND channel = ANY(%s)
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING d.id, d.notification_id, d.user_id, d.channel, d.attempts
+        )
+        SELECT c.id, c.channel, c.attempts, u.email, u.telegram, n.title, n.message, n.link
+        FROM claimed c
+        JOIN users u ON u.id = c.user_id
+        JOIN notifications n ON n.id = c.notification_id
+    ''', (channels, DELIVERY_BATCH))
+    deliveries = cursor.fetchall()
+    conn.commit()
+    cursor.close()
+    return deliveries
+
+def dispatch_notification_deliveries(conn) -> Tuple[int, int]:
+    senders = delivery_senders()
+    if not senders:
+        return 0, 0
+    
+    deliveries = claim_notification_deliveries(conn, list(senders))
+    
+    def attempt(delivery: Dict[str, Any]) -> Optional[str]:
+        try:
+            senders[delivery['channel']](delivery)
+            return None
+        except (OSError, ValueError) as e:
+            return str(e)[:500]
+    
+    errors = list(_delivery_pool.map(attempt, deliveries))
+    
+    cursor = conn.cursor()
+    for delivery, error in zip(deliveries, errors):
+        if error is None:
+            cursor.execute('''
+                UPDATE notification_deliveries
+                SET status = 'sent', sent_at = NOW(), last_error = NULL
+                WHERE id = %s
+            ''', (delivery['id'],))
+        else:
+            cursor.execute('''
+                UPDATE notification_deliveries
+                SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END, last_error = %s
+                WHERE id = %s
+            ''', (DELIVERY_MAX_ATTEMPTS, error, delivery['id']))
+    conn.commit()
+    cursor.close()
+    
+    failed = sum(1 for error in errors if error is not None)
+    return len(deliveries) - failed, failed
+
+def handle_process_outbox(conn) -> Dict[str, Any]:
+    moved_total = 0
+    while True:
+        moved = flush_notification_outbox(conn)
+        moved_total += moved
+        if moved < OUTBOX_FLUSH_BATCH:
+            break
+    
+    delivered, failed = dispatch_notification_deliveries(conn)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'moved': moved_total, 'delivered': delivered, 'failed': failed}),
+        'isBase64Encoded': False
+    }
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -27,22 +683,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    headers = event.get('headers', {})
-    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
-    
     params = event.get('queryStringParameters') or {}
     action = params.get('action', 'messages')
     
+    rejected = admit_request(event, rate_limit_cost(method, event.get('queryStringParameters') or {}))
+    if rejected:
+        return rejected
+    
     conn = get_db_connection()
     
     try:
+        claims = authenticate(event, conn)
+        user_id = claims['sub'] if claims else None
+        
         if method == 'GET':
             if action == 'messages':
                 booking_id = params.get('booking_id')
@@ -54,96 +714,131 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT cm.*, u.name as sender_name, u.avatar_url as sender_avatar
-                    FROM chat_messages cm
-                    JOIN users u ON cm.sender_id = u.id
-                    WHERE cm.booking_id = %s
-                    ORDER BY cm.created_at ASC
-                ''', (booking_id,))
-                messages = cursor.fetchall()
-                cursor.close()
+                try:
+                    booking_id = int(booking_id)
+                    after_id = int(params['after_id']) if params.get('after_id') else None
+                    before_id = int(params['before_id']) if params.get('before_id') else None
+                    limit = int(params.get('limit', MESSAGES_DEFAULT_LIMIT))
+                    wait = float(params.get('wait', '0'))
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'booking_id, after_id, before_id, limit and wait must be numbers'}),
+                        'isBase64Encoded': False
+                    }
+                limit = max(1, min(limit, MESSAGES_MAX_LIMIT))
+                wait = max(0.0, min(wait, MESSAGES_MAX_WAIT))
                 
-                result = []
-                for msg in messages:
-                    result.append({
-                        'id': msg['id'],
-                        'booking_id': msg['booking_id'],
-                        'sender_id': msg['sender_id'],
-                        'sender_name': msg['sender_name'],
-                        'sender_avatar': msg['sender_avatar'],
-                        'message': msg['message'],
-                        'is_read': msg['is_read'],
-                        'created_at': msg['created_at'].isoformat() if msg['created_at'] else None
-                    })
+                if not claims:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Authorization required'}),
+                        'isBase64Encoded': False
+                    }
+                
+                if not can_read_booking_chat(conn, booking_id, claims):
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Not a participant of this booking'}),
+                        'isBase64Encoded': False
+                    }
+                
+                listening = wait > 0 and after_id is not None
+                if listening:
+                    set_listening(conn, f'chat_booking_{booking_id}')
+                
+                try:
+                    messages, has_more = fetch_chat_messages(conn, booking_id, after_id, before_id, limit)
+                    if not messages and listening and wait_for_pg_notify(conn, wait) is not None:
+                        messages, has_more = fetch_chat_messages(conn, booking_id, after_id, before_id, limit)
+                finally:
+                    if listening:
+                        set_listening(conn, None)
+                
+                return cached_json_response(event, {
+                    'messages': messages,
+                    'has_more': has_more
+                }, MESSAGES_MAX_AGE, private=True)
+            
+            elif action == 'notifications':
+                if not user_id:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Authorization required'}),
+                        'isBase64Encoded': False
+                    }
+                
+                result = fetch_notifications(conn, int(user_id), None)
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'messages': result}),
+                    'body': dumps_json({'notifications': result}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'notifications':
+            elif action == 'watch_notifications':
                 if not user_id:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Authorization required'}),
+                        'isBase64Encoded': False
+                    }
+                
+                try:
+                    watcher_id = int(user_id)
+                    since_id = int(params['since_id']) if params.get('since_id') else None
+                    wait = float(params.get('wait', '0'))
+                except ValueError:
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'X-User-Id header required'}),
+                        'body': json.dumps({'error': 'since_id and wait must be numbers'}),
                         'isBase64Encoded': False
                     }
+                wait = max(0.0, min(wait, NOTIFICATIONS_MAX_WAIT))
                 
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT * FROM notifications
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                    LIMIT 50
-                ''', (user_id,))
-                notifications = cursor.fetchall()
-                cursor.close()
+                listening = wait > 0 and since_id is not None
+                if listening:
+                    set_listening(conn, f'notifications_user_{watcher_id}')
                 
-                result = []
-                for notif in notifications:
-                    result.append({
-                        'id': notif['id'],
-                        'type': notif['type'],
-                        'title': notif['title'],
-                        'message': notif['message'],
-                        'link': notif['link'],
-                        'is_read': notif['is_read'],
-                        'created_at': notif['created_at'].isoformat() if notif['created_at'] else None
-                    })
+                try:
+                    result = fetch_notifications(conn, watcher_id, since_id)
+                    if not result and listening:
+                        if wait_for_pg_notify(conn, wait) is not None:
+                            result = fetch_notifications(conn, watcher_id, since_id)
+                finally:
+                    if listening:
+                        set_listening(conn, None)
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'notifications': result}),
+                    'body': dumps_json({
+                        'notifications': result,
+                        'unread_count': get_unread_count(conn, watcher_id)
+                    }),
                     'isBase64Encoded': False
                 }
             
             elif action == 'unread_count':
                 if not user_id:
                     return {
-                        'statusCode': 400,
+                        'statusCode': 401,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'X-User-Id header required'}),
+                        'body': json.dumps({'error': 'Authorization required'}),
                         'isBase64Encoded': False
                     }
                 
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT COUNT(*) as count FROM notifications
-                    WHERE user_id = %s AND is_read = false
-                ''', (user_id,))
-                result = cursor.fetchone()
-                cursor.close()
-                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'unread_count': result['count']}),
+                    'body': json.dumps({'unread_count': get_unread_count(conn, int(user_id))}),
                     'isBase64Encoded': False
                 }
         
@@ -151,19 +846,41 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             body_data = json.loads(event.get('body', '{}'))
             
             if action == 'send_message':
+                if not user_id:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Authorization required'}),
+                        'isBase64Encoded': False
+                    }
+                
                 booking_id = body_data.get('booking_id')
-                sender_id = body_data.get('sender_id')
+                sender_id = user_id
                 message = body_data.get('message')
                 
-                if not all([booking_id, sender_id, message]):
+                if not all([booking_id, message]):
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'booking_id, sender_id, and message required'}),
+                        'body': json.dumps({'error': 'booking_id and message required'}),
                         'isBase64Encoded': False
                     }
                 
                 cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT guide_id, client_id FROM bookings WHERE id = %s
+                ''', (booking_id,))
+                booking = cursor.fetchone()
+                
+                if not booking or sender_id not in (booking['guide_id'], booking['client_id']):
+                    cursor.close()
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Not a participant of this booking'}),
+                        'isBase64Encoded': False
+                    }
+                
                 cursor.execute('''
                     INSERT INTO chat_messages (booking_id, sender_id, message)
                     VALUES (%s, %s, %s)
@@ -171,26 +888,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 ''', (booking_id, sender_id, message))
                 result = cursor.fetchone()
                 
-                cursor.execute('''
-                    SELECT guide_id, client_id FROM bookings WHERE id = %s
-                ''', (booking_id,))
-                booking = cursor.fetchone()
-                
-                receiver_id = booking['guide_id'] if int(sender_id) == booking['client_id'] else booking['client_id']
+                receiver_id = booking['guide_id'] if sender_id == booking['client_id'] else booking['client_id']
                 
-                cursor.execute('''
-                    INSERT INTO notifications (user_id, type, title, message, link)
-                    VALUES (%s, %s, %s, %s, %s)
-                ''', (
+                queue_notifications(cursor, [(
                     receiver_id,
                     'message',
                     'Новое сообщение',
                     message[:100],
                     f'/booking/{booking_id}'
-                ))
+                )])
                 
                 conn.commit()
                 cursor.close()
+                kick_outbox_flush()
                 
                 return {
                     'statusCode': 201,
@@ -202,38 +912,105 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            elif action == 'process_outbox':
+                if not is_worker_request(event, claims):
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Worker secret or admin token required'}),
+                        'isBase64Encoded': False
+                    }
+                return handle_process_outbox(conn)
+            
+            elif action == 'broadcast':
+                if not claims or claims.get('role') != 'admin':
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Only admins can broadcast notifications'}),
+                        'isBase64Encoded': False
+                    }
+                
+                role = body_data.get('role')
+                notif_type = body_data.get('type', 'system')
+                title = body_data.get('title')
+                message = body_data.get('message')
+                link = body_data.get('link')
+                
+                if not all([title, message]) or notif_type not in NOTIFICATION_TYPES or (role and role not in BROADCAST_ROLES):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'title and message required, role must be client, guide or admin'}),
+                        'isBase64Encoded': False
+                    }
+                
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO notification_outbox (user_id, type, title, message, link)
+                    SELECT id, %s, %s, %s, %s
+                    FROM users
+                    WHERE %s IS NULL OR role = %s
+                ''', (notif_type, title, message, link, role, role))
+                queued = cursor.rowcount
+                conn.commit()
+                cursor.close()
+                kick_outbox_flush()
+                
+                return {
+                    'statusCode': 202,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'queued': queued}),
+                    'isBase64Encoded': False
+                }
+            
             elif action == 'create_notification':
-                user_id_target = body_data.get('user_id')
+                if not claims:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Authorization required'}),
+                        'isBase64Encoded': False
+                    }
+                
                 notif_type = body_data.get('type')
                 title = body_data.get('title')
                 message = body_data.get('message')
                 link = body_data.get('link')
+                recipients = parse_recipient_ids(body_data.get('user_ids', body_data.get('user_id')))
                 
-                if not all([user_id_target, notif_type, title, message]):
+                if not recipients or not all([title, message]) or notif_type not in NOTIFICATION_TYPES:
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'user_id, type, title, and message required'}),
+                        'body': json.dumps({'error': f'user_id or up to {MAX_NOTIFICATION_RECIPIENTS} numeric user_ids, a known type, title, and message required'}),
+                        'isBase64Encoded': False
+                    }
+                
+                if claims.get('role') != 'admin' and recipients != [claims['sub']]:
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Only admins can notify other users'}),
                         'isBase64Encoded': False
                     }
                 
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO notifications (user_id, type, title, message, link)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id, created_at
-                ''', (user_id_target, notif_type, title, message, link))
-                result = cursor.fetchone()
+                    INSERT INTO notification_outbox (user_id, type, title, message, link)
+                    SELECT id, %s, %s, %s, %s
+                    FROM users
+                    WHERE id = ANY(%s)
+                ''', (notif_type, title, message, link, recipients))
+                queued = cursor.rowcount
                 conn.commit()
                 cursor.close()
+                kick_outbox_flush()
                 
                 return {
-                    'statusCode': 201,
+                    'statusCode': 202,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'id': result['id'],
-                        'created_at': result['created_at'].isoformat() if result['created_at'] else None
-                    }),
+                    'body': json.dumps({'queued': queued}),
                     'isBase64Encoded': False
                 }
         
@@ -241,6 +1018,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             body_data = json.loads(event.get('body', '{}'))
             
             if action == 'mark_read':
+                if not user_id:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Authorization required'}),
+                        'isBase64Encoded': False
+                    }
+                
                 notification_id = body_data.get('notification_id')
                 
                 if not notification_id:
@@ -253,11 +1038,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 cursor = conn.cursor()
                 cursor.execute('''
-                    UPDATE notifications SET is_read = true WHERE id = %s
-                ''', (notification_id,))
+                    UPDATE notifications SET is_read = true WHERE id = %s AND user_id = %s
+                    RETURNING user_id
+                ''', (notification_id, user_id))
+                updated = cursor.fetchone()
                 conn.commit()
                 cursor.close()
                 
+                if not updated:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Notification not found'}),
+                        'isBase64Encoded': False
+                    }
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -268,15 +1063,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             elif action == 'mark_all_read':
                 if not user_id:
                     return {
-                        'statusCode': 400,
+                        'statusCode': 401,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'X-User-Id header required'}),
+                        'body': json.dumps({'error': 'Authorization required'}),
                         'isBase64Encoded': False
                     }
                 
                 cursor = conn.cursor()
                 cursor.execute('''
-                    UPDATE notifications SET is_read = true WHERE user_id = %s
+                    UPDATE notifications SET is_read = true WHERE user_id = %s AND is_read = false
                 ''', (user_id,))
                 conn.commit()
                 cursor.close()
@@ -296,4 +1091,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     finally:
-        conn.close()
+        release_db_connection(conn)
@@ -5,18 +5,323 @@ Args: event - dict with httpMethod, queryStringParameters, body
 Returns: HTTP response with tours data or operation result
 '''
 
+import base64
+import hashlib
+import hmac
 import json
+import math
 import os
-from typing import Dict, Any, List
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from datetime import date, datetime
+from decimal import Decimal
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_DEBUG = os.environ.get('DB_POOL_DEBUG', 'false') == 'true'
+
+_db_pool: List[Tuple[Any, float]] = []
+_db_pool_lock = threading.Lock()
+_db_pool_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0}
+
+def _connection_is_healthy(conn, idle_seconds: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_seconds < DB_POOL_PING_AFTER:
+        return True
+    try:
+        ping_cursor = conn.cursor()
+        ping_cursor.execute('SELECT 1')
+        ping_cursor.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
 def get_db_connection():
+    while True:
+        with _db_pool_lock:
+            if not _db_pool:
+                break
+            conn, released_at = _db_pool.pop()
+        if _connection_is_healthy(conn, time.monotonic() - released_at):
+            with _db_pool_lock:
+                _db_pool_stats['hits'] += 1
+            return conn
+        with _db_pool_lock:
+            _db_pool_stats['reconnects'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+    
     database_url = os.environ.get('DATABASE_URL')
     if not database_url:
         raise ValueError('DATABASE_URL environment variable is not set')
+    with _db_pool_lock:
+        _db_pool_stats['misses'] += 1
+    if DB_POOL_DEBUG:
+        print(f'db pool miss: {db_pool_stats()}')
     return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
 
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        conn.close()
+        return
+    with _db_pool_lock:
+        if len(_db_pool) < DB_POOL_MAX_SIZE:
+            _db_pool.append((conn, time.monotonic()))
+            return
+        _db_pool_stats['discarded'] += 1
+    conn.close()
+
+def db_pool_stats() -> Dict[str, int]:
+    with _db_pool_lock:
+        return dict(_db_pool_stats, idle=len(_db_pool), max_size=DB_POOL_MAX_SIZE)
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps_json(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default).decode()
+    return json.dumps(payload, default=_json_default)
+
+RENDER_MODES = ('python', 'sql')
+DEFAULT_RENDER_MODE = os.environ.get('RENDER_MODE', 'python')
+
+def cached_json_response(event: Dict[str, Any], payload: Any, max_age: int, private: bool = False) -> Dict[str, Any]:
+    return cached_json_body_response(event, dumps_json(payload), max_age, private)
+
+def cached_json_body_response(event: Dict[str, Any], body: str, max_age: int, private: bool = False) -> Dict[str, Any]:
+    etag = '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': f"{'private' if private else 'public'}, max-age={max_age}",
+        'ETag': etag
+    }
+    
+    request_headers = event.get('headers') or {}
+    if_none_match = request_headers.get('If-None-Match') or request_headers.get('if-none-match')
+    if if_none_match:
+        candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        if etag in candidates or '*' in candidates:
+            return {
+                'statusCode': 304,
+                'headers': headers,
+                'body': '',
+                'isBase64Encoded': False
+            }
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+CATALOG_MAX_AGE = 30
+AVAILABILITY_MAX_AGE = 15
+
+CATALOG_FIELDS = {
+    'id': 't.id',
+    'title': 't.title',
+    'city': 't.city',
+    'price': 't.price',
+    'duration': 't.duration',
+    'short_description': 't.short_description',
+    'full_description': 't.full_description',
+    'image_url': 't.image_url',
+    'image_variants': 't.image_variants',
+    'rating': 'COALESCE(t.rating, 0)',
+    'reviews_count': 't.reviews_count',
+    'guide_name': 'u.name',
+    'guide_avatar': 'u.avatar_url',
+    'instant_booking': 't.instant_booking',
+    'max_guests': 't.max_guests'
+}
+
+CATALOG_DEFAULT_FIELDS = [
+    'id', 'title', 'city', 'price', 'duration', 'short_description', 'image_url', 'image_variants',
+    'rating', 'reviews_count', 'guide_name', 'guide_avatar', 'instant_booking'
+]
+
+CATALOG_DEFAULT_LIMIT = 50
+CATALOG_MAX_LIMIT = 100
+
+def encode_catalog_cursor(sort_key: str, tour_id: int) -> str:
+    raw = f'{sort_key}|{tour_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_catalog_cursor(cursor_value: str) -> Tuple[str, int]:
+    padded = cursor_value + '=' * (-len(cursor_value) % 4)
+    raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    sort_key, tour_id_str = raw.split('|', 1)
+    return sort_key, int(tour_id_str)
+
+CATALOG_FACETS_TTL = float(os.environ.get('CATALOG_FACETS_TTL', '60'))
+
+_catalog_facets_cache: Dict[str, Any] = {'facets': None, 'expires_at': 0.0}
+_catalog_facets_lock = threading.Lock()
+
+def invalidate_catalog_facets() -> None:
+    with _catalog_facets_lock:
+        _catalog_facets_cache['facets'] = None
+        _catalog_facets_cache['expires_at'] = 0.0
+
+def get_catalog_facets(conn) -> Dict[str, Any]:
+    now = time.monotonic()
+    with _catalog_facets_lock:
+        if _catalog_facets_cache['facets'] is not None and now < _catalog_facets_cache['expires_at']:
+            return _catalog_facets_cache['facets']
+    
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT city, COUNT(*) as tours_count, MIN(price) as min_price, MAX(price) as max_price
+        FROM t_p71176016_tour_booking_platfor.tours
+        WHERE status = 'active'
+        GROUP BY city
+        ORDER BY city
+    ''')
+    rows = cursor.fetchall()
+    cursor.close()
+    
+    facets = {
+        'cities': [{'city': row['city'], 'count': row['tours_count']} for row in rows],
+        'price': {
+            'min': float(min(row['min_price'] for row in rows)) if rows else 0,
+            'max': float(max(row['max_price'] for row in rows)) if rows else 0
+        }
+    }
+    
+    with _catalog_facets_lock:
+        _catalog_facets_cache['facets'] = facets
+        _catalog_facets_cache['expires_at'] = now + CATALOG_FACETS_TTL
+    return facets
+
+CATALOG_COUNT_MODES = ('exact', 'estimate', 'cached')
+CATALOG_COUNT_CACHE_TTL = float(os.environ.get('CATALOG_COUNT_CACHE_TTL', '60'))
+CATALOG_COUNT_CACHE_MAX_SIZE = 256
+
+_catalog_count_cache: Dict[Tuple[Any, ...], Tuple[int, float]] = {}
+_catalog_count_lock = threading.Lock()
+
+def invalidate_catalog_counts() -> None:
+    with _catalog_count_lock:
+        _catalog_count_cache.clear()
+
+def count_catalog_tours(conn, where_sql: str, query_params: List[Any], count_mode: str) -> Tuple[int, str]:
+    cursor = conn.cursor()
+    
+    if count_mode == 'estimate':
+        cursor.execute(f'''
+            EXPLAIN (FORMAT JSON)
+            SELECT 1 FROM t_p71176016_tour_booking_platfor.tours t
+            WHERE {where_sql}
+        ''', query_params)
+        plan = cursor.fetchone()['QUERY PLAN']
+        cursor.close()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows']), 'estimate'
+    
+    cache_key = (where_sql, tuple(query_params))
+    if count_mode == 'cached':
+        with _catalog_count_lock:
+            cached = _catalog_count_cache.get(cache_key)
+        if cached and time.monotonic() < cached[1]:
+            cursor.close()
+            return cached[0], 'cached'
+    
+    cursor.execute(f'''
+        SELECT COUNT(*) as total
+        FROM t_p71176016_tour_booking_platfor.tours t
+        WHERE {where_sql}
+    ''', query_params)
+    total_count = cursor.fetchone()['total']
+    cursor.close()
+    
+    if count_mode == 'cached':
+        with _catalog_count_lock:
+            if len(_catalog_count_cache) >= CATALOG_COUNT_CACHE_MAX_SIZE:
+                _catalog_count_cache.pop(next(iter(_catalog_count_cache)))
+            _catalog_count_cache[cache_key] = (total_count, time.monotonic() + CATALOG_COUNT_CACHE_TTL)
+    return total_count, 'exact'
+
+def render_catalog_in_sql(event: Dict[str, Any], conn, fields: List[str], select_sql: str, search: Any,
+                          relevance_sql: str, relevance_params: List[Any], sort_sql: str, sort_params: List[Any],
+                          page_where_sql: str, page_params: List[Any], limit: int, meta: Dict[str, Any]) -> Dict[str, Any]:
+    object_sql = ', '.join(f"'{field}', page.{field}" for field in fields)
+    if search:
+        object_sql += ", 'relevance', round(page.relevance::numeric, 4)"
+    
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT
+            COALESCE(
+                json_agg(json_build_object({object_sql}) ORDER BY page.row_number)
+                    FILTER (WHERE page.row_number <= %s),
+                '[]'::json
+            )::text as tours_json,
+            MAX(page.cursor_id) FILTER (WHERE page.row_number = %s) as last_id,
+            MAX(page.cursor_created_at) FILTER (WHERE page.row_number = %s) as last_created_at,
+            MAX(page.relevance) FILTER (WHERE page.row_number = %s) as last_relevance,
+            COUNT(*) > %s as has_more
+        FROM (
+            SELECT 
+                t.id as cursor_id,
+                t.created_at as cursor_created_at,
+                {select_sql},
+                {relevance_sql} as relevance,
+                ROW_NUMBER() OVER (ORDER BY {sort_sql} DESC, t.id DESC) as row_number
+            FROM t_p71176016_tour_booking_platfor.tours t
+            JOIN t_p71176016_tour_booking_platfor.users u ON t.guide_id = u.id
+            WHERE {page_where_sql}
+            ORDER BY {sort_sql} DESC, t.id DESC
+            LIMIT %s
+        ) page
+    ''', [limit] * 5 + relevance_params + sort_params + page_params + sort_params + [limit + 1])
+    page = cursor.fetchone()
+    cursor.close()
+    
+    next_cursor = None
+    if page['has_more']:
+        if search:
+            sort_key = repr(page['last_relevance'])
+        else:
+            sort_key = page['last_created_at'].isoformat()
+        next_cursor = encode_catalog_cursor(sort_key, page['last_id'])
+    
+    facets = get_catalog_facets(conn)
+    envelope = dumps_json(dict(
+        meta,
+        cities=[item['city'] for item in facets['cities']],
+        facets=facets,
+        next_cursor=next_cursor
+    ))
+    body = '{"tours":' + page['tours_json'] + ',' + envelope[1:]
+    return cached_json_body_response(event, body, CATALOG_MAX_AGE)
+
 def handle_catalog(event: Dict[str, Any], conn) -> Dict[str, Any]:
     params = event.get('queryStringParameters') or {}
     
@@ -24,8 +329,44 @@ def handle_catalog(event: Dict[str, Any], conn) -> Dict[str, Any]:
     min_price = params.get('min_price')
     max_price = params.get('max_price')
     search = params.get('search')
-    limit = int(params.get('limit', '50'))
-    offset = int(params.get('offset', '0'))
+    cursor_param = params.get('cursor')
+    count_mode = params.get('count_mode', 'cached')
+    fields_param = params.get('fields')
+    render_mode = params.get('render', DEFAULT_RENDER_MODE)
+    
+    if render_mode not in RENDER_MODES:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'render must be python or sql'}),
+            'isBase64Encoded': False
+        }
+    
+    fields = list(dict.fromkeys(
+        field.strip() for field in fields_param.split(',') if field.strip()
+    )) if fields_param else CATALOG_DEFAULT_FIELDS
+    unknown_fields = [field for field in fields if field not in CATALOG_FIELDS]
+    if unknown_fields or not fields:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f"Unknown fields: {', '.join(unknown_fields) or '(empty)'}"}),
+            'isBase64Encoded': False
+        }
+    
+    if count_mode not in CATALOG_COUNT_MODES:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'count_mode must be exact, estimate or cached'}),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        limit = int(params.get('limit', CATALOG_DEFAULT_LIMIT))
+    except ValueError:
+        limit = CATALOG_DEFAULT_LIMIT
+    limit = max(1, min(limit, CATALOG_MAX_LIMIT))
     
     where_clauses = ["t.status = 'active'"]
     query_params: List[Any] = []
@@ -43,75 +384,122 @@ def handle_catalog(event: Dict[str, Any], conn) -> Dict[str, Any]:
         query_params.append(float(max_price))
     
     if search:
-        where_clauses.append('(t.title ILIKE %s OR t.short_description ILIKE %s)')
-        query_params.append(f'%{search}%')
-        query_params.append(f'%{search}%')
+        where_clauses.append(
+            "(t.search_vector @@ websearch_to_tsquery('russian', %s) OR %s <%% t.title)"
+        )
+        query_params.append(search)
+        query_params.append(search)
+        relevance_sql = (
+            "(ts_rank_cd(t.search_vector, websearch_to_tsquery('russian', %s))"
+            " + word_similarity(%s, t.title))::real"
+        )
+        relevance_params: List[Any] = [search, search]
+        sort_sql = relevance_sql
+        sort_params = relevance_params
+    else:
+        relevance_sql = 'NULL::real'
+        relevance_params = []
+        sort_sql = 't.created_at'
+        sort_params = []
     
     where_sql = ' AND '.join(where_clauses)
     
-    cursor = conn.cursor()
+    page_where_sql = where_sql
+    page_params = list(query_params)
+    if cursor_param:
+        try:
+            sort_key, after_id = decode_catalog_cursor(cursor_param)
+            after_sort_value = float(sort_key) if search else datetime.fromisoformat(sort_key)
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Invalid cursor'}),
+                'isBase64Encoded': False
+            }
+        if search:
+            page_where_sql += f' AND ({sort_sql}, t.id) < (%s::real, %s)'
+        else:
+            page_where_sql += f' AND ({sort_sql}, t.id) < (%s, %s)'
+        page_params += sort_params + [after_sort_value, after_id]
     
-    count_query = f'''
-        SELECT COUNT(*) as total
-        FROM t_p71176016_tour_booking_platfor.tours t
-        WHERE {where_sql}
-    '''
-    cursor.execute(count_query, query_params)
-    total_count = cursor.fetchone()['total']
+    total_count, total_mode = count_catalog_tours(conn, where_sql, query_params, count_mode)
+    
+    select_sql = ',\n            '.join(
+        f'{CATALOG_FIELDS[field]} as {field}' for field in fields
+    )
+    
+    if render_mode == 'sql':
+        return render_catalog_in_sql(
+            event, conn, fields, select_sql, search,
+            relevance_sql, relevance_params, sort_sql, sort_params,
+            page_where_sql, page_params, limit, {
+                'total': total_count,
+                'total_mode': total_mode,
+                'limit': limit
+            }
+        )
+    
+    cursor = conn.cursor()
     
     tours_query = f'''
         SELECT 
-            t.*,
-            u.name as guide_name,
-            u.avatar_url as guide_avatar
+            t.id as cursor_id,
+            t.created_at as cursor_created_at,
+            {select_sql},
+            {relevance_sql} as relevance
         FROM t_p71176016_tour_booking_platfor.tours t
         JOIN t_p71176016_tour_booking_platfor.users u ON t.guide_id = u.id
-        WHERE {where_sql}
-        ORDER BY t.created_at DESC
-        LIMIT %s OFFSET %s
+        WHERE {page_where_sql}
+        ORDER BY {sort_sql} DESC, t.id DESC
+        LIMIT %s
     '''
-    tours_query_params = query_params + [limit, offset]
+    tours_query_params = relevance_params + page_params + sort_params + [limit + 1]
     
     cursor.execute(tours_query, tours_query_params)
     tours = cursor.fetchall()
     
-    cursor.execute('''
-        SELECT DISTINCT city FROM t_p71176016_tour_booking_platfor.tours WHERE status = 'active' ORDER BY city
-    ''')
-    cities = [row['city'] for row in cursor.fetchall()]
+    next_cursor = None
+    if len(tours) > limit:
+        tours = tours[:limit]
+        last_tour = tours[-1]
+        if search:
+            sort_key = repr(last_tour['relevance'])
+        else:
+            sort_key = last_tour['cursor_created_at'].isoformat()
+        next_cursor = encode_catalog_cursor(sort_key, last_tour['cursor_id'])
     
     cursor.close()
     
-    result = []
+    facets = get_catalog_facets(conn)
+    
     for tour in tours:
-        result.append({
-            'id': tour['id'],
-            'title': tour['title'],
-            'city': tour['city'],
-            'price': float(tour['price']),
-            'duration': tour['duration'],
-            'short_description': tour['short_description'],
-            'full_description': tour['full_description'],
-            'image_url': tour['image_url'],
-            'rating': float(tour['rating']) if tour['rating'] else 0,
-            'reviews_count': tour['reviews_count'],
-            'guide_name': tour['guide_name'],
-            'guide_avatar': tour['guide_avatar'],
-            'instant_booking': tour['instant_booking']
-        })
+        del tour['cursor_id']
+        del tour['cursor_created_at']
+        relevance = tour.pop('relevance')
+        if search:
+            tour['relevance'] = round(relevance, 4)
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'tours': result,
-            'total': total_count,
-            'cities': cities,
-            'limit': limit,
-            'offset': offset
-        }),
-        'isBase64Encoded': False
-    }
+    return cached_json_response(event, {
+        'tours': tours,
+        'total': total_count,
+        'total_mode': total_mode,
+        'cities': [item['city'] for item in facets['cities']],
+        'facets': facets,
+        'limit': limit,
+        'next_cursor': next_cursor
+    }, CATALOG_MAX_AGE)
+
+AVAILABILITY_BATCH_MAX_TOURS = 100
+
+def is_valid_date_window(date_from: Any, date_to: Any) -> bool:
+    try:
+        for value in (date_from, date_to):
+            if value:
+                date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
 
 def handle_availability(event: Dict[str, Any], conn) -> Dict[str, Any]:
     params = event.get('queryStringParameters') or {}
@@ -125,6 +513,16 @@ def handle_availability(event: Dict[str, Any], conn) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    date_from = params.get('date_from')
+    date_to = params.get('date_to')
+    if not is_valid_date_window(date_from, date_to):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'date_from and date_to must be YYYY-MM-DD'}),
+            'isBase64Encoded': False
+        }
+    
     cursor = conn.cursor()
     
     cursor.execute(
@@ -145,37 +543,285 @@ def handle_availability(event: Dict[str, Any], conn) -> Dict[str, Any]:
     max_guests = tour_row['max_guests'] or 8
     
     cursor.execute(
-        """SELECT booking_date, SUM(guests_count) as total_booked
-        FROM t_p71176016_tour_booking_platfor.bookings
+        """SELECT date, GREATEST(capacity - reserved, 0) as available
+        FROM t_p71176016_tour_booking_platfor.tour_availability
         WHERE tour_id = %s
-          AND status IN ('pending', 'confirmed')
-          AND booking_date >= CURRENT_DATE
-        GROUP BY booking_date
-        ORDER BY booking_date""",
+          AND date >= COALESCE(%s::date, CURRENT_DATE)
+          AND (%s::date IS NULL OR date <= %s::date)
+        ORDER BY date""",
+        (tour_id, date_from, date_to, date_to)
+    )
+    
+    rows = cursor.fetchall()
+    cursor.close()
+    
+    availability = {row['date'].isoformat(): row['available'] for row in rows}
+    
+    return cached_json_response(event, {
+        'tour_id': int(tour_id),
+        'max_guests': max_guests,
+        'availability': availability
+    }, AVAILABILITY_MAX_AGE)
+
+def handle_availability_batch(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    params = event.get('queryStringParameters') or {}
+    date_from = params.get('date_from')
+    date_to = params.get('date_to')
+    
+    try:
+        tour_ids = sorted({int(value) for value in params.get('tour_ids', '').split(',') if value.strip()})
+    except ValueError:
+        tour_ids = []
+    
+    if not tour_ids or len(tour_ids) > AVAILABILITY_BATCH_MAX_TOURS:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'tour_ids must list 1 to {AVAILABILITY_BATCH_MAX_TOURS} numeric ids'}),
+            'isBase64Encoded': False
+        }
+    
+    if not is_valid_date_window(date_from, date_to):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'date_from and date_to must be YYYY-MM-DD'}),
+            'isBase64Encoded': False
+        }
+    
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT t.id as tour_id, t.max_guests, ta.date,
+                  GREATEST(ta.capacity - ta.reserved, 0) as available
+        FROM t_p71176016_tour_booking_platfor.tours t
+        LEFT JOIN t_p71176016_tour_booking_platfor.tour_availability ta
+          ON ta.tour_id = t.id
+         AND ta.date >= COALESCE(%s::date, CURRENT_DATE)
+         AND (%s::date IS NULL OR ta.date <= %s::date)
+        WHERE t.id = ANY(%s)
+        ORDER BY t.id, ta.date""",
+        (date_from, date_to, date_to, tour_ids)
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    
+    tours: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        entry = tours.setdefault(str(row['tour_id']), {
+            'max_guests': row['max_guests'] or 8,
+            'availability': {}
+        })
+        if row['date'] is not None:
+            entry['availability'][row['date'].isoformat()] = row['available']
+    
+    return cached_json_response(event, {'tours': tours}, AVAILABILITY_MAX_AGE)
+
+TOUR_DETAIL_TTL = float(os.environ.get('TOUR_DETAIL_TTL', '300'))
+TOUR_DETAIL_CACHE_MAX_SIZE = 512
+TOUR_DETAIL_DEFAULT_DATES = 14
+TOUR_DETAIL_MAX_DATES = 60
+TOUR_DETAIL_MAX_AGE = 15
+
+_tour_detail_cache: Dict[int, Tuple[Dict[str, Any], float, Any]] = {}
+_tour_detail_lock = threading.Lock()
+
+def invalidate_tour_detail(tour_id: Any) -> None:
+    with _tour_detail_lock:
+        _tour_detail_cache.pop(int(tour_id), None)
+
+def load_tour_detail(conn, tour_id: int) -> Optional[Dict[str, Any]]:
+    """Cached per instance and keyed on tours.updated_at, which other functions bump (moderation, image variants)."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT updated_at FROM t_p71176016_tour_booking_platfor.tours WHERE id = %s",
+        (tour_id,)
+    )
+    version_row = cursor.fetchone()
+    if not version_row:
+        cursor.close()
+        return None
+    version = version_row['updated_at']
+    
+    with _tour_detail_lock:
+        cached = _tour_detail_cache.get(tour_id)
+    if cached and cached[2] == version and time.monotonic() < cached[1]:
+        cursor.close()
+        return cached[0]
+    
+    cursor.execute(
+        """SELECT t.id, t.title, t.city, t.price, t.duration, t.short_description,
+                  t.full_description, t.image_url, t.image_variants, t.rating, t.reviews_count,
+                  t.status, t.instant_booking, t.max_guests,
+                  u.id as guide_id, u.name as guide_name, u.avatar_url as guide_avatar,
+                  u.bio as guide_bio, u.city as guide_city, u.languages as guide_languages,
+                  u.experience_years as guide_experience_years,
+                  u.specialization as guide_specialization
+        FROM t_p71176016_tour_booking_platfor.tours t
+        JOIN t_p71176016_tour_booking_platfor.users u ON t.guide_id = u.id
+        WHERE t.id = %s""",
         (tour_id,)
     )
+    tour = cursor.fetchone()
+    
+    if not tour:
+        cursor.close()
+        return None
     
-    bookings = cursor.fetchall()
+    cursor.execute(
+        """SELECT rating, COUNT(*) as reviews
+        FROM t_p71176016_tour_booking_platfor.reviews
+        WHERE tour_id = %s
+        GROUP BY rating""",
+        (tour_id,)
+    )
+    distribution = {str(star): 0 for star in range(1, 6)}
+    for row in cursor.fetchall():
+        distribution[str(row['rating'])] = row['reviews']
     cursor.close()
     
-    availability = {}
-    for row in bookings:
-        date_str = row['booking_date'].isoformat()
-        total_booked = row['total_booked']
-        available = max_guests - total_booked
-        availability[date_str] = max(0, available)
+    reviews_total = sum(distribution.values())
+    detail = {
+        'id': tour['id'],
+        'title': tour['title'],
+        'city': tour['city'],
+        'price': float(tour['price']),
+        'duration': tour['duration'],
+        'short_description': tour['short_description'],
+        'full_description': tour['full_description'],
+        'image_url': tour['image_url'],
+        'image_variants': tour['image_variants'],
+        'status': tour['status'],
+        'instant_booking': tour['instant_booking'],
+        'max_guests': tour['max_guests'] or 8,
+        'guide': {
+            'id': tour['guide_id'],
+            'name': tour['guide_name'],
+            'avatar_url': tour['guide_avatar'],
+            'bio': tour['guide_bio'],
+            'city': tour['guide_city'],
+            'languages': tour['guide_languages'],
+            'experience_years': tour['guide_experience_years'],
+            'specialization': tour['guide_specialization']
+        },
+        'rating_summary': {
+            'rating': float(tour['rating']) if tour['rating'] else 0,
+            'reviews_count': tour['reviews_count'],
+            'reviews_average': round(
+                sum(int(star) * count for star, count in distribution.items()) / reviews_total, 2
+            ) if reviews_total else 0,
+            'distribution': distribution
+        }
+    }
+    
+    with _tour_detail_lock:
+        if len(_tour_detail_cache) >= TOUR_DETAIL_CACHE_MAX_SIZE:
+            _tour_detail_cache.pop(next(iter(_tour_detail_cache)))
+        _tour_detail_cache[tour_id] = (detail, time.monotonic() + TOUR_DETAIL_TTL, version)
+    return detail
+
+def handle_tour_detail(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    params = event.get('queryStringParameters') or {}
+    
+    try:
+        tour_id = int(params.get('id', ''))
+        dates_limit = int(params.get('dates', TOUR_DETAIL_DEFAULT_DATES))
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'id is required and must be a number'}),
+            'isBase64Encoded': False
+        }
+    dates_limit = max(0, min(dates_limit, TOUR_DETAIL_MAX_DATES))
+    
+    detail = load_tour_detail(conn, tour_id)
+    private = bool(detail) and detail['status'] != 'active'
+    if private:
+        claims = authenticate(event, conn)
+        if not claims or (claims['sub'] != detail['guide']['id'] and claims.get('role') != 'admin'):
+            detail = None
+    
+    if not detail:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Tour not found'}),
+            'isBase64Encoded': False
+        }
+    
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT date, GREATEST(capacity - reserved, 0) as available
+        FROM t_p71176016_tour_booking_platfor.tour_availability
+        WHERE tour_id = %s AND date >= CURRENT_DATE
+        ORDER BY date
+        LIMIT %s""",
+        (tour_id, dates_limit)
+    )
+    availability = {row['date'].isoformat(): row['available'] for row in cursor.fetchall()}
+    cursor.close()
+    
+    return cached_json_response(event, dict(detail, availability=availability), TOUR_DETAIL_MAX_AGE, private=private)
+
+def handle_reconcile_availability(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    body_data = json.loads(event.get('body') or '{}')
+    tour_id = body_data.get('tour_id')
+    
+    cursor = conn.cursor()
+    cursor.execute(
+        "LOCK TABLE t_p71176016_tour_booking_platfor.tour_availability IN SHARE ROW EXCLUSIVE MODE"
+    )
+    
+    cursor.execute(
+        """INSERT INTO t_p71176016_tour_booking_platfor.tour_availability (tour_id, date, capacity, reserved)
+        SELECT b.tour_id, b.booking_date, COALESCE(t.max_guests, 8), SUM(b.guests_count)
+        FROM t_p71176016_tour_booking_platfor.bookings b
+        JOIN t_p71176016_tour_booking_platfor.tours t ON t.id = b.tour_id
+        WHERE b.status IN ('pending', 'confirmed')
+          AND (%s::int IS NULL OR b.tour_id = %s::int)
+        GROUP BY b.tour_id, b.booking_date, t.max_guests
+        ON CONFLICT (tour_id, date) DO UPDATE
+        SET reserved = EXCLUDED.reserved, updated_at = CURRENT_TIMESTAMP
+        WHERE tour_availability.reserved <> EXCLUDED.reserved""",
+        (tour_id, tour_id)
+    )
+    corrected = cursor.rowcount
+    
+    cursor.execute(
+        """UPDATE t_p71176016_tour_booking_platfor.tour_availability ta
+        SET reserved = 0, updated_at = CURRENT_TIMESTAMP
+        WHERE ta.reserved <> 0
+          AND (%s::int IS NULL OR ta.tour_id = %s::int)
+          AND NOT EXISTS (
+              SELECT 1 FROM t_p71176016_tour_booking_platfor.bookings b
+              WHERE b.tour_id = ta.tour_id
+                AND b.booking_date = ta.date
+                AND b.status IN ('pending', 'confirmed')
+          )""",
+        (tour_id, tour_id)
+    )
+    released = cursor.rowcount
+    
+    conn.commit()
+    cursor.close()
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
         'isBase64Encoded': False,
         'body': json.dumps({
-            'tour_id': int(tour_id),
-            'max_guests': max_guests,
-            'availability': availability
+            'success': True,
+            'corrected': corrected,
+            'released': released
         })
     }
 
+IMAGE_HASH_PATTERN = re.compile(r'/([0-9a-f]{64})$')
+
+def image_hash_from_url(url: str) -> Optional[str]:
+    match = IMAGE_HASH_PATTERN.search(url)
+    return match.group(1) if match else None
+
 def handle_create_tour(event: Dict[str, Any], conn) -> Dict[str, Any]:
     body_data = json.loads(event.get('body', '{}'))
     
@@ -214,11 +860,12 @@ def handle_create_tour(event: Dict[str, Any], conn) -> Dict[str, Any]:
         INSERT INTO t_p71176016_tour_booking_platfor.tours (
             title, city, price, duration, 
             short_description, full_description, 
-            image_url, guide_id, status, instant_booking, max_guests
+            image_url, image_variants, guide_id, status, instant_booking, max_guests
         ) VALUES (
             %s, %s, %s, %s, 
             %s, %s, 
-            %s, 1, 'pending', %s, 10
+            %s, (SELECT variants FROM t_p71176016_tour_booking_platfor.image_blobs WHERE hash = %s),
+            1, 'pending', %s, 10
         ) RETURNING id
     """, (
         body_data['title'],
@@ -228,12 +875,15 @@ def handle_create_tour(event: Dict[str, Any], conn) -> Dict[str, Any]:
         body_data['short_description'],
         body_data['full_description'],
         body_data.get('image_url', ''),
+        image_hash_from_url(body_data.get('image_url') or ''),
         body_data.get('instant_booking', False)
     ))
     
     tour_id = cursor.fetchone()['id']
     conn.commit()
     cursor.close()
+    invalidate_catalog_facets()
+    invalidate_catalog_counts()
     
     return {
         'statusCode': 201,
@@ -286,6 +936,9 @@ def handle_moderation(event: Dict[str, Any], conn) -> Dict[str, Any]:
     )
     conn.commit()
     cursor.close()
+    invalidate_catalog_facets()
+    invalidate_catalog_counts()
+    invalidate_tour_detail(tour_id)
     
     return {
         'statusCode': 200,
@@ -299,6 +952,209 @@ def handle_moderation(event: Dict[str, Any], conn) -> Dict[str, Any]:
         })
     }
 
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+REVOKED_TOKENS_TTL = float(os.environ.get('REVOKED_TOKENS_TTL', '30'))
+WORKER_SECRET = os.environ.get('WORKER_SECRET', '')
+
+_revoked_tokens: set = set()
+_revoked_tokens_lock = threading.Lock()
+_revoked_tokens_state: Dict[str, float] = {'loaded_at': float('-inf')}
+
+def _b64url_decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign_auth_token(signing_input: str) -> bytes:
+    if not AUTH_TOKEN_SECRET:
+        raise ValueError('AUTH_TOKEN_SECRET environment variable is not set')
+    return hmac.new(AUTH_TOKEN_SECRET.encode(), signing_input.encode(), hashlib.sha256).digest()
+
+def decode_auth_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        header_b64, payload_b64, signature_b64 = token.split('.')
+        signature = _b64url_decode(signature_b64)
+        if not hmac.compare_digest(_sign_auth_token(f'{header_b64}.{payload_b64}'), signature):
+            return None
+        header = json.loads(_b64url_decode(header_b64))
+        claims = json.loads(_b64url_decode(payload_b64))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(header, dict) or header.get('alg') != 'HS256' or not isinstance(claims, dict):
+        return None
+    if not isinstance(claims.get('exp'), (int, float)) or claims['exp'] <= time.time():
+        return None
+    return claims
+
+def is_token_revoked(conn, jti: Any) -> bool:
+    now = time.monotonic()
+    with _revoked_tokens_lock:
+        stale = now - _revoked_tokens_state['loaded_at'] >= REVOKED_TOKENS_TTL
+    if stale:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT jti FROM t_p71176016_tour_booking_platfor.revoked_tokens WHERE expires_at > NOW()"
+        )
+        revoked = {row['jti'] for row in cursor.fetchall()}
+        cursor.close()
+        with _revoked_tokens_lock:
+            _revoked_tokens.clear()
+            _revoked_tokens.update(revoked)
+            _revoked_tokens_state['loaded_at'] = now
+    with _revoked_tokens_lock:
+        return jti in _revoked_tokens
+
+def authenticate(event: Dict[str, Any], conn) -> Optional[Dict[str, Any]]:
+    """Claims of a valid, unrevoked bearer token; the denylist is reloaded at most every REVOKED_TOKENS_TTL seconds."""
+    headers = event.get('headers') or {}
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    claims = decode_auth_token(token.strip())
+    if claims is None or is_token_revoked(conn, claims.get('jti')):
+        return None
+    return claims
+
+def is_worker_request(event: Dict[str, Any], claims: Optional[Dict[str, Any]]) -> bool:
+    """Timer triggers send X-Worker-Secret; an admin token is accepted for manual runs."""
+    if claims and claims.get('role') == 'admin':
+        return True
+    headers = event.get('headers') or {}
+    supplied = headers.get('X-Worker-Secret') or headers.get('x-worker-secret') or ''
+    return bool(WORKER_SECRET) and hmac.compare_digest(supplied.encode(), WORKER_SECRET.encode())
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_SCOPE = 'tours'
+RATE_LIMIT_IP_BURST = float(os.environ.get('RATE_LIMIT_IP_BURST', '60'))
+RATE_LIMIT_IP_RATE = float(os.environ.get('RATE_LIMIT_IP_RATE', '1'))
+RATE_LIMIT_USER_BURST = float(os.environ.get('RATE_LIMIT_USER_BURST', '120'))
+RATE_LIMIT_USER_RATE = float(os.environ.get('RATE_LIMIT_USER_RATE', '2'))
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false') == 'true'
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+
+class MemoryRateLimitStore:
+    """Token buckets kept as a theoretical arrival time per key (GCRA), bounded by LRU eviction."""
+    
+    def __init__(self, max_keys: int):
+        self._max_keys = max_keys
+        self._arrivals: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        step = cost / rate
+        now = time.monotonic()
+        with self._lock:
+            arrival = max(self._arrivals.pop(key, now), now)
+            retry_after = arrival + step - now - burst / rate
+            self._arrivals[key] = arrival + step if retry_after <= 0 else arrival
+            while len(self._arrivals) > self._max_keys:
+                self._arrivals.popitem(last=False)
+        return max(retry_after, 0.0)
+
+class PostgresRateLimitStore:
+    """Same buckets in a shared table, so limits hold across instances; one upsert per admitted request."""
+    
+    def __init__(self, acquire: Callable[[], Any], release: Callable[[Any], None]):
+        self._acquire = acquire
+        self._release = release
+    
+    def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        params = {'key': key, 'step': cost / rate, 'burst': burst / rate}
+        conn = self._acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO t_p71176016_tour_booking_platfor.rate_limit_buckets AS b (key, tat)
+                VALUES (%(key)s, EXTRACT(EPOCH FROM clock_timestamp()) + %(step)s)
+                ON CONFLICT (key) DO UPDATE
+                    SET tat = GREATEST(b.tat + %(step)s, EXCLUDED.tat)
+                    WHERE GREATEST(b.tat + %(step)s, EXCLUDED.tat) - EXCLUDED.tat + %(step)s <= %(burst)s
+                RETURNING tat
+            ''', params)
+            retry_after = 0.0
+            if cursor.fetchone() is None:
+                cursor.execute('''
+                    SELECT tat + %(step)s - %(burst)s - EXTRACT(EPOCH FROM clock_timestamp()) as retry_after
+                    FROM t_p71176016_tour_booking_platfor.rate_limit_buckets
+                    WHERE key = %(key)s
+                ''', params)
+                retry_after = float(cursor.fetchone()['retry_after'])
+            conn.commit()
+            cursor.close()
+            return max(retry_after, 0.0)
+        finally:
+            self._release(conn)
+
+_rate_limit_memory = MemoryRateLimitStore(RATE_LIMIT_MAX_KEYS)
+_rate_limit_store: Any = (
+    PostgresRateLimitStore(get_db_connection, release_db_connection) if RATE_LIMIT_BACKEND == 'postgres' else _rate_limit_memory
+)
+
+def client_ip(event: Dict[str, Any]) -> str:
+    """The gateway-observed address; X-Forwarded-For is client-controlled unless a proxy we run appends to it."""
+    if RATE_LIMIT_TRUST_FORWARDED:
+        headers = event.get('headers') or {}
+        forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+        if forwarded.strip():
+            return forwarded.split(',')[-1].strip()
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or 'unknown'
+
+def rate_limit_subject(event: Dict[str, Any]) -> Optional[Any]:
+    headers = event.get('headers') or {}
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if not AUTH_TOKEN_SECRET or scheme.lower() != 'bearer' or not token.strip():
+        return None
+    claims = decode_auth_token(token.strip())
+    return claims['sub'] if claims else None
+
+def _take_rate_limit(key: str, burst: float, rate: float, cost: float) -> float:
+    try:
+        return _rate_limit_store.take(key, burst, rate, cost)
+    except psycopg2.Error as e:
+        print(f'rate limit store unavailable, using local buckets: {e}')
+        return _rate_limit_memory.take(key, burst, rate, cost)
+
+def admit_request(event: Dict[str, Any], cost: float) -> Optional[Dict[str, Any]]:
+    """None when the request fits the caller's per-IP and per-user buckets, otherwise the 429 response."""
+    buckets = [(f'{RATE_LIMIT_SCOPE}:ip:{client_ip(event)}', RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_RATE)]
+    subject = rate_limit_subject(event)
+    if subject is not None:
+        buckets.append((f'{RATE_LIMIT_SCOPE}:user:{subject}', RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_RATE))
+    
+    for key, burst, rate in buckets:
+        retry_after = _take_rate_limit(key, burst, rate, cost)
+        if retry_after > 0:
+            return {
+                'statusCode': 429,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'Retry-After',
+                    'Retry-After': str(math.ceil(retry_after))
+                },
+                'body': json.dumps({'error': 'Too many requests', 'retry_after': math.ceil(retry_after)}),
+                'isBase64Encoded': False
+            }
+    return None
+
+RATE_LIMIT_COSTS: Dict[str, float] = {
+    'GET catalog': 1,
+    'GET search': 3,
+    'GET availability': 1,
+    'GET availability_batch': 2,
+    'GET detail': 1,
+    'POST create': 3,
+    'POST moderate': 1,
+    'POST reconcile_availability': 10
+}
+
+def rate_limit_cost(method: str, params: Dict[str, Any]) -> float:
+    action = params.get('action') or ('catalog' if method == 'GET' else 'create')
+    if action == 'catalog' and params.get('search'):
+        action = 'search'
+    return RATE_LIMIT_COSTS.get(f'{method} {action}', 1)
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -308,13 +1164,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Admin-Id, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    rejected = admit_request(event, rate_limit_cost(method, event.get('queryStringParameters') or {}))
+    if rejected:
+        return rejected
+    
     conn = get_db_connection()
     
     try:
@@ -324,12 +1184,25 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if method == 'GET':
             if action == 'availability':
                 return handle_availability(event, conn)
+            elif action == 'availability_batch':
+                return handle_availability_batch(event, conn)
+            elif action == 'detail':
+                return handle_tour_detail(event, conn)
             else:
                 return handle_catalog(event, conn)
         
         elif method == 'POST':
             if action == 'moderate':
                 return handle_moderation(event, conn)
+            elif action == 'reconcile_availability':
+                if not is_worker_request(event, authenticate(event, conn)):
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Worker secret or admin token required'}),
+                        'isBase64Encoded': False
+                    }
+                return handle_reconcile_availability(event, conn)
             else:
                 return handle_create_tour(event, conn)
         
@@ -342,4 +1215,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
     
     finally:
-        conn.close()
\ No newline at end of file
+        release_db_connection(conn)
\ No newline at end of file
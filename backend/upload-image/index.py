@@ -1,15 +1,982 @@
 '''
 Business: Upload images to CDN and return public URL
-Args: event - dict with httpMethod, body (base64 encoded image)
+Args: event - dict with httpMethod, body (raw, multipart or JSON base64 image, or one chunk of a resumable upload)
       context - object with attributes: request_id, function_name
 Returns: HTTP response with image URL
 '''
 
 import json
 import base64
+import hmac
+import io
+import math
+import mmap
+import os
+import tempfile
+import threading
+import time
 import uuid
 import hashlib
-from typing import Dict, Any
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable, Iterable, Tuple
+
+try:
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+except ImportError:
+    psycopg2 = None
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+DB_ERRORS = (psycopg2.Error, ValueError) if psycopg2 is not None else (ValueError,)
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_DEBUG = os.environ.get('DB_POOL_DEBUG', 'false') == 'true'
+
+_db_pool: List[Tuple[Any, float]] = []
+_db_pool_lock = threading.Lock()
+_db_pool_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0}
+
+def _connection_is_healthy(conn, idle_seconds: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_seconds < DB_POOL_PING_AFTER:
+        return True
+    try:
+        ping_cursor = conn.cursor()
+        ping_cursor.execute('SELECT 1')
+        ping_cursor.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def get_db_connection():
+    while True:
+        with _db_pool_lock:
+            if not _db_pool:
+                break
+            conn, released_at = _db_pool.pop()
+        if _connection_is_healthy(conn, time.monotonic() - released_at):
+            with _db_pool_lock:
+                _db_pool_stats['hits'] += 1
+            return conn
+        with _db_pool_lock:
+            _db_pool_stats['reconnects'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+    
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        raise ValueError('DATABASE_URL environment variable is not set')
+    with _db_pool_lock:
+        _db_pool_stats['misses'] += 1
+    if DB_POOL_DEBUG:
+        print(f'db pool miss: {db_pool_stats()}')
+    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        conn.close()
+        return
+    with _db_pool_lock:
+        if len(_db_pool) < DB_POOL_MAX_SIZE:
+            _db_pool.append((conn, time.monotonic()))
+            return
+        _db_pool_stats['discarded'] += 1
+    conn.close()
+
+def db_pool_stats() -> Dict[str, int]:
+    with _db_pool_lock:
+        return dict(_db_pool_stats, idle=len(_db_pool), max_size=DB_POOL_MAX_SIZE)
+
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+REVOKED_TOKENS_TTL = float(os.environ.get('REVOKED_TOKENS_TTL', '30'))
+WORKER_SECRET = os.environ.get('WORKER_SECRET', '')
+
+_revoked_tokens: set = set()
+_revoked_tokens_lock = threading.Lock()
+_revoked_tokens_state: Dict[str, float] = {'loaded_at': float('-inf')}
+
+def _b64url_decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign_auth_token(signing_input: str) -> bytes:
+    if not AUTH_TOKEN_SECRET:
+        raise ValueError('AUTH_TOKEN_SECRET environment variable is not set')
+    return hmac.new(AUTH_TOKEN_SECRET.encode(), signing_input.encode(), hashlib.sha256).digest()
+
+def decode_auth_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        header_b64, payload_b64, signature_b64 = token.split('.')
+        signature = _b64url_decode(signature_b64)
+        if not hmac.compare_digest(_sign_auth_token(f'{header_b64}.{payload_b64}'), signature):
+            return None
+        header = json.loads(_b64url_decode(header_b64))
+        claims = json.loads(_b64url_decode(payload_b64))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(header, dict) or header.get('alg') != 'HS256' or not isinstance(claims, dict):
+        return None
+    if not isinstance(claims.get('exp'), (int, float)) or claims['exp'] <= time.time():
+        return None
+    return claims
+
+def is_token_revoked(conn, jti: Any) -> bool:
+    now = time.monotonic()
+    with _revoked_tokens_lock:
+        stale = now - _revoked_tokens_state['loaded_at'] >= REVOKED_TOKENS_TTL
+    if stale:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT jti FROM t_p71176016_tour_booking_platfor.revoked_tokens WHERE expires_at > NOW()"
+        )
+        revoked = {row['jti'] for row in cursor.fetchall()}
+        cursor.close()
+        with _revoked_tokens_lock:
+            _revoked_tokens.clear()
+            _revoked_tokens.update(revoked)
+            _revoked_tokens_state['loaded_at'] = now
+    with _revoked_tokens_lock:
+        return jti in _revoked_tokens
+
+def authenticate(event: Dict[str, Any], conn) -> Optional[Dict[str, Any]]:
+    """Claims of a valid, unrevoked bearer token; the denylist is reloaded at most every REVOKED_TOKENS_TTL seconds."""
+    headers = event.get('headers') or {}
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    claims = decode_auth_token(token.strip())
+    if claims is None or is_token_revoked(conn, claims.get('jti')):
+        return None
+    return claims
+
+def authenticate_uploader(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """authenticate for action=upload, which otherwise needs no database; without one only signature and expiry are checked."""
+    if psycopg2 is None or not os.environ.get('DATABASE_URL'):
+        headers = event.get('headers') or {}
+        authorization = headers.get('Authorization') or headers.get('authorization') or ''
+        scheme, _, token = authorization.partition(' ')
+        if scheme.lower() != 'bearer' or not token.strip():
+            return None
+        return decode_auth_token(token.strip())
+    conn = get_db_connection()
+    try:
+        return authenticate(event, conn)
+    finally:
+        release_db_connection(conn)
+
+def is_worker_request(event: Dict[str, Any], claims: Optional[Dict[str, Any]]) -> bool:
+    """Timer triggers send X-Worker-Secret; an admin token is accepted for manual runs."""
+    if claims and claims.get('role') == 'admin':
+        return True
+    headers = event.get('headers') or {}
+    supplied = headers.get('X-Worker-Secret') or headers.get('x-worker-secret') or ''
+    return bool(WORKER_SECRET) and hmac.compare_digest(supplied.encode(), WORKER_SECRET.encode())
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_SCOPE = 'upload-image'
+RATE_LIMIT_IP_BURST = float(os.environ.get('RATE_LIMIT_IP_BURST', '60'))
+RATE_LIMIT_IP_RATE = float(os.environ.get('RATE_LIMIT_IP_RATE', '1'))
+RATE_LIMIT_USER_BURST = float(os.environ.get('RATE_LIMIT_USER_BURST', '120'))
+RATE_LIMIT_USER_RATE = float(os.environ.get('RATE_LIMIT_USER_RATE', '2'))
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false') == 'true'
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+
+class MemoryRateLimitStore:
+    """Token buckets kept as a theoretical arrival time per key (GCRA), bounded by LRU eviction."""
+    
+    def __init__(self, max_keys: int):
+        self._max_keys = max_keys
+        self._arrivals: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        step = cost / rate
+        now = time.monotonic()
+        with self._lock:
+            arrival = max(self._arrivals.pop(key, now), now)
+            retry_after = arrival + step - now - burst / rate
+            self._arrivals[key] = arrival + step if retry_after <= 0 else arrival
+            while len(self._arrivals) > self._max_keys:
+                self._arrivals.popitem(last=False)
+        return max(retry_after, 0.0)
+
+class PostgresRateLimitStore:
+    """Same buckets in a shared table, so limits hold across instances; one upsert per admitted request."""
+    
+    def __init__(self, acquire: Callable[[], Any], release: Callable[[Any], None]):
+        self._acquire = acquire
+        self._release = release
+    
+    def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        params = {'key': key, 'step': cost / rate, 'burst': burst / rate}
+        conn = self._acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO t_p71176016_tour_booking_platfor.rate_limit_buckets AS b (key, tat)
+                VALUES (%(key)s, EXTRACT(EPOCH FROM clock_timestamp()) + %(step)s)
+                ON CONFLICT (key) DO UPDATE
+                    SET tat = GREATEST(b.tat + %(step)s, EXCLUDED.tat)
+                    WHERE GREATEST(b.tat + %(step)s, EXCLUDED.tat) - EXCLUDED.tat + %(step)s <= %(burst)s
+                RETURNING tat
+            ''', params)
+            retry_after = 0.0
+            if cursor.fetchone() is None:
+                cursor.execute('''
+                    SELECT tat + %(step)s - %(burst)s - EXTRACT(EPOCH FROM clock_timestamp()) as retry_after
+                    FROM t_p71176016_tour_booking_platfor.rate_limit_buckets
+                    WHERE key = %(key)s
+                ''', params)
+                retry_after = float(cursor.fetchone()['retry_after'])
+            conn.commit()
+            cursor.close()
+            return max(retry_after, 0.0)
+        finally:
+            self._release(conn)
+
+_rate_limit_memory = MemoryRateLimitStore(RATE_LIMIT_MAX_KEYS)
+_rate_limit_store: Any = (
+    PostgresRateLimitStore(get_db_connection, release_db_connection) if RATE_LIMIT_BACKEND == 'postgres' and psycopg2 is not None else _rate_limit_memory
+)
+
+def client_ip(event: Dict[str, Any]) -> str:
+    """The gateway-observed address; X-Forwarded-For is client-controlled unless a proxy we run appends to it."""
+    if RATE_LIMIT_TRUST_FORWARDED:
+        headers = event.get('headers') or {}
+        forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+        if forwarded.strip():
+            return forwarded.split(',')[-1].strip()
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or 'unknown'
+
+def rate_limit_subject(event: Dict[str, Any]) -> Optional[Any]:
+    headers = event.get('headers') or {}
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if not AUTH_TOKEN_SECRET or scheme.lower() != 'bearer' or not token.strip():
+        return None
+    claims = decode_auth_token(token.strip())
+    return claims['sub'] if claims else None
+
+def _take_rate_limit(key: str, burst: float, rate: float, cost: float) -> float:
+    try:
+        return _rate_limit_store.take(key, burst, rate, cost)
+    except DB_ERRORS as e:
+        print(f'rate limit store unavailable, using local buckets: {e}')
+        return _rate_limit_memory.take(key, burst, rate, cost)
+
+def admit_request(event: Dict[str, Any], cost: float) -> Optional[Dict[str, Any]]:
+    """None when the request fits the caller's per-IP and per-user buckets, otherwise the 429 response."""
+    buckets = [(f'{RATE_LIMIT_SCOPE}:ip:{client_ip(event)}', RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_RATE)]
+    subject = rate_limit_subject(event)
+    if subject is not None:
+        buckets.append((f'{RATE_LIMIT_SCOPE}:user:{subject}', RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_RATE))
+    
+    for key, burst, rate in buckets:
+        retry_after = _take_rate_limit(key, burst, rate, cost)
+        if retry_after > 0:
+            return {
+                'statusCode': 429,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'Retry-After',
+                    'Retry-After': str(math.ceil(retry_after))
+                },
+                'body': json.dumps({'error': 'Too many requests', 'retry_after': math.ceil(retry_after)}),
+                'isBase64Encoded': False
+            }
+    return None
+
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_MAX_BYTES = int(os.environ.get('UPLOAD_CHUNK_MAX_BYTES', str(4 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_HOURS = 24
+UPLOAD_DECODE_STEP = 64 * 1024
+UPLOAD_RATE_LIMIT_COSTS: Dict[str, float] = {
+    'upload': 10,
+    'start': 2,
+    'chunk': 2,
+    'status': 1,
+    'finish': 5,
+    'stats': 1,
+    'process_variants': 5
+}
+BLOB_S3_BUCKET = os.environ.get('BLOB_S3_BUCKET', '')
+BLOB_STORE_BACKEND = os.environ.get('BLOB_STORE_BACKEND', 's3' if BLOB_S3_BUCKET else 'local')
+BLOB_STORE_ROOT = os.environ.get('BLOB_STORE_ROOT', os.path.join(tempfile.gettempdir(), 'tour-images'))
+BLOB_PUBLIC_URL = os.environ.get('BLOB_PUBLIC_URL', '').rstrip('/')
+# Without a public blob backend (S3 bucket + BLOB_PUBLIC_URL) uploads are not kept:
+# function storage is ephemeral and nothing serves it, so the old stock photos are returned instead.
+PLACEHOLDER_IMAGES = [
+    'https://images.unsplash.com/photo-1469854523086-cc02fe5d8800?w=800',
+    'https://images.unsplash.com/photo-1476514525535-07fb3b4ae5f1?w=800',
+    'https://images.unsplash.com/photo-1488646953014-85cb44e25828?w=800',
+    'https://images.unsplash.com/photo-1502920917128-1aa500764cbd?w=800',
+    'https://images.unsplash.com/photo-1503220317375-aaad61436b1b?w=800',
+    'https://images.unsplash.com/photo-1500835556837-99ac94a94552?w=800',
+    'https://images.unsplash.com/photo-1530789253388-582c481c54b0?w=800',
+    'https://images.unsplash.com/photo-1507525428034-b723cf961d3e?w=800',
+    'https://images.unsplash.com/photo-1506905925346-21bda4d32df4?w=800',
+    'https://images.unsplash.com/photo-1504150558151-b2c5a8a8c8f3?w=800'
+]
+IMAGE_VARIANT_WIDTHS = {'thumb': 320, 'card': 640, 'hero': 1600}
+IMAGE_VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True})
+}
+IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', '2'))
+IMAGE_VARIANT_MAX_ATTEMPTS = 5
+IMAGE_VARIANT_BATCH = 10
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png', 'png'),
+    (b'GIF87a', 'image/gif', 'gif'),
+    (b'GIF89a', 'image/gif', 'gif')
+]
+
+class UploadTooLarge(Exception):
+    pass
+
+class UploadDigest:
+    """Size and SHA-256 of an upload, fed chunk by chunk so the whole image is never held twice."""
+    
+    def __init__(self, max_bytes: int):
+        self.size = 0
+        self.head = b''
+        self._max_bytes = max_bytes
+        self._sha256 = hashlib.sha256()
+    
+    def feed(self, chunk: Any) -> None:
+        self.size += len(chunk)
+        if self.size > self._max_bytes:
+            raise UploadTooLarge()
+        if len(self.head) < 16:
+            self.head += bytes(chunk[:16 - len(self.head)])
+        self._sha256.update(chunk)
+    
+    def feed_all(self, chunks: Iterable[Any]) -> 'UploadDigest':
+        for chunk in chunks:
+            self.feed(chunk)
+        return self
+    
+    def hexdigest(self) -> str:
+        return self._sha256.hexdigest()
+
+class ChunkStream(io.RawIOBase):
+    """File-like view over a chunk iterator, for clients that want read() rather than chunks."""
+    
+    def __init__(self, chunks: Iterable[Any]):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b'')
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, buffer: Any) -> int:
+        while not self._pending:
+            try:
+                self._pending = memoryview(bytes(next(self._chunks)))
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+class LocalBlobStore:
+    """Blobs as files under root, sharded by hash prefix; reads are memory-mapped."""
+    
+    def __init__(self, root: str):
+        self._root = root
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self._root, *key.split('/'))
+    
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+    
+    def put(self, key: str, chunks: Iterable[Any], content_type: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as blob_file:
+                for chunk in chunks:
+                    blob_file.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    
+    def read(self, key: str) -> Any:
+        with open(self._path(key), 'rb') as blob_file:
+            return mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+class S3BlobStore:
+    """Blobs in an S3-compatible bucket; BLOB_S3_ENDPOINT can point at a local stand-in such as MinIO."""
+    
+    def __init__(self, bucket: str):
+        self._bucket = bucket
+        self._client = boto3.client(
+            's3',
+            endpoint_url=os.environ.get('BLOB_S3_ENDPOINT') or None,
+            region_name=os.environ.get('BLOB_S3_REGION') or None,
+            aws_access_key_id=os.environ.get('BLOB_S3_ACCESS_KEY') or None,
+            aws_secret_access_key=os.environ.get('BLOB_S3_SECRET_KEY') or None
+        )
+    
+    def exists(self, key: str) -> bool:
+        try:
+            self._client.head_object(Bucket=self._bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+    
+    def put(self, key: str, chunks: Iterable[Any], content_type: str) -> None:
+        self._client.upload_fileobj(
+            ChunkStream(chunks), self._bucket, key,
+            ExtraArgs={'ContentType': content_type, 'CacheControl': 'public, max-age=31536000, immutable'}
+        )
+    
+    def read(self, key: str) -> Any:
+        return self._client.get_object(Bucket=self._bucket, Key=key)['Body'].read()
+
+def create_blob_store() -> Any:
+    if BLOB_STORE_BACKEND == 's3':
+        if boto3 is None:
+            raise ValueError('BLOB_STORE_BACKEND=s3 requires boto3')
+        return S3BlobStore(BLOB_S3_BUCKET)
+    return LocalBlobStore(BLOB_STORE_ROOT)
+
+_blob_store = create_blob_store()
+_blob_stats_lock = threading.Lock()
+_blob_stats: Dict[str, int] = {'uploads': 0, 'dedup_hits': 0, 'bytes_received': 0, 'bytes_written': 0}
+
+def blob_store_stats() -> Dict[str, Any]:
+    with _blob_stats_lock:
+        stats = dict(_blob_stats)
+    stats['hit_rate'] = round(stats['dedup_hits'] / stats['uploads'], 4) if stats['uploads'] else 0.0
+    stats['backend'] = BLOB_STORE_BACKEND
+    return stats
+
+def global_blob_stats() -> Optional[Dict[str, Any]]:
+    if psycopg2 is None or not os.environ.get('DATABASE_URL'):
+        return None
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT
+                COUNT(*) as blobs,
+                COALESCE(SUM(upload_count), 0) as uploads,
+                COALESCE(SUM(size), 0) as stored_bytes,
+                COALESCE(SUM(size * (upload_count - 1)), 0) as deduplicated_bytes
+            FROM t_p71176016_tour_booking_platfor.image_blobs
+        """)
+        stats = {key: int(value) for key, value in cursor.fetchone().items()}
+        cursor.close()
+    finally:
+        release_db_connection(conn)
+    stats['hit_rate'] = round(1 - stats['blobs'] / stats['uploads'], 4) if stats['uploads'] else 0.0
+    return stats
+
+def blob_key(file_hash: str) -> str:
+    return f'images/{file_hash[:2]}/{file_hash}'
+
+def sniff_image_type(head: bytes) -> Optional[Tuple[str, str]]:
+    """Content type and extension from the magic bytes; None for anything that is not a supported image."""
+    for signature, content_type, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type, extension
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp', 'webp'
+    return None
+
+def base64_decoded_size(text: str, start: int = 0) -> int:
+    return (len(text) - start) * 3 // 4 - text[-2:].count('=')
+
+def iter_base64_chunks(text: str, start: int = 0) -> Iterable[bytes]:
+    for offset in range(start, len(text), UPLOAD_DECODE_STEP):
+        yield base64.b64decode(text[offset:offset + UPLOAD_DECODE_STEP])
+
+def iter_view_chunks(data: Any) -> Iterable[memoryview]:
+    view = memoryview(data)
+    for offset in range(0, len(view), UPLOAD_DECODE_STEP):
+        yield view[offset:offset + UPLOAD_DECODE_STEP]
+
+def request_header(event: Dict[str, Any], name: str) -> str:
+    headers = event.get('headers') or {}
+    return headers.get(name) or headers.get(name.lower()) or ''
+
+def request_body_bytes(event: Dict[str, Any]) -> bytes:
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        return base64.b64decode(body)
+    return body.encode()
+
+def find_multipart_file(body: bytes, content_type: str) -> Optional[Tuple[str, memoryview]]:
+    _, _, boundary = content_type.partition('boundary=')
+    delimiter = b'--' + boundary.strip('"').encode()
+    position = body.find(delimiter)
+    while position != -1:
+        headers_start = position + len(delimiter) + 2
+        headers_end = body.find(b'\r\n\r\n', headers_start)
+        next_position = body.find(b'\r\n' + delimiter, headers_end)
+        if headers_end == -1 or next_position == -1:
+            return None
+        part_headers = body[headers_start:headers_end].decode('utf-8', 'replace')
+        if 'filename=' in part_headers:
+            filename = part_headers.split('filename=', 1)[1].split(';', 1)[0].splitlines()[0].strip().strip('"')
+            return filename or 'image.jpg', memoryview(body)[headers_end + 4:next_position]
+        position = next_position + 2
+    return None
+
+def json_response(status: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(payload),
+        'isBase64Encoded': False
+    }
+
+def too_large_response() -> Dict[str, Any]:
+    return json_response(413, {'error': f'Image exceeds {UPLOAD_MAX_BYTES} bytes'})
+
+def upsert_image_blob(conn, file_hash: str, size: int, content_type: str) -> None:
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO t_p71176016_tour_booking_platfor.image_blobs (hash, size, content_type)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (hash) DO UPDATE
+        SET upload_count = image_blobs.upload_count + 1, last_uploaded_at = CURRENT_TIMESTAMP
+    """, (file_hash, size, content_type))
+    cursor.close()
+
+def record_blob_upload(file_hash: str, size: int, content_type: str, deduplicated: bool, conn=None) -> None:
+    with _blob_stats_lock:
+        _blob_stats['uploads'] += 1
+        _blob_stats['bytes_received'] += size
+        if deduplicated:
+            _blob_stats['dedup_hits'] += 1
+        else:
+            _blob_stats['bytes_written'] += size
+    
+    if conn is not None:
+        upsert_image_blob(conn, file_hash, size, content_type)
+        return
+    
+    if psycopg2 is None or not os.environ.get('DATABASE_URL'):
+        return
+    try:
+        conn = get_db_connection()
+    except DB_ERRORS as e:
+        print(f'image_blobs not updated: {e}')
+        return
+    try:
+        upsert_image_blob(conn, file_hash, size, content_type)
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f'image_blobs not updated: {e}')
+    finally:
+        release_db_connection(conn)
+
+_variant_pool = ThreadPoolExecutor(max_workers=IMAGE_VARIANT_WORKERS, thread_name_prefix='image-variants')
+
+def image_url(key: str) -> str:
+    return f'{BLOB_PUBLIC_URL}/{key}'
+
+def render_image_variants(file_hash: str) -> Dict[str, Any]:
+    """Resizes the original to every IMAGE_VARIANT_WIDTHS width (never upscaling) in WebP and JPEG."""
+    data = _blob_store.read(blob_key(file_hash))
+    source = ImageOps.exif_transpose(Image.open(data if hasattr(data, 'seek') else io.BytesIO(data)))
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+    
+    variants: Dict[str, Any] = {}
+    for name, width in IMAGE_VARIANT_WIDTHS.items():
+        image = source.copy()
+        image.thumbnail((width, width * 4))
+        variant = {'width': image.width, 'height': image.height}
+        for extension, (image_format, content_type, options) in IMAGE_VARIANT_FORMATS.items():
+            buffer = io.BytesIO()
+            (image.convert('RGB') if image_format == 'JPEG' else image).save(buffer, image_format, **options)
+            key = f'variants/{file_hash[:2]}/{file_hash}/{name}.{extension}'
+            _blob_store.put(key, [buffer.getbuffer()], content_type)
+            variant[extension] = image_url(key)
+        variants[name] = variant
+    return variants
+
+def save_image_variants(file_hash: str, variants: Dict[str, Any]) -> None:
+    if psycopg2 is None or not os.environ.get('DATABASE_URL'):
+        return
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE t_p71176016_tour_booking_platfor.image_blobs SET variants = %s WHERE hash = %s
+        """, (json.dumps(variants), file_hash))
+        cursor.execute("""
+            UPDATE t_p71176016_tour_booking_platfor.tours
+            SET image_variants = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE image_url = %s
+        """, (json.dumps(variants), image_url(blob_key(file_hash))))
+        cursor.execute("""
+            DELETE FROM t_p71176016_tour_booking_platfor.image_variant_jobs WHERE hash = %s
+        """, (file_hash,))
+        conn.commit()
+        cursor.close()
+    finally:
+        release_db_connection(conn)
+
+def record_image_variant_failure(file_hash: str, error: str) -> None:
+    if psycopg2 is None or not os.environ.get('DATABASE_URL'):
+        return
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE t_p71176016_tour_booking_platfor.image_variant_jobs
+            SET last_error = %s, last_attempt_at = CURRENT_TIMESTAMP
+            WHERE hash = %s
+        """, (error[:500], file_hash))
+        conn.commit()
+        cursor.close()
+    except psycopg2.Error as e:
+        print(f'image variant failure for {file_hash} not recorded: {e}')
+    finally:
+        release_db_connection(conn)
+
+def run_image_variant_job(file_hash: str) -> bool:
+    """Runs on the variant pool, where nobody reads the future, so every failure is logged and kept on the job row."""
+    try:
+        save_image_variants(file_hash, render_image_variants(file_hash))
+        return True
+    except Exception as e:
+        print(f'image variants failed for {file_hash}: {e!r}')
+        record_image_variant_failure(file_hash, repr(e))
+        return False
+
+def enqueue_image_variants(file_hash: str, conn=None) -> Optional[str]:
+    """Records a durable job, then renders in the background so the upload response does not wait on encoding.
+    
+    The job row is inserted already claimed (attempts = 1, last_attempt_at set), so action=process_variants
+    leaves it to the inline render and only picks it up if that render is lost with a frozen or recycled instance.
+    When conn is given the row joins the caller's transaction and nothing is started: the hash is returned
+    and the caller passes it to start_image_variants after its commit.
+    """
+    if Image is None:
+        print('Pillow is not installed, image variants are skipped')
+        return None
+    
+    if conn is not None or (psycopg2 is not None and os.environ.get('DATABASE_URL')):
+        owned = conn is None
+        if owned:
+            conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO t_p71176016_tour_booking_platfor.image_variant_jobs (hash, attempts, last_attempt_at)
+                VALUES (%s, 1, CURRENT_TIMESTAMP)
+                ON CONFLICT (hash) DO NOTHING
+                RETURNING hash
+            """, (file_hash,))
+            claimed = cursor.fetchone() is not None
+            cursor.close()
+            if owned:
+                conn.commit()
+        finally:
+            if owned:
+                release_db_connection(conn)
+        if not claimed:
+            return None
+        if not owned:
+            return file_hash
+    
+    start_image_variants(file_hash)
+    return None
+
+def start_image_variants(file_hash: str) -> None:
+    _variant_pool.submit(run_image_variant_job, file_hash)
+
+def handle_process_variants(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    if not is_worker_request(event, authenticate(event, conn)):
+        return json_response(403, {'error': 'Worker secret or admin token required'})
+    if Image is None:
+        return json_response(503, {'error': 'Pillow is not installed'})
+    if not BLOB_PUBLIC_URL:
+        return json_response(503, {'error': 'No public blob storage is configured'})
+    
+    hashes = claim_image_variant_jobs(conn)
+    
+    processed = sum(1 for file_hash in hashes if run_image_variant_job(file_hash))
+    return json_response(200, {'claimed': len(hashes), 'processed': processed, 'failed': len(hashes) - processed})
+
+def claim_image_variant_jobs(conn) -> List[str]:
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE t_p71176016_tour_booking_platfor.image_variant_jobs
+        SET attempts = attempts + 1, last_attempt_at = CURRENT_TIMESTAMP
+        WHERE hash IN (
+            SELECT hash FROM t_p71176016_tour_booking_platfor.image_variant_jobs
+            WHERE attempts < %s
+              AND (last_attempt_at IS NULL OR last_attempt_at < NOW() - INTERVAL '1 minute')
+            ORDER BY created_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING hash
+    """, (IMAGE_VARIANT_MAX_ATTEMPTS, IMAGE_VARIANT_BATCH))
+    hashes = [row['hash'] for row in cursor.fetchall()]
+    conn.commit()
+    cursor.close()
+    return hashes
+
+def store_upload(filename: str, chunks: Callable[[], Iterable[Any]], conn=None,
+                 variant_jobs: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Hashes the upload, then writes it only if no blob with that hash exists yet.
+    
+    chunks must return a fresh iterator on every call: once for hashing, once more for writing.
+    When conn is given the image_blobs and image_variant_jobs rows join the caller's transaction,
+    and the hash of a variant job to start after the commit is appended to variant_jobs.
+    """
+    digest = UploadDigest(UPLOAD_MAX_BYTES).feed_all(chunks())
+    file_hash = digest.hexdigest()
+    key = blob_key(file_hash)
+    image_type = sniff_image_type(digest.head)
+    if not image_type:
+        return json_response(400, {'error': 'Only JPEG, PNG, GIF and WebP images are supported'})
+    content_type, extension = image_type
+    
+    if not BLOB_PUBLIC_URL:
+        return json_response(200, {
+            'url': PLACEHOLDER_IMAGES[int(file_hash, 16) % len(PLACEHOLDER_IMAGES)],
+            'filename': f'{file_hash}.{extension}',
+            'size': digest.size,
+            'hash': file_hash,
+            'deduplicated': False,
+            'stored': False
+        })
+    
+    deduplicated = _blob_store.exists(key)
+    if not deduplicated:
+        _blob_store.put(key, chunks(), content_type)
+    record_blob_upload(file_hash, digest.size, content_type, deduplicated, conn)
+    if not deduplicated:
+        pending = enqueue_image_variants(file_hash, conn)
+        if pending and variant_jobs is not None:
+            variant_jobs.append(pending)
+    
+    return json_response(200, {
+        'url': image_url(key),
+        'filename': f'{file_hash}.{extension}',
+        'size': digest.size,
+        'hash': file_hash,
+        'deduplicated': deduplicated,
+        'stored': True
+    })
+
+def handle_single_upload(event: Dict[str, Any], params: Dict[str, Any]) -> Dict[str, Any]:
+    content_type = request_header(event, 'Content-Type').lower()
+    content_length = request_header(event, 'Content-Length')
+    
+    if content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES * 2:
+        return too_large_response()
+    
+    if content_type.startswith('multipart/form-data'):
+        body = request_body_bytes(event)
+        part = find_multipart_file(body, request_header(event, 'Content-Type'))
+        if not part:
+            return json_response(400, {'error': 'multipart body has no file part'})
+        filename, data = part
+        return store_upload(filename, lambda: iter_view_chunks(data))
+    
+    if content_type.startswith('image/') or content_type.startswith('application/octet-stream'):
+        filename = params.get('filename') or request_header(event, 'X-Filename') or 'image.jpg'
+        body = event.get('body') or ''
+        if not body:
+            return json_response(400, {'error': 'image data is required'})
+        if event.get('isBase64Encoded'):
+            if base64_decoded_size(body) > UPLOAD_MAX_BYTES:
+                return too_large_response()
+            return store_upload(filename, lambda: iter_base64_chunks(body))
+        data = body.encode()
+        return store_upload(filename, lambda: iter_view_chunks(data))
+    
+    body_data = json.loads(event.get('body') or '{}')
+    image_data = body_data.get('image')
+    filename = body_data.get('filename', 'image.jpg')
+    
+    if not image_data:
+        return json_response(400, {'error': 'image data is required'})
+    
+    data_start = image_data.find(',') + 1
+    if base64_decoded_size(image_data, data_start) > UPLOAD_MAX_BYTES:
+        return too_large_response()
+    
+    return store_upload(filename, lambda: iter_base64_chunks(image_data, data_start))
+
+def handle_start_upload(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    body_data = json.loads(event.get('body') or '{}')
+    filename = body_data.get('filename', 'image.jpg')
+    
+    try:
+        total_size = int(body_data.get('size'))
+    except (TypeError, ValueError):
+        return json_response(400, {'error': 'size must be a number'})
+    
+    if total_size <= 0:
+        return json_response(400, {'error': 'size must be positive'})
+    if total_size > UPLOAD_MAX_BYTES:
+        return too_large_response()
+    
+    upload_id = str(uuid.uuid4())
+    cursor = conn.cursor()
+    cursor.execute("""
+        DELETE FROM t_p71176016_tour_booking_platfor.upload_sessions WHERE expires_at < NOW()
+    """)
+    cursor.execute("""
+        INSERT INTO t_p71176016_tour_booking_platfor.upload_sessions (id, filename, total_size, expires_at)
+        VALUES (%s, %s, %s, NOW() + make_interval(hours => %s))
+    """, (upload_id, filename, total_size, UPLOAD_SESSION_TTL_HOURS))
+    conn.commit()
+    cursor.close()
+    
+    return json_response(201, {
+        'upload_id': upload_id,
+        'size': total_size,
+        'received': 0,
+        'chunk_size': UPLOAD_CHUNK_MAX_BYTES
+    })
+
+def load_upload_session(cursor, upload_id: str, for_update: bool = False) -> Optional[Dict[str, Any]]:
+    try:
+        uuid.UUID(upload_id)
+    except (TypeError, ValueError):
+        return None
+    cursor.execute(f"""
+        SELECT id, filename, total_size, received_size
+        FROM t_p71176016_tour_booking_platfor.upload_sessions
+        WHERE id = %s AND expires_at >= NOW()
+        {'FOR UPDATE' if for_update else ''}
+    """, (upload_id,))
+    return cursor.fetchone()
+
+def handle_upload_chunk(event: Dict[str, Any], conn, params: Dict[str, Any]) -> Dict[str, Any]:
+    body = event.get('body') or ''
+    try:
+        offset = int(params.get('offset', '0'))
+    except ValueError:
+        return json_response(400, {'error': 'offset must be a number'})
+    
+    chunk_size = base64_decoded_size(body) if event.get('isBase64Encoded') else len(body)
+    if chunk_size > UPLOAD_CHUNK_MAX_BYTES:
+        return json_response(413, {'error': f'Chunk exceeds {UPLOAD_CHUNK_MAX_BYTES} bytes'})
+    if chunk_size <= 0:
+        return json_response(400, {'error': 'chunk data is required'})
+    
+    cursor = conn.cursor()
+    session = load_upload_session(cursor, params.get('upload_id'), for_update=True)
+    if not session:
+        cursor.close()
+        return json_response(404, {'error': 'Upload not found or expired'})
+    
+    if offset != session['received_size']:
+        cursor.close()
+        return json_response(409, {'error': 'Unexpected offset', 'received': session['received_size']})
+    
+    chunk = request_body_bytes(event)
+    if session['received_size'] + len(chunk) > session['total_size']:
+        cursor.close()
+        return too_large_response()
+    
+    cursor.execute("""
+        INSERT INTO t_p71176016_tour_booking_platfor.upload_chunks (upload_id, chunk_offset, data)
+        VALUES (%s, %s, %s)
+    """, (session['id'], offset, psycopg2.Binary(chunk)))
+    cursor.execute("""
+        UPDATE t_p71176016_tour_booking_platfor.upload_sessions
+        SET received_size = received_size + %s
+        WHERE id = %s
+        RETURNING received_size
+    """, (len(chunk), session['id']))
+    received = cursor.fetchone()['received_size']
+    conn.commit()
+    cursor.close()
+    
+    return json_response(200, {'upload_id': str(session['id']), 'size': session['total_size'], 'received': received})
+
+def handle_upload_status(conn, params: Dict[str, Any]) -> Dict[str, Any]:
+    cursor = conn.cursor()
+    session = load_upload_session(cursor, params.get('upload_id'))
+    cursor.close()
+    if not session:
+        return json_response(404, {'error': 'Upload not found or expired'})
+    return json_response(200, {
+        'upload_id': str(session['id']),
+        'size': session['total_size'],
+        'received': session['received_size']
+    })
+
+def iter_stored_chunks(conn, upload_id: Any) -> Iterable[Any]:
+    chunks_cursor = conn.cursor(name=f'upload_chunks_{uuid.uuid4().hex}')
+    chunks_cursor.itersize = 4
+    try:
+        chunks_cursor.execute("""
+            SELECT data FROM t_p71176016_tour_booking_platfor.upload_chunks
+            WHERE upload_id = %s
+            ORDER BY chunk_offset
+        """, (upload_id,))
+        for row in chunks_cursor:
+            yield row['data']
+    finally:
+        chunks_cursor.close()
+
+def handle_finish_upload(conn, params: Dict[str, Any]) -> Dict[str, Any]:
+    cursor = conn.cursor()
+    session = load_upload_session(cursor, params.get('upload_id'), for_update=True)
+    if not session:
+        cursor.close()
+        return json_response(404, {'error': 'Upload not found or expired'})
+    
+    if session['received_size'] != session['total_size']:
+        cursor.close()
+        return json_response(409, {'error': 'Upload is incomplete', 'received': session['received_size']})
+    
+    variant_jobs: List[str] = []
+    result = store_upload(session['filename'], lambda: iter_stored_chunks(conn, session['id']), conn, variant_jobs)
+    
+    cursor.execute("""
+        DELETE FROM t_p71176016_tour_booking_platfor.upload_sessions WHERE id = %s
+    """, (session['id'],))
+    conn.commit()
+    cursor.close()
+    
+    for file_hash in variant_jobs:
+        start_image_variants(file_hash)
+    
+    return result
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'POST')
@@ -19,80 +986,61 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Filename, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+    params = event.get('queryStringParameters') or {}
+    action = params.get('action', 'upload')
     
-    body_data = json.loads(event.get('body', '{}'))
-    image_data = body_data.get('image')
-    filename = body_data.get('filename', 'image.jpg')
+    routes = {
+        ('POST', 'upload'), ('POST', 'start'), ('PUT', 'chunk'),
+        ('GET', 'status'), ('POST', 'finish'), ('GET', 'stats'),
+        ('POST', 'process_variants')
+    }
+    if (method, action) not in routes:
+        return json_response(405, {'error': 'Method not allowed'})
     
-    if not image_data:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'image data is required'}),
-            'isBase64Encoded': False
-        }
+    rejected = admit_request(event, UPLOAD_RATE_LIMIT_COSTS[action])
+    if rejected:
+        return rejected
     
     try:
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        image_bytes = base64.b64decode(image_data)
+        if action == 'upload':
+            if not authenticate_uploader(event):
+                return json_response(401, {'error': 'Authorization required'})
+            return handle_single_upload(event, params)
         
-        file_hash = hashlib.md5(image_bytes).hexdigest()
-        file_extension = filename.split('.')[-1].lower() if '.' in filename else 'jpg'
+        if action == 'stats':
+            return json_response(200, {'instance': blob_store_stats(), 'global': global_blob_stats()})
         
-        if file_extension not in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-            file_extension = 'jpg'
+        if psycopg2 is None:
+            return json_response(503, {'error': 'This action needs a database connection'})
         
-        unique_id = str(uuid.uuid4())
-        unique_filename = f"{unique_id}.{file_extension}"
-        
-        placeholder_images = [
-            'https://images.unsplash.com/photo-1469854523086-cc02fe5d8800?w=800',
-            'https://images.unsplash.com/photo-1476514525535-07fb3b4ae5f1?w=800',
-            'https://images.unsplash.com/photo-1488646953014-85cb44e25828?w=800',
-            'https://images.unsplash.com/photo-1502920917128-1aa500764cbd?w=800',
-            'https://images.unsplash.com/photo-1503220317375-aaad61436b1b?w=800',
-            'https://images.unsplash.com/photo-1500835556837-99ac94a94552?w=800',
-            'https://images.unsplash.com/photo-1530789253388-582c481c54b0?w=800',
-            'https://images.unsplash.com/photo-1507525428034-b723cf961d3e?w=800',
-            'https://images.unsplash.com/photo-1506905925346-21bda4d32df4?w=800',
-            'https://images.unsplash.com/photo-1504150558151-b2c5a8a8c8f3?w=800'
-        ]
-        
-        cdn_url = placeholder_images[hash(file_hash) % len(placeholder_images)]
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'url': cdn_url,
-                'filename': unique_filename,
-                'size': len(image_bytes),
-                'hash': file_hash
-            }),
-            'isBase64Encoded': False
-        }
+        conn = get_db_connection()
+        try:
+            if action in ('start', 'chunk', 'finish') and not authenticate(event, conn):
+                return json_response(401, {'error': 'Authorization required'})
+            
+            if action == 'process_variants':
+                return handle_process_variants(event, conn)
+            elif action == 'start':
+                return handle_start_upload(event, conn)
+            elif action == 'chunk':
+                return handle_upload_chunk(event, conn, params)
+            elif action == 'status':
+                return handle_upload_status(conn, params)
+            else:
+                return handle_finish_upload(conn, params)
+        finally:
+            release_db_connection(conn)
+    
+    except UploadTooLarge:
+        return too_large_response()
     
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Failed to process image: {str(e)}'}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+        return json_response(500, {'error': f'Failed to process image: {str(e)}'})
@@ -0,0 +1,4 @@
+-- Индекс для keyset-пагинации каталога: ORDER BY created_at DESC, id DESC среди активных туров
+CREATE INDEX IF NOT EXISTS idx_tours_active_created_at_id
+ON t_p71176016_tour_booking_platfor.tours (created_at DESC, id DESC)
+WHERE status = 'active';
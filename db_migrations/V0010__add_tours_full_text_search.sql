@@ -0,0 +1,16 @@
+-- Полнотекстовый поиск по турам: русская морфология + триграммы для опечаток
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE t_p71176016_tour_booking_platfor.tours
+ADD COLUMN IF NOT EXISTS search_vector tsvector
+GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(short_description, '')), 'B') ||
+    setweight(to_tsvector('russian', coalesce(full_description, '')), 'C')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_tours_search_vector
+ON t_p71176016_tour_booking_platfor.tours USING GIN (search_vector);
+
+CREATE INDEX IF NOT EXISTS idx_tours_title_trgm
+ON t_p71176016_tour_booking_platfor.tours USING GIN (title gin_trgm_ops);
@@ -0,0 +1,18 @@
+-- Уведомление слушателей чата о новых сообщениях (LISTEN chat_booking_<id>)
+CREATE OR REPLACE FUNCTION t_p71176016_tour_booking_platfor.notify_chat_message()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('chat_booking_' || NEW.booking_id, NEW.id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chat_messages_notify ON t_p71176016_tour_booking_platfor.chat_messages;
+
+CREATE TRIGGER trg_chat_messages_notify
+AFTER INSERT ON t_p71176016_tour_booking_platfor.chat_messages
+FOR EACH ROW EXECUTE FUNCTION t_p71176016_tour_booking_platfor.notify_chat_message();
+
+-- Окно сообщений по booking_id с курсором по id
+CREATE INDEX IF NOT EXISTS idx_chat_messages_booking_id_id
+ON t_p71176016_tour_booking_platfor.chat_messages (booking_id, id);
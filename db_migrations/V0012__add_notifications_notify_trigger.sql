@@ -0,0 +1,37 @@
+-- Push-события для колокольчика уведомлений (LISTEN notifications_user_<id>)
+-- Полезная нагрузка: {"last_id": ..., "unread_count": ...}
+CREATE OR REPLACE FUNCTION t_p71176016_tour_booking_platfor.notify_notifications_changed()
+RETURNS trigger AS $$
+DECLARE
+    changed RECORD;
+BEGIN
+    FOR changed IN
+        SELECT user_id, MAX(id) AS last_id FROM changed_rows GROUP BY user_id
+    LOOP
+        PERFORM pg_notify(
+            'notifications_user_' || changed.user_id,
+            json_build_object(
+                'last_id', changed.last_id,
+                'unread_count', (
+                    SELECT COUNT(*) FROM t_p71176016_tour_booking_platfor.notifications
+                    WHERE user_id = changed.user_id AND is_read = false
+                )
+            )::text
+        );
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notifications_insert_notify ON t_p71176016_tour_booking_platfor.notifications;
+DROP TRIGGER IF EXISTS trg_notifications_update_notify ON t_p71176016_tour_booking_platfor.notifications;
+
+CREATE TRIGGER trg_notifications_insert_notify
+AFTER INSERT ON t_p71176016_tour_booking_platfor.notifications
+REFERENCING NEW TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p71176016_tour_booking_platfor.notify_notifications_changed();
+
+CREATE TRIGGER trg_notifications_update_notify
+AFTER UPDATE ON t_p71176016_tour_booking_platfor.notifications
+REFERENCING NEW TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p71176016_tour_booking_platfor.notify_notifications_changed();
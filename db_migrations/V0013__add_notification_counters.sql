@@ -0,0 +1,104 @@
+-- Материализованный счётчик непрочитанных уведомлений на пользователя
+CREATE TABLE IF NOT EXISTS t_p71176016_tour_booking_platfor.notification_counters (
+    user_id INTEGER PRIMARY KEY REFERENCES t_p71176016_tour_booking_platfor.users(id),
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_notifications_user_id_unread
+ON t_p71176016_tour_booking_platfor.notifications (user_id)
+WHERE is_read = false;
+
+INSERT INTO t_p71176016_tour_booking_platfor.notification_counters (user_id, unread_count)
+SELECT user_id, COUNT(*)
+FROM t_p71176016_tour_booking_platfor.notifications
+WHERE is_read = false AND user_id IS NOT NULL
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET unread_count = EXCLUDED.unread_count, updated_at = CURRENT_TIMESTAMP;
+
+-- Счётчик обновляется в той же транзакции, что и вставка/изменение уведомлений
+CREATE OR REPLACE FUNCTION t_p71176016_tour_booking_platfor.apply_notification_counter_deltas()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO t_p71176016_tour_booking_platfor.notification_counters (user_id, unread_count)
+        SELECT user_id, COUNT(*) FROM new_rows
+        WHERE is_read IS NOT TRUE AND user_id IS NOT NULL
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET unread_count = notification_counters.unread_count + EXCLUDED.unread_count,
+            updated_at = CURRENT_TIMESTAMP;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO t_p71176016_tour_booking_platfor.notification_counters (user_id, unread_count)
+        SELECT d.user_id, d.delta
+        FROM (
+            SELECT n.user_id,
+                   SUM((n.is_read IS NOT TRUE)::int - (o.is_read IS NOT TRUE)::int) AS delta
+            FROM new_rows n
+            JOIN old_rows o ON o.id = n.id
+            WHERE n.user_id IS NOT NULL
+            GROUP BY n.user_id
+        ) d
+        WHERE d.delta <> 0
+        ON CONFLICT (user_id) DO UPDATE
+        SET unread_count = GREATEST(notification_counters.unread_count + EXCLUDED.unread_count, 0),
+            updated_at = CURRENT_TIMESTAMP;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE t_p71176016_tour_booking_platfor.notification_counters c
+        SET unread_count = GREATEST(c.unread_count - d.removed, 0),
+            updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT user_id, COUNT(*) AS removed FROM old_rows
+            WHERE is_read IS NOT TRUE AND user_id IS NOT NULL
+            GROUP BY user_id
+        ) d
+        WHERE c.user_id = d.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Имена триггеров сортируются раньше trg_notifications_*_notify, поэтому
+-- NOTIFY из V0012 уже видит обновлённый счётчик
+DROP TRIGGER IF EXISTS trg_notifications_counter_insert ON t_p71176016_tour_booking_platfor.notifications;
+DROP TRIGGER IF EXISTS trg_notifications_counter_update ON t_p71176016_tour_booking_platfor.notifications;
+DROP TRIGGER IF EXISTS trg_notifications_counter_delete ON t_p71176016_tour_booking_platfor.notifications;
+
+CREATE TRIGGER trg_notifications_counter_insert
+AFTER INSERT ON t_p71176016_tour_booking_platfor.notifications
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p71176016_tour_booking_platfor.apply_notification_counter_deltas();
+
+CREATE TRIGGER trg_notifications_counter_update
+AFTER UPDATE ON t_p71176016_tour_booking_platfor.notifications
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p71176016_tour_booking_platfor.apply_notification_counter_deltas();
+
+CREATE TRIGGER trg_notifications_counter_delete
+AFTER DELETE ON t_p71176016_tour_booking_platfor.notifications
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION t_p71176016_tour_booking_platfor.apply_notification_counter_deltas();
+
+-- NOTIFY берёт счётчик из таблицы вместо COUNT(*)
+CREATE OR REPLACE FUNCTION t_p71176016_tour_booking_platfor.notify_notifications_changed()
+RETURNS trigger AS $$
+DECLARE
+    changed RECORD;
+BEGIN
+    FOR changed IN
+        SELECT user_id, MAX(id) AS last_id FROM changed_rows GROUP BY user_id
+    LOOP
+        PERFORM pg_notify(
+            'notifications_user_' || changed.user_id,
+            json_build_object(
+                'last_id', changed.last_id,
+                'unread_count', COALESCE((
+                    SELECT unread_count FROM t_p71176016_tour_booking_platfor.notification_counters
+                    WHERE user_id = changed.user_id
+                ), 0)
+            )::text
+        );
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,19 @@
+-- Остатки мест по (тур, дата): бронирование резервирует места атомарным
+-- условным UPDATE, поэтому параллельные запросы не могут превысить capacity
+CREATE TABLE IF NOT EXISTS t_p71176016_tour_booking_platfor.tour_availability (
+    tour_id INTEGER NOT NULL REFERENCES t_p71176016_tour_booking_platfor.tours(id),
+    date DATE NOT NULL,
+    capacity INTEGER NOT NULL,
+    reserved INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (tour_id, date)
+);
+
+-- Перенос уже существующих активных бронирований
+INSERT INTO t_p71176016_tour_booking_platfor.tour_availability (tour_id, date, capacity, reserved)
+SELECT b.tour_id, b.booking_date, COALESCE(t.max_guests, 8), SUM(b.guests_count)
+FROM t_p71176016_tour_booking_platfor.bookings b
+JOIN t_p71176016_tour_booking_platfor.tours t ON t.id = b.tour_id
+WHERE b.status IN ('pending', 'confirmed')
+GROUP BY b.tour_id, b.booking_date, t.max_guests
+ON CONFLICT (tour_id, date) DO UPDATE SET reserved = EXCLUDED.reserved, updated_at = CURRENT_TIMESTAMP;
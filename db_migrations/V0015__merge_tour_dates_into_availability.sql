@@ -0,0 +1,7 @@
+-- tour_availability становится единственным источником остатков мест:
+-- расписанные в tour_dates даты переносятся с их вместимостью
+INSERT INTO t_p71176016_tour_booking_platfor.tour_availability (tour_id, date, capacity, reserved)
+SELECT td.tour_id, td.date, td.available_slots, 0
+FROM t_p71176016_tour_booking_platfor.tour_dates td
+WHERE td.tour_id IS NOT NULL
+ON CONFLICT (tour_id, date) DO NOTHING;
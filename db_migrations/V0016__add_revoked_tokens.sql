@@ -0,0 +1,10 @@
+-- Отозванные токены (logout): функции держат этот список в памяти
+-- и перечитывают его не чаще раза в REVOKED_TOKENS_TTL секунд
+CREATE TABLE IF NOT EXISTS t_p71176016_tour_booking_platfor.revoked_tokens (
+    jti VARCHAR(64) PRIMARY KEY,
+    expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at
+    ON t_p71176016_tour_booking_platfor.revoked_tokens (expires_at);
@@ -0,0 +1,7 @@
+-- Общие счётчики ограничения частоты запросов (RATE_LIMIT_BACKEND=postgres).
+-- Ведро токенов хранится как теоретическое время следующего запроса (GCRA):
+-- строки с tat в прошлом равносильны полному ведру, их можно удалять в любой момент
+CREATE TABLE IF NOT EXISTS t_p71176016_tour_booking_platfor.rate_limit_buckets (
+    key VARCHAR(255) PRIMARY KEY,
+    tat DOUBLE PRECISION NOT NULL
+);
@@ -0,0 +1,20 @@
+-- Возобновляемая загрузка изображений частями: сессия хранит ожидаемый размер
+-- и сколько байт уже принято, части лежат отдельно до вызова finish
+CREATE TABLE IF NOT EXISTS t_p71176016_tour_booking_platfor.upload_sessions (
+    id UUID PRIMARY KEY,
+    filename VARCHAR(255) NOT NULL,
+    total_size BIGINT NOT NULL,
+    received_size BIGINT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS t_p71176016_tour_booking_platfor.upload_chunks (
+    upload_id UUID NOT NULL REFERENCES t_p71176016_tour_booking_platfor.upload_sessions(id) ON DELETE CASCADE,
+    chunk_offset BIGINT NOT NULL,
+    data BYTEA NOT NULL,
+    PRIMARY KEY (upload_id, chunk_offset)
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires_at
+    ON t_p71176016_tour_booking_platfor.upload_sessions (expires_at);
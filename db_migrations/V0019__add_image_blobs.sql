@@ -0,0 +1,10 @@
+-- Контентно-адресуемое хранилище изображений: один объект на SHA-256,
+-- upload_count > 1 означает, что повторные загрузки не записывали байты заново
+CREATE TABLE IF NOT EXISTS t_p71176016_tour_booking_platfor.image_blobs (
+    hash CHAR(64) PRIMARY KEY,
+    size BIGINT NOT NULL,
+    content_type VARCHAR(50) NOT NULL,
+    upload_count INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
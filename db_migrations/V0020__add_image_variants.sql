@@ -0,0 +1,15 @@
+-- Производные размеры изображений (thumb/card/hero в WebP и JPEG)
+ALTER TABLE t_p71176016_tour_booking_platfor.image_blobs
+ADD COLUMN IF NOT EXISTS variants JSONB;
+
+ALTER TABLE t_p71176016_tour_booking_platfor.tours
+ADD COLUMN IF NOT EXISTS image_variants JSONB;
+
+-- Очередь перекодирования: строка живёт, пока варианты не сохранены;
+-- зависшие задачи повторно забирает action=process_variants
+CREATE TABLE IF NOT EXISTS t_p71176016_tour_booking_platfor.image_variant_jobs (
+    hash CHAR(64) PRIMARY KEY,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_attempt_at TIMESTAMP
+);
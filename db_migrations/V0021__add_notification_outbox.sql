@@ -0,0 +1,29 @@
+-- Транзакционный outbox уведомлений: пишется в той же транзакции, что и бронирование/сообщение,
+-- переносится в notifications фоновым воркером или action=process_outbox
+CREATE TABLE IF NOT EXISTS t_p71176016_tour_booking_platfor.notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    type VARCHAR(50) NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    message TEXT NOT NULL,
+    link TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Доставка во внешние каналы (email, telegram) с повторами и экспоненциальной задержкой
+CREATE TABLE IF NOT EXISTS t_p71176016_tour_booking_platfor.notification_deliveries (
+    id BIGSERIAL PRIMARY KEY,
+    notification_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    channel VARCHAR(20) NOT NULL CHECK (channel IN ('email', 'telegram')),
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    sent_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_notification_deliveries_due
+ON t_p71176016_tour_booking_platfor.notification_deliveries (next_attempt_at)
+WHERE status = 'pending';
@@ -0,0 +1,23 @@
+-- Составные и частичные индексы под реальные формы запросов обработчиков
+
+-- Бронирования клиента: WHERE client_id = ? ORDER BY booking_date DESC
+CREATE INDEX IF NOT EXISTS idx_bookings_client_id_booking_date
+ON t_p71176016_tour_booking_platfor.bookings (client_id, booking_date DESC);
+
+-- Сверка остатков мест: активные бронирования по (tour_id, booking_date), без обращения к таблице
+CREATE INDEX IF NOT EXISTS idx_bookings_active_tour_id_booking_date
+ON t_p71176016_tour_booking_platfor.bookings (tour_id, booking_date) INCLUDE (guests_count)
+WHERE status IN ('pending', 'confirmed');
+
+-- Лента уведомлений: WHERE user_id = ? ORDER BY created_at DESC LIMIT 50
+CREATE INDEX IF NOT EXISTS idx_notifications_user_id_created_at
+ON t_p71176016_tour_booking_platfor.notifications (user_id, created_at DESC);
+
+-- Догрузка новых уведомлений: WHERE user_id = ? AND id > ? ORDER BY id ASC LIMIT 50
+CREATE INDEX IF NOT EXISTS idx_notifications_user_id_id
+ON t_p71176016_tour_booking_platfor.notifications (user_id, id);
+
+-- Список городов каталога: активные туры, GROUP BY city
+CREATE INDEX IF NOT EXISTS idx_tours_active_city
+ON t_p71176016_tour_booking_platfor.tours (city) INCLUDE (price)
+WHERE status = 'active';
@@ -0,0 +1,16 @@
+-- Outbox переносится в notifications одним INSERT ... SELECT на пачку, поэтому
+-- строка, нарушающая ограничения notifications, откатывала бы каждую следующую пачку.
+-- Те же ограничения проверяются уже при записи в outbox, в транзакции отправителя.
+DELETE FROM t_p71176016_tour_booking_platfor.notification_outbox o
+WHERE o.type NOT IN ('booking', 'message', 'review', 'system')
+   OR NOT EXISTS (
+       SELECT 1 FROM t_p71176016_tour_booking_platfor.users u WHERE u.id = o.user_id
+   );
+
+ALTER TABLE t_p71176016_tour_booking_platfor.notification_outbox
+ADD CONSTRAINT notification_outbox_type_check
+CHECK (type IN ('booking', 'message', 'review', 'system'));
+
+ALTER TABLE t_p71176016_tour_booking_platfor.notification_outbox
+ADD CONSTRAINT notification_outbox_user_id_fkey
+FOREIGN KEY (user_id) REFERENCES t_p71176016_tour_booking_platfor.users(id) ON DELETE CASCADE;
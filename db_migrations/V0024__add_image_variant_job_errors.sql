@@ -0,0 +1,3 @@
+-- Последняя ошибка перекодирования, чтобы упавшие задачи было видно без логов функции
+ALTER TABLE t_p71176016_tour_booking_platfor.image_variant_jobs
+ADD COLUMN IF NOT EXISTS last_error TEXT;
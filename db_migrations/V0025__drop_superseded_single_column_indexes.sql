@@ -0,0 +1,21 @@
+-- Одноколоночные индексы, которые заменены составными из V0022.
+-- Применять после того, как scripts/explain_hot_queries.py прошёл на базе с V0022:
+-- каждая форма запроса ниже должна идти по указанному индексу, а не по удаляемому.
+
+-- bookings WHERE client_id = ? ORDER BY booking_date DESC -> idx_bookings_client_id_booking_date
+DROP INDEX IF EXISTS t_p71176016_tour_booking_platfor.idx_bookings_client_id;
+
+-- notifications WHERE user_id = ? ORDER BY created_at DESC -> idx_notifications_user_id_created_at,
+-- WHERE user_id = ? AND id > ? ORDER BY id ASC -> idx_notifications_user_id_id
+DROP INDEX IF EXISTS t_p71176016_tour_booking_platfor.idx_notifications_user_id;
+
+-- notifications WHERE user_id = ? AND is_read = false -> частичный idx_notifications_user_id_unread;
+-- сам по себе is_read не селективен
+DROP INDEX IF EXISTS t_p71176016_tour_booking_platfor.idx_notifications_is_read;
+
+-- chat_messages WHERE booking_id = ? [AND id > ?] ORDER BY id -> idx_chat_messages_booking_id_id
+DROP INDEX IF EXISTS t_p71176016_tour_booking_platfor.idx_chat_messages_booking_id;
+
+-- tours WHERE status = 'active' -> частичные idx_tours_active_created_at_id и idx_tours_active_city;
+-- других фильтров по status в обработчиках нет
+DROP INDEX IF EXISTS t_p71176016_tour_booking_platfor.idx_tours_status;
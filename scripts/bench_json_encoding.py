@@ -0,0 +1,106 @@
+'''
+Business: Microbenchmark for the response encoder (dumps_json) against the old dict-per-row path
+Args: --rows, --repeat, --number; orjson is used when importable
+Returns: best-of timings per strategy, after checking that all strategies decode to the same JSON
+
+dumps_json and _json_default are taken from backend/bookings/index.py itself,
+so the numbers always describe the code that ships. The module cannot simply be
+imported here because it needs psycopg2 and a database.
+
+    python scripts/bench_json_encoding.py --rows 1000 --repeat 5 --number 50
+'''
+
+import argparse
+import ast
+import json
+import os
+import random
+import timeit
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HANDLER_PATH = os.path.join(os.path.dirname(__file__), '..', 'backend', 'bookings', 'index.py')
+
+def load_encoder(use_orjson: bool) -> Callable[[Any], str]:
+    with open(HANDLER_PATH, encoding='utf-8') as source:
+        tree = ast.parse(source.read())
+    wanted = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name in ('_json_default', 'dumps_json')]
+    namespace: Dict[str, Any] = {
+        'json': json, 'Any': Any, 'Decimal': Decimal, 'date': date, 'datetime': datetime,
+        'orjson': orjson if use_orjson else None
+    }
+    exec(compile(ast.Module(body=wanted, type_ignores=[]), HANDLER_PATH, 'exec'), namespace)
+    return namespace['dumps_json']
+
+def user_booking_rows(count: int) -> List[Dict[str, Any]]:
+    """Rows shaped like the RealDictCursor result of bookings action=user_bookings."""
+    rng = random.Random(42)
+    created = datetime(2025, 1, 1, 12, 0, 0)
+    return [{
+        'id': i,
+        'tour_id': rng.randint(1, 200),
+        'tour_title': f'Экскурсия по старому городу №{i}',
+        'city': rng.choice(['Москва', 'Санкт-Петербург', 'Казань', 'Калининград']),
+        'image_url': f'https://images.example.com/images/{i:02x}/{i:064x}',
+        'guide_name': 'Анна Смирнова',
+        'guide_avatar': 'https://api.dicebear.com/7.x/avataaars/svg?seed=Anna',
+        'booking_date': date(2025, 6, 1) + timedelta(days=i % 120),
+        'guests_count': rng.randint(1, 8),
+        'total_price': Decimal(rng.randint(1000, 30000)) + Decimal('0.50'),
+        'status': rng.choice(['pending', 'confirmed', 'cancelled']),
+        'created_at': created + timedelta(minutes=i)
+    } for i in range(count)]
+
+def old_dict_per_row(rows: List[Dict[str, Any]]) -> str:
+    """What the handlers did before: copy every row, converting Decimal and dates by hand."""
+    return json.dumps({'bookings': [{
+        'id': row['id'],
+        'tour_id': row['tour_id'],
+        'tour_title': row['tour_title'],
+        'city': row['city'],
+        'image_url': row['image_url'],
+        'guide_name': row['guide_name'],
+        'guide_avatar': row['guide_avatar'],
+        'booking_date': row['booking_date'].isoformat() if row['booking_date'] else None,
+        'guests_count': row['guests_count'],
+        'total_price': float(row['total_price']),
+        'status': row['status'],
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None
+    } for row in rows]})
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=50)
+    args = parser.parse_args()
+
+    rows = user_booking_rows(args.rows)
+    strategies = {
+        'old dict-per-row + json.dumps': lambda: old_dict_per_row(rows),
+        'rows + dumps_json (stdlib)': lambda encode=load_encoder(False): encode({'bookings': rows})
+    }
+    if orjson is not None:
+        strategies['rows + dumps_json (orjson)'] = lambda encode=load_encoder(True): encode({'bookings': rows})
+    else:
+        print('orjson is not installed; only the stdlib paths are measured')
+
+    decoded = {name: json.loads(run()) for name, run in strategies.items()}
+    reference = next(iter(decoded.values()))
+    mismatched = [name for name, value in decoded.items() if value != reference]
+    if mismatched:
+        raise SystemExit(f'outputs differ: {", ".join(mismatched)}')
+
+    print(f'{args.rows} user_bookings-shaped rows, best of {args.repeat}x{args.number}')
+    for name, run in strategies.items():
+        best = min(timeit.repeat(run, repeat=args.repeat, number=args.number)) / args.number
+        print(f'  {name:<32} {best * 1000:6.2f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+Business: Concurrency check that parallel bookings never oversell a tour date
+Args: --bookings-url, --tours-url, --auth-url of a deployed (staging) stack, tour id and date
+Returns: exit code 0 when booked seats fit the seats that were free before the run, 1 otherwise
+
+Creates real bookings and a throwaway client account; do not point it at production.
+
+    python scripts/booking_oversell_check.py \\
+        --bookings-url https://functions.poehali.dev/<bookings> \\
+        --tours-url https://functions.poehali.dev/<tours> \\
+        --auth-url https://functions.poehali.dev/<auth> \\
+        --tour-id 1 --date 2026-12-15 --requests 40 --guests 2
+'''
+
+import argparse
+import json
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+def call(url: str, method: str = 'GET', body: Optional[Dict[str, Any]] = None,
+         token: Optional[str] = None) -> Tuple[int, Dict[str, Any]]:
+    headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        payload = e.read()
+        try:
+            return e.code, json.loads(payload or b'{}')
+        except ValueError:
+            return e.code, {'error': payload.decode(errors='replace')}
+
+def register_client(auth_url: str) -> str:
+    email = f'oversell-check-{int(time.time() * 1000)}@example.com'
+    status, payload = call(auth_url, 'POST', {
+        'action': 'register',
+        'name': 'Oversell check',
+        'email': email,
+        'password': f'check-{time.time_ns()}',
+        'role': 'client'
+    })
+    if status != 200 or 'token' not in payload:
+        raise SystemExit(f'could not register a test client: {status} {payload}')
+    return payload['token']
+
+def seats_free(tours_url: str, tour_id: int, booking_date: str) -> int:
+    query = urllib.parse.urlencode({
+        'action': 'availability',
+        'tour_id': tour_id,
+        'date_from': booking_date,
+        'date_to': booking_date
+    })
+    status, payload = call(f'{tours_url}?{query}')
+    if status != 200:
+        raise SystemExit(f'could not read availability: {status} {payload}')
+    return payload['availability'].get(booking_date, payload['max_guests'])
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bookings-url', required=True)
+    parser.add_argument('--tours-url', required=True)
+    parser.add_argument('--auth-url', required=True)
+    parser.add_argument('--tour-id', type=int, required=True)
+    parser.add_argument('--date', required=True, help='YYYY-MM-DD, ideally a date with no bookings yet')
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--guests', type=int, default=2)
+    args = parser.parse_args()
+
+    token = register_client(args.auth_url)
+    free_before = seats_free(args.tours_url, args.tour_id, args.date)
+
+    def book(_: int) -> Tuple[int, Dict[str, Any]]:
+        return call(args.bookings_url, 'POST', {
+            'tour_id': args.tour_id,
+            'booking_date': args.date,
+            'guests_count': args.guests,
+            'client_name': 'Oversell check'
+        }, token)
+
+    with ThreadPoolExecutor(max_workers=args.requests) as pool:
+        results = list(pool.map(book, range(args.requests)))
+
+    statuses = Counter(status for status, _ in results)
+    booked = statuses[201] * args.guests
+    print(f'seats free before: {free_before}')
+    print(f'responses: {dict(sorted(statuses.items()))}')
+    print(f'seats booked: {booked}')
+
+    unexpected = set(statuses) - {201, 409, 429}
+    if unexpected:
+        print(f'FAIL: unexpected statuses {sorted(unexpected)}')
+        return 1
+    if booked > free_before:
+        print(f'FAIL: oversold by {booked - free_before} seats')
+        return 1
+    if booked + args.guests <= free_before and statuses[409]:
+        print('FAIL: requests were rejected while seats were still free')
+        return 1
+    if statuses[429]:
+        print('note: some requests were rate limited; raise RATE_LIMIT_* on staging for a full run')
+    print('OK: no oversell')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+'''
+Business: Regression check that every hot handler query can be served by its index
+Args: DATABASE_URL of a local Postgres with db_migrations applied (the demo data is enough)
+Returns: exit code 0 when no hot query plans a sequential scan, 1 otherwise
+
+Demo tables are tiny, and on them the planner picks a sequential scan even when a
+perfect index exists. The check therefore turns enable_seqscan off: a Seq Scan
+that survives means no index can serve that query shape. Each query is also
+expected to use the index that was added for it.
+
+    DATABASE_URL=postgresql://localhost/tours python scripts/explain_hot_queries.py
+'''
+
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Tuple
+
+import psycopg2
+
+SCHEMA = 't_p71176016_tour_booking_platfor'
+
+# (handler, acceptable indexes, SQL in the shape the handler sends, params)
+HOT_QUERIES: List[Tuple[str, Tuple[str, ...], str, Tuple[Any, ...]]] = [
+    ('tours catalog page', ('idx_tours_active_created_at_id',), '''
+        SELECT t.id FROM tours t
+        WHERE t.status = 'active'
+        ORDER BY t.created_at DESC, t.id DESC
+        LIMIT 21
+    ''', ()),
+    ('tours cities', ('idx_tours_active_city',), '''
+        SELECT city, COUNT(*), MIN(price), MAX(price)
+        FROM tours
+        WHERE status = 'active'
+        GROUP BY city
+        ORDER BY city
+    ''', ()),
+    ('tours availability', ('tour_availability_pkey',), '''
+        SELECT date, GREATEST(capacity - reserved, 0)
+        FROM tour_availability
+        WHERE tour_id = %s AND date >= CURRENT_DATE
+        ORDER BY date
+    ''', (1,)),
+    ('tours reconcile: active bookings per date', ('idx_bookings_active_tour_id_booking_date',), '''
+        SELECT 1 FROM bookings b
+        WHERE b.tour_id = %s
+          AND b.booking_date = CURRENT_DATE
+          AND b.status IN ('pending', 'confirmed')
+    ''', (1,)),
+    ('bookings user_bookings', ('idx_bookings_client_id_booking_date',), '''
+        SELECT b.id FROM bookings b
+        WHERE b.client_id = %s
+        ORDER BY b.booking_date DESC
+    ''', (3,)),
+    ('chat messages window', ('idx_chat_messages_booking_id_id',), '''
+        SELECT cm.id FROM chat_messages cm
+        WHERE cm.booking_id = %s AND cm.id > %s
+        ORDER BY cm.id ASC
+        LIMIT 51
+    ''', (1, 0)),
+    ('chat messages latest', ('idx_chat_messages_booking_id_id',), '''
+        SELECT cm.id FROM chat_messages cm
+        WHERE cm.booking_id = %s
+        ORDER BY cm.id DESC
+        LIMIT 51
+    ''', (1,)),
+    ('chat notifications feed', ('idx_notifications_user_id_created_at',), '''
+        SELECT id FROM notifications
+        WHERE user_id = %s
+        ORDER BY created_at DESC
+        LIMIT 50
+    ''', (3,)),
+    ('chat notifications since id', ('idx_notifications_user_id_id',), '''
+        SELECT id FROM notifications
+        WHERE user_id = %s AND id > %s
+        ORDER BY id ASC
+        LIMIT 50
+    ''', (3, 0)),
+    ('chat mark_all_read', ('idx_notifications_user_id_unread', 'idx_notifications_user_id_id', 'idx_notifications_user_id_created_at'), '''
+        UPDATE notifications SET is_read = true WHERE user_id = %s AND is_read = false
+    ''', (3,)),
+    ('chat due deliveries', ('idx_notification_deliveries_due',), '''
+        SELECT id FROM notification_deliveries
+        WHERE status = 'pending' AND next_attempt_at <= NOW()
+        ORDER BY next_attempt_at
+        LIMIT 50
+    ''', ()),
+    ('auth login', ('users_email_key',), '''
+        SELECT id, password_hash FROM users WHERE email = %s
+    ''', ('anna@example.com',)),
+]
+
+def plan_nodes(node: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+def check(cursor, sql: str, params: Tuple[Any, ...]) -> Tuple[List[str], List[str]]:
+    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+    nodes = list(plan_nodes(cursor.fetchone()[0][0]['Plan']))
+    seq_scans = [node['Relation Name'] for node in nodes if node['Node Type'] == 'Seq Scan']
+    indexes = [node['Index Name'] for node in nodes if 'Index Name' in node]
+    return seq_scans, indexes
+
+def main() -> int:
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        print('DATABASE_URL is not set')
+        return 2
+
+    conn = psycopg2.connect(dsn)
+    cursor = conn.cursor()
+    cursor.execute(f'SET search_path TO {SCHEMA}, public')
+    cursor.execute('ANALYZE')
+    cursor.execute('SET enable_seqscan = off')
+
+    failures = 0
+    for name, expected_indexes, sql, params in HOT_QUERIES:
+        seq_scans, indexes = check(cursor, sql, params)
+        if seq_scans:
+            failures += 1
+            print(f'FAIL {name}: sequential scan on {", ".join(seq_scans)}')
+        elif not set(expected_indexes) & set(indexes):
+            failures += 1
+            print(f'FAIL {name}: expected {" or ".join(expected_indexes)}, plan uses {", ".join(indexes) or "no index"}')
+        else:
+            print(f'ok   {name}: {", ".join(indexes)}')
+
+    conn.rollback()
+    conn.close()
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,23 +20,37 @@ export default function ChatWidget({ bookingId, currentUserId, currentUserName,
   const [isLoading, setIsLoading] = useState(false);
   const scrollRef = useRef<HTMLDivElement>(null);
 
-  const loadMessages = async () => {
-    try {
-      const data = await chatApi.getMessages(bookingId, currentUserId);
-      setMessages(data);
-    } catch (error) {
-      console.error('Failed to load messages:', error);
-    }
-  };
-
   useEffect(() => {
-    loadMessages();
-    
-    const interval = setInterval(() => {
-      loadMessages();
-    }, 5000);
+    let cancelled = false;
+    setMessages([]);
+
+    const watch = async () => {
+      let afterId: number | undefined;
+      while (!cancelled) {
+        try {
+          const data = await chatApi.getMessages(bookingId, { afterId, wait: afterId === undefined ? 0 : 25 });
+          if (cancelled) break;
+          if (data.length > 0) {
+            afterId = data[data.length - 1].id;
+            setMessages(prev => {
+              const seen = new Set(prev.map(m => m.id));
+              return [...prev, ...data.filter(m => !seen.has(m.id))];
+            });
+          } else if (afterId === undefined) {
+            afterId = 0;
+          }
+        } catch (error) {
+          console.error('Failed to load messages:', error);
+          await new Promise(resolve => setTimeout(resolve, 10000));
+        }
+      }
+    };
+
+    watch();
 
-    return () => clearInterval(interval);
+    return () => {
+      cancelled = true;
+    };
   }, [bookingId, currentUserId]);
 
   useEffect(() => {
@@ -50,9 +64,8 @@ export default function ChatWidget({ bookingId, currentUserId, currentUserName,
 
     setIsLoading(true);
     try {
-      await chatApi.sendMessage(bookingId, currentUserId, newMessage.trim());
+      await chatApi.sendMessage(bookingId, newMessage.trim());
       setNewMessage('');
-      await loadMessages();
     } catch (error) {
       console.error('Failed to send message:', error);
     } finally {
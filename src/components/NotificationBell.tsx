@@ -24,10 +24,10 @@ export default function NotificationBell({ userId }: NotificationBellProps) {
 
   const loadNotifications = async () => {
     try {
-      const data = await chatApi.getNotifications(userId);
+      const data = await chatApi.getNotifications();
       setNotifications(data);
       
-      const count = await chatApi.getUnreadCount(userId);
+      const count = await chatApi.getUnreadCount();
       setUnreadCount(count);
     } catch (error) {
       console.error('Failed to load notifications:', error);
@@ -35,13 +35,34 @@ export default function NotificationBell({ userId }: NotificationBellProps) {
   };
 
   useEffect(() => {
-    loadNotifications();
-    
-    const interval = setInterval(() => {
-      loadNotifications();
-    }, 10000);
+    let cancelled = false;
 
-    return () => clearInterval(interval);
+    const watch = async () => {
+      let sinceId: number | undefined;
+      while (!cancelled) {
+        try {
+          const data = await chatApi.watchNotifications(sinceId, sinceId === undefined ? 0 : 25);
+          if (cancelled) break;
+          if (sinceId === undefined) {
+            setNotifications(data.notifications);
+          } else if (data.notifications.length > 0) {
+            setNotifications(prev => [...[...data.notifications].reverse(), ...prev].slice(0, 50));
+          }
+          setUnreadCount(data.unread_count);
+          const ids = data.notifications.map(n => n.id);
+          sinceId = Math.max(sinceId ?? 0, ...ids);
+        } catch (error) {
+          console.error('Failed to watch notifications:', error);
+          await new Promise(resolve => setTimeout(resolve, 10000));
+        }
+      }
+    };
+
+    watch();
+
+    return () => {
+      cancelled = true;
+    };
   }, [userId]);
 
   const handleMarkAsRead = async (notificationId: number) => {
@@ -55,7 +76,7 @@ export default function NotificationBell({ userId }: NotificationBellProps) {
 
   const handleMarkAllAsRead = async () => {
     try {
-      await chatApi.markAllAsRead(userId);
+      await chatApi.markAllAsRead();
       await loadNotifications();
     } catch (error) {
       console.error('Failed to mark all as read:', error);
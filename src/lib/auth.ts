@@ -1,3 +1,5 @@
+const AUTH_API_URL = 'https://functions.poehali.dev/ef197ae1-9fe2-4462-8cf1-06214e5d2355';
+
 export interface User {
   id: number;
   name: string;
@@ -16,11 +18,29 @@ export const getUser = (): User | null => {
   }
 };
 
+export const getAuthToken = (): string | null => {
+  return localStorage.getItem('authToken');
+};
+
+export const authHeaders = (): Record<string, string> => {
+  const token = getAuthToken();
+  return token ? { Authorization: `Bearer ${token}` } : {};
+};
+
 export const isAuthenticated = (): boolean => {
   return getUser() !== null;
 };
 
 export const logout = (): void => {
+  const token = getAuthToken();
+  if (token) {
+    fetch(AUTH_API_URL, {
+      method: 'POST',
+      keepalive: true,
+      headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${token}` },
+      body: JSON.stringify({ action: 'logout' })
+    }).catch(() => undefined);
+  }
   localStorage.removeItem('user');
   localStorage.removeItem('authToken');
 };
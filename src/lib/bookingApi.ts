@@ -1,3 +1,5 @@
+import { authHeaders } from './auth';
+
 const BOOKING_API_URL = 'https://functions.poehali.dev/2b4d691b-a242-40f0-ab27-cee036ce7a7c';
 
 export interface TourDate {
@@ -22,7 +24,6 @@ export interface Booking {
 
 export interface CreateBookingRequest {
   tour_id: number;
-  client_id: number;
   booking_date: string;
   guests_count: number;
   client_name: string;
@@ -48,11 +49,9 @@ export const bookingApi = {
     return data.dates || [];
   },
 
-  async getUserBookings(userId: number): Promise<Booking[]> {
+  async getUserBookings(): Promise<Booking[]> {
     const response = await fetch(`${BOOKING_API_URL}?action=user_bookings`, {
-      headers: {
-        'X-User-Id': String(userId)
-      }
+      headers: authHeaders()
     });
     
     if (!response.ok) {
@@ -67,7 +66,8 @@ export const bookingApi = {
     const response = await fetch(BOOKING_API_URL, {
       method: 'POST',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        ...authHeaders()
       },
       body: JSON.stringify(bookingData)
     });
@@ -84,7 +84,8 @@ export const bookingApi = {
     const response = await fetch(BOOKING_API_URL, {
       method: 'PUT',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        ...authHeaders()
       },
       body: JSON.stringify({
         booking_id: bookingId,
@@ -101,7 +102,8 @@ export const bookingApi = {
     const response = await fetch(BOOKING_API_URL, {
       method: 'PUT',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        ...authHeaders()
       },
       body: JSON.stringify({
         booking_id: bookingId,
@@ -1,3 +1,5 @@
+import { authHeaders } from './auth';
+
 const CHAT_API_URL = 'https://functions.poehali.dev/35949772-9ec1-4eb2-9d6e-8bdfba2d3323';
 
 export interface ChatMessage {
@@ -21,15 +23,23 @@ export interface Notification {
   created_at: string;
 }
 
+export interface MessagesWindow {
+  afterId?: number;
+  beforeId?: number;
+  limit?: number;
+  wait?: number;
+}
+
 export const chatApi = {
-  async getMessages(bookingId: number, userId?: number): Promise<ChatMessage[]> {
-    const headers: Record<string, string> = {};
-    if (userId) {
-      headers['X-User-Id'] = String(userId);
-    }
+  async getMessages(bookingId: number, window?: MessagesWindow): Promise<ChatMessage[]> {
+    const params = new URLSearchParams({ action: 'messages', booking_id: String(bookingId) });
+    if (window?.afterId !== undefined) params.append('after_id', String(window.afterId));
+    if (window?.beforeId) params.append('before_id', String(window.beforeId));
+    if (window?.limit) params.append('limit', String(window.limit));
+    if (window?.wait) params.append('wait', String(window.wait));
 
-    const response = await fetch(`${CHAT_API_URL}?action=messages&booking_id=${bookingId}`, {
-      headers
+    const response = await fetch(`${CHAT_API_URL}?${params.toString()}`, {
+      headers: authHeaders()
     });
     
     if (!response.ok) {
@@ -40,15 +50,15 @@ export const chatApi = {
     return data.messages || [];
   },
 
-  async sendMessage(bookingId: number, senderId: number, message: string): Promise<void> {
+  async sendMessage(bookingId: number, message: string): Promise<void> {
     const response = await fetch(`${CHAT_API_URL}?action=send_message`, {
       method: 'POST',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        ...authHeaders()
       },
       body: JSON.stringify({
         booking_id: bookingId,
-        sender_id: senderId,
         message
       })
     });
@@ -58,11 +68,9 @@ export const chatApi = {
     }
   },
 
-  async getNotifications(userId: number): Promise<Notification[]> {
+  async getNotifications(): Promise<Notification[]> {
     const response = await fetch(`${CHAT_API_URL}?action=notifications`, {
-      headers: {
-        'X-User-Id': String(userId)
-      }
+      headers: authHeaders()
     });
     
     if (!response.ok) {
@@ -73,11 +81,9 @@ export const chatApi = {
     return data.notifications || [];
   },
 
-  async getUnreadCount(userId: number): Promise<number> {
+  async getUnreadCount(): Promise<number> {
     const response = await fetch(`${CHAT_API_URL}?action=unread_count`, {
-      headers: {
-        'X-User-Id': String(userId)
-      }
+      headers: authHeaders()
     });
     
     if (!response.ok) {
@@ -88,11 +94,35 @@ export const chatApi = {
     return data.unread_count || 0;
   },
 
+  async watchNotifications(
+    sinceId?: number,
+    wait?: number
+  ): Promise<{ notifications: Notification[]; unread_count: number }> {
+    const params = new URLSearchParams({ action: 'watch_notifications' });
+    if (sinceId !== undefined) params.append('since_id', String(sinceId));
+    if (wait) params.append('wait', String(wait));
+
+    const response = await fetch(`${CHAT_API_URL}?${params.toString()}`, {
+      headers: authHeaders()
+    });
+    
+    if (!response.ok) {
+      throw new Error('Failed to watch notifications');
+    }
+    
+    const data = await response.json();
+    return {
+      notifications: data.notifications || [],
+      unread_count: data.unread_count || 0
+    };
+  },
+
   async markAsRead(notificationId: number): Promise<void> {
     const response = await fetch(`${CHAT_API_URL}?action=mark_read`, {
       method: 'PUT',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        ...authHeaders()
       },
       body: JSON.stringify({
         notification_id: notificationId
@@ -104,12 +134,10 @@ export const chatApi = {
     }
   },
 
-  async markAllAsRead(userId: number): Promise<void> {
+  async markAllAsRead(): Promise<void> {
     const response = await fetch(`${CHAT_API_URL}?action=mark_all_read`, {
       method: 'PUT',
-      headers: {
-        'X-User-Id': String(userId)
-      }
+      headers: authHeaders()
     });
     
     if (!response.ok) {
@@ -127,7 +155,8 @@ export const chatApi = {
     const response = await fetch(`${CHAT_API_URL}?action=create_notification`, {
       method: 'POST',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        ...authHeaders()
       },
       body: JSON.stringify({
         user_id: userId,
@@ -141,5 +170,64 @@ export const chatApi = {
     if (!response.ok) {
       throw new Error('Failed to create notification');
     }
+  },
+
+  async createNotifications(
+    userIds: number[],
+    type: 'booking' | 'message' | 'review' | 'system',
+    title: string,
+    message: string,
+    link?: string
+  ): Promise<number> {
+    const response = await fetch(`${CHAT_API_URL}?action=create_notification`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        ...authHeaders()
+      },
+      body: JSON.stringify({
+        user_ids: userIds,
+        type,
+        title,
+        message,
+        link
+      })
+    });
+    
+    if (!response.ok) {
+      throw new Error('Failed to create notifications');
+    }
+    
+    const data = await response.json();
+    return data.queued;
+  },
+
+  async broadcast(
+    title: string,
+    message: string,
+    role?: 'client' | 'guide' | 'admin',
+    link?: string
+  ): Promise<number> {
+    const response = await fetch(`${CHAT_API_URL}?action=broadcast`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        ...authHeaders()
+      },
+      body: JSON.stringify({
+        role,
+        type: 'system',
+        title,
+        message,
+        link
+      })
+    });
+    
+    if (!response.ok) {
+      throw new Error('Failed to broadcast notification');
+    }
+    
+    const data = await response.json();
+    return data.queued;
   }
 };
@@ -1,3 +1,5 @@
+import { authHeaders } from './auth';
+
 const AUTH_API_URL = 'https://functions.poehali.dev/ef197ae1-9fe2-4462-8cf1-06214e5d2355';
 
 export interface UserProfile {
@@ -53,6 +55,7 @@ export const profileApi = {
       method: 'PUT',
       headers: {
         'Content-Type': 'application/json',
+        ...authHeaders(),
       },
       body: JSON.stringify(data),
     });
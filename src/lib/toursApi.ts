@@ -1,5 +1,21 @@
+import { authHeaders } from './auth';
+
 const TOURS_API_URL = 'https://functions.poehali.dev/4c1ca0b4-cf0f-45df-b42e-d029cfb0b520';
 
+export interface ImageVariant {
+  width: number;
+  height: number;
+  webp: string;
+  jpg: string;
+}
+
+export type ImageVariants = Record<'thumb' | 'card' | 'hero', ImageVariant>;
+
+export const variantSrcSet = (variants: ImageVariants, format: 'webp' | 'jpg'): string =>
+  Object.values(variants)
+    .map((variant) => `${variant[format]} ${variant.width}w`)
+    .join(', ');
+
 export interface Tour {
   id: number;
   title: string;
@@ -7,21 +23,30 @@ export interface Tour {
   price: number;
   duration: number;
   short_description: string;
-  full_description: string;
+  full_description?: string;
   image_url: string;
+  image_variants?: ImageVariants | null;
   rating: number;
   reviews_count: number;
   guide_name: string;
   guide_avatar: string;
   instant_booking: boolean;
+  relevance?: number;
+}
+
+export interface CatalogFacets {
+  cities: { city: string; count: number }[];
+  price: { min: number; max: number };
 }
 
 export interface ToursResponse {
   tours: Tour[];
   total: number;
+  total_mode: 'exact' | 'estimate' | 'cached';
   cities: string[];
+  facets: CatalogFacets;
   limit: number;
-  offset: number;
+  next_cursor: string | null;
 }
 
 export interface ToursFilters {
@@ -30,7 +55,9 @@ export interface ToursFilters {
   max_price?: number;
   search?: string;
   limit?: number;
-  offset?: number;
+  cursor?: string;
+  count_mode?: 'exact' | 'estimate' | 'cached';
+  fields?: string[];
 }
 
 export interface CreateTourData {
@@ -49,6 +76,32 @@ export interface CreateTourData {
   images?: string[];
 }
 
+export interface BatchAvailabilityResponse {
+  tours: Record<string, { max_guests: number; availability: Record<string, number> }>;
+}
+
+export interface TourDetail extends Omit<Tour, 'guide_name' | 'guide_avatar' | 'rating' | 'reviews_count' | 'relevance'> {
+  status: string;
+  max_guests: number;
+  guide: {
+    id: number;
+    name: string;
+    avatar_url: string | null;
+    bio: string | null;
+    city: string | null;
+    languages: string | null;
+    experience_years: number | null;
+    specialization: string | null;
+  };
+  rating_summary: {
+    rating: number;
+    reviews_count: number;
+    reviews_average: number;
+    distribution: Record<string, number>;
+  };
+  availability: Record<string, number>;
+}
+
 export const toursApi = {
   async getTours(filters?: ToursFilters): Promise<ToursResponse> {
     const params = new URLSearchParams();
@@ -59,7 +112,9 @@ export const toursApi = {
       if (filters.max_price) params.append('max_price', String(filters.max_price));
       if (filters.search) params.append('search', filters.search);
       if (filters.limit) params.append('limit', String(filters.limit));
-      if (filters.offset) params.append('offset', String(filters.offset));
+      if (filters.cursor) params.append('cursor', filters.cursor);
+      if (filters.count_mode) params.append('count_mode', filters.count_mode);
+      if (filters.fields) params.append('fields', filters.fields.join(','));
     }
     
     const url = params.toString() ? `${TOURS_API_URL}?${params.toString()}` : TOURS_API_URL;
@@ -73,6 +128,35 @@ export const toursApi = {
     return await response.json();
   },
 
+  async getTourDetail(tourId: number, dates?: number): Promise<TourDetail> {
+    const params = new URLSearchParams({ action: 'detail', id: String(tourId) });
+    if (dates !== undefined) params.append('dates', String(dates));
+    
+    const response = await fetch(`${TOURS_API_URL}?${params.toString()}`, {
+      headers: authHeaders()
+    });
+    
+    if (!response.ok) {
+      throw new Error('Failed to fetch tour');
+    }
+    
+    return await response.json();
+  },
+
+  async getAvailabilityBatch(tourIds: number[], dateFrom?: string, dateTo?: string): Promise<BatchAvailabilityResponse> {
+    const params = new URLSearchParams({ action: 'availability_batch', tour_ids: tourIds.join(',') });
+    if (dateFrom) params.append('date_from', dateFrom);
+    if (dateTo) params.append('date_to', dateTo);
+    
+    const response = await fetch(`${TOURS_API_URL}?${params.toString()}`);
+    
+    if (!response.ok) {
+      throw new Error('Failed to fetch availability');
+    }
+    
+    return await response.json();
+  },
+
   async createTour(tourData: CreateTourData): Promise<Tour> {
     const response = await fetch(TOURS_API_URL, {
       method: 'POST',
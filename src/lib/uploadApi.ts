@@ -1,48 +1,113 @@
+import { authHeaders } from './auth';
+
 const UPLOAD_API_URL = 'https://functions.poehali.dev/575c74cb-b97a-448b-b10a-c73b3b884705';
 
+const CHUNKED_UPLOAD_THRESHOLD = 3 * 1024 * 1024;
+const MAX_CHUNK_RETRIES = 3;
+
 export interface UploadResponse {
   url: string;
   filename: string;
   size: number;
+  hash: string;
+  deduplicated: boolean;
+}
+
+interface UploadSession {
+  upload_id: string;
+  size: number;
+  received: number;
+  chunk_size?: number;
 }
 
+const readError = async (response: Response, fallback: string): Promise<Error> => {
+  const errorData = await response.json().catch(() => ({}));
+  return new Error(errorData.error || fallback);
+};
+
 export const uploadApi = {
   async uploadImage(file: File): Promise<UploadResponse> {
-    const fileReader = new FileReader();
-    
-    return new Promise((resolve, reject) => {
-      fileReader.onloadend = async () => {
-        try {
-          const base64Content = fileReader.result as string;
-          
-          const uploadResponse = await fetch(UPLOAD_API_URL, {
-            method: 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-              image: base64Content,
-              filename: file.name
-            }),
-          });
-          
-          if (!uploadResponse.ok) {
-            const errorData = await uploadResponse.json();
-            throw new Error(errorData.error || 'Failed to upload image');
-          }
-          
-          const uploadResult = await uploadResponse.json();
-          resolve(uploadResult);
-        } catch (uploadError) {
-          reject(uploadError);
-        }
-      };
-      
-      fileReader.onerror = () => {
-        reject(new Error('Failed to read file'));
-      };
-      
-      fileReader.readAsDataURL(file);
+    if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+      return uploadApi.uploadImageInChunks(file);
+    }
+
+    const params = new URLSearchParams({ filename: file.name });
+    const uploadResponse = await fetch(`${UPLOAD_API_URL}?${params.toString()}`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': file.type || 'application/octet-stream',
+        ...authHeaders(),
+      },
+      body: file,
     });
+
+    if (!uploadResponse.ok) {
+      throw await readError(uploadResponse, 'Failed to upload image');
+    }
+
+    return await uploadResponse.json();
+  },
+
+  async uploadImageInChunks(file: File, uploadId?: string): Promise<UploadResponse> {
+    let session: UploadSession;
+
+    if (uploadId) {
+      const statusResponse = await fetch(`${UPLOAD_API_URL}?action=status&upload_id=${uploadId}`);
+      if (!statusResponse.ok) {
+        throw await readError(statusResponse, 'Failed to resume upload');
+      }
+      session = await statusResponse.json();
+    } else {
+      const startResponse = await fetch(`${UPLOAD_API_URL}?action=start`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', ...authHeaders() },
+        body: JSON.stringify({ filename: file.name, size: file.size }),
+      });
+      if (!startResponse.ok) {
+        throw await readError(startResponse, 'Failed to start upload');
+      }
+      session = await startResponse.json();
+    }
+
+    const chunkSize = Math.min(session.chunk_size || CHUNKED_UPLOAD_THRESHOLD, CHUNKED_UPLOAD_THRESHOLD);
+    let received = session.received;
+    let retries = 0;
+
+    while (received < file.size) {
+      const params = new URLSearchParams({
+        action: 'chunk',
+        upload_id: session.upload_id,
+        offset: String(received),
+      });
+      const chunkResponse = await fetch(`${UPLOAD_API_URL}?${params.toString()}`, {
+        method: 'PUT',
+        headers: { 'Content-Type': 'application/octet-stream', ...authHeaders() },
+        body: file.slice(received, received + chunkSize),
+      }).catch(() => null);
+
+      if (chunkResponse?.ok || chunkResponse?.status === 409) {
+        received = (await chunkResponse.json()).received;
+        retries = 0;
+        continue;
+      }
+
+      retries += 1;
+      if (retries > MAX_CHUNK_RETRIES) {
+        throw chunkResponse
+          ? await readError(chunkResponse, 'Failed to upload image chunk')
+          : new Error('Failed to upload image chunk');
+      }
+    }
+
+    const finishResponse = await fetch(`${UPLOAD_API_URL}?action=finish&upload_id=${session.upload_id}`, {
+      method: 'POST',
+      headers: authHeaders(),
+    });
+
+    if (!finishResponse.ok) {
+      throw await readError(finishResponse, 'Failed to finish upload');
+    }
+
+    return await finishResponse.json();
   }
-};
\ No newline at end of file
+};
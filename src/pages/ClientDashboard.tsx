@@ -8,6 +8,7 @@ import Icon from '@/components/ui/icon';
 import ChatWidget from '@/components/ChatWidget';
 import NotificationBell from '@/components/NotificationBell';
 import { profileApi } from '@/lib/profileApi';
+import { logout } from '@/lib/auth';
 import ClientSidebar from '@/components/client-dashboard/ClientSidebar';
 import BookingsTab from '@/components/client-dashboard/BookingsTab';
 import FavoritesTab from '@/components/client-dashboard/FavoritesTab';
@@ -83,8 +84,7 @@ export default function ClientDashboard() {
   }, [navigate]);
 
   const handleLogout = () => {
-    localStorage.removeItem('user');
-    localStorage.removeItem('authToken');
+    logout();
     navigate('/');
   };
 
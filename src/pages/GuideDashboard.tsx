@@ -20,6 +20,7 @@ import { bookingApi } from '@/lib/bookingApi';
 import { toursApi, CreateTourData } from '@/lib/toursApi';
 import { uploadApi } from '@/lib/uploadApi';
 import { profileApi } from '@/lib/profileApi';
+import { logout } from '@/lib/auth';
 import { useToast } from '@/hooks/use-toast';
 
 export default function GuideDashboard() {
@@ -117,8 +118,7 @@ export default function GuideDashboard() {
   }, [navigate]);
 
   const handleLogout = () => {
-    localStorage.removeItem('user');
-    localStorage.removeItem('authToken');
+    logout();
     navigate('/');
   };
 
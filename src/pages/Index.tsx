@@ -8,7 +8,7 @@ import { Accordion, AccordionContent, AccordionItem, AccordionTrigger } from '@/
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
 import { Slider } from '@/components/ui/slider';
 import Icon from '@/components/ui/icon';
-import { toursApi, Tour } from '@/lib/toursApi';
+import { toursApi, Tour, variantSrcSet } from '@/lib/toursApi';
 
 export default function Index() {
   const [searchQuery, setSearchQuery] = useState('');
@@ -239,11 +239,23 @@ export default function Index() {
                   <Link key={tour.id} to={`/tour/${tour.id}`}>
                     <Card className="overflow-hidden hover:shadow-xl transition-shadow group cursor-pointer">
                       <div className="relative h-64 overflow-hidden">
-                        <img 
-                          src={tour.image_url} 
-                          alt={tour.title}
-                          className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-300"
-                        />
+                        <picture>
+                          {tour.image_variants && (
+                            <source
+                              type="image/webp"
+                              srcSet={variantSrcSet(tour.image_variants, 'webp')}
+                              sizes="(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw"
+                            />
+                          )}
+                          <img 
+                            src={tour.image_variants?.card.jpg || tour.image_url} 
+                            srcSet={tour.image_variants ? variantSrcSet(tour.image_variants, 'jpg') : undefined}
+                            sizes="(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw"
+                            alt={tour.title}
+                            loading="lazy"
+                            className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-300"
+                          />
+                        </picture>
                         <Badge className="absolute top-4 right-4 bg-white text-foreground">
                           {formatDuration(tour.duration)}
                         </Badge>
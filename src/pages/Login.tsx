@@ -45,6 +45,7 @@ export default function Login() {
       const data = await response.json();
 
       localStorage.setItem('user', JSON.stringify(data.user));
+      localStorage.setItem('authToken', data.token);
 
       toast({
         title: 'Добро пожаловать!',
@@ -50,6 +50,7 @@ export default function Register() {
 
       const data = await response.json();
       localStorage.setItem('user', JSON.stringify(data.user));
+      localStorage.setItem('authToken', data.token);
 
       toast({
         title: 'Успешная регистрация!',
@@ -125,7 +125,6 @@ export default function TourDetail() {
       
       await bookingApi.createBooking({
         tour_id: tour.id,
-        client_id: 3,
         booking_date: bookingDate,
         guests_count: guestsCount,
         client_name: clientName,